@@ -17,14 +17,17 @@ import argparse
 import pandas as pd
 import numpy as np
 from functions import separate_attributes, rejoin_attributes
-from functions import empty_attributes, gvf_columns, vcf_columns
+from functions import empty_attributes, gvf_columns, gvf_attributes, \
+    vcf_columns
+from functions import load_annotation_index
 
 # Function to parse command line arguments
 def parse_args():
     parser = argparse.ArgumentParser(
         description='Adds functional annotation to a GVF file')
     parser.add_argument('--ingvf', type=str, default=None,
-                        help='Path to a GVF file')
+                        help='Path to a GVF file; if not given, only '
+                             '--annotation_index is created')
     parser.add_argument('--outgvf', type=str,
                         help='Filename for the output GVF file')
     parser.add_argument('--functional_annotations', type=str,
@@ -35,29 +38,34 @@ def parse_args():
                               "functional annotations to "
                               "this .txt filename for "
                               "troubleshooting purposes")
+    parser.add_argument('--annotation_index', type=str, default=None,
+                        help='Compiled index (.npz) of the functional '
+                             'annotations file, created if missing or '
+                             'older than --functional_annotations')
     return parser.parse_args()
 
 # Function to add Pokay annotations to GVF file
-def add_pokay_annotations(gvf, annotation_file):
-    
-    # expand #attributes into columns to fill in separately
-    gvf = separate_attributes(gvf)
+def add_pokay_annotations(gvf, annotation_file, expanded=False,
+                          annotation_index=None):
+    # if expanded=True, the GVF already has one column per attribute and
+    # is returned that way, instead of with a single '#attributes' column
+    # annotation_index is the compiled annotations file, created if
+    # missing or older than annotation_file
+    if not expanded:
+        # expand #attributes into columns to fill in separately
+        gvf = separate_attributes(gvf)
     
     # drop columns that are going to be re-added in the merge
     functional_attributes = ["function_category", "function_description", 
                              "source", "citation", "comb_mutation"]
     gvf = gvf.drop(columns=functional_attributes)
 
-    # load functional annotations spreadsheet
-    df = pd.read_csv(annotation_file, sep='\t', header=0)
-    # remove any leading/trailing spaces
-    for column in df.columns:
-        df[column] = df[column].astype(str).str.strip()
+    # look up the functional annotations of the GVF's mutations (from
+    # the compiled index if it is up to date)
+    df = load_annotation_index(annotation_file, annotation_index).lookup(
+        gvf['Name'], gvf['protein_symbol'])
 
     # merge annotated vcf and functional annotation files by 'Name' and 'protein_symbol'
-    df = df.rename(columns={"original mutation description": "Name", "amino acid mutation alias":"Pokay_alias", 'mutation functional effect category':"function_category", \
-                            'mutation functional effect description':"function_description", 'URL':"source", 'protein symbol':'protein_symbol'})
-    df['citation'] = df['author'] + ' et al. (' + df['publication year'].str.replace(".0", "", regex=False) + ')'
     merged_df = pd.merge(df, gvf, on=['Name', 'protein_symbol'], how='right') #, 'alias'
 
     # data cleaning
@@ -83,24 +91,20 @@ def add_pokay_annotations(gvf, annotation_file):
         "mutation_group"].str.replace(',,', ',')
     merged_df["mutation_group"] = merged_df[
         "mutation_group"].str.strip(',')
-    # sort each row alphabetically
-    # extract column into a list (each row is an element)
-    unsorted_group_list = merged_df["mutation_group"].tolist()
-    # convert each element of the list to a list, making a nested list
-    nested_list = [x.split(",") for x in unsorted_group_list]
-    # sort sublists alphabetically
-    nested_list = [sorted(x) for x in nested_list]
-    # return sublists to strings
-    sorted_group_list = [",".join(x) for x in nested_list]
-    # add sorted lists back to the df
-    merged_df["mutation_group"] = pd.Series(sorted_group_list)
-
-    # make another column to check if all members of the group are
-    # represented individually in 'Name' (True/False)
-    unique_Name_entries = set(merged_df['Name'].tolist())
-    group_fully_represented = [set(x).issubset(unique_Name_entries)
-                               for x in nested_list]
-    merged_df['group_fully_represented'] = group_fully_represented
+    # sort each row alphabetically, and make another column to check
+    # if all members of the group are represented individually in
+    # 'Name' (True/False); both are worked out once per distinct group
+    group_codes, groups = pd.factorize(merged_df["mutation_group"])
+    members = pd.Series(groups, dtype=object).str.split(",").explode()
+    members = members.rename("member").rename_axis("group").reset_index()
+    members = members.sort_values(by=["group", "member"], kind="mergesort")
+    sorted_groups = members.groupby("group")["member"].agg(",".join)
+    members["represented"] = members["member"].isin(
+        merged_df['Name'].unique())
+    fully_represented = members.groupby("group")["represented"].all()
+    merged_df["mutation_group"] = sorted_groups.to_numpy()[group_codes]
+    merged_df['group_fully_represented'] = \
+        fully_represented.to_numpy()[group_codes]
     # drop rows with mutation group members not found in 'Name',
     # leaving the index unchanged
     merged_df = merged_df[merged_df['group_fully_represented']==True]
@@ -117,6 +121,9 @@ def add_pokay_annotations(gvf, annotation_file):
     # replace NaNs in df with empty string
     merged_df = merged_df.fillna('')
 
+    if expanded:
+        return merged_df[gvf_columns + gvf_attributes]
+
     # merge attributes back into a single column
     merged_df = rejoin_attributes(merged_df, empty_attributes)
 
@@ -125,6 +132,16 @@ def add_pokay_annotations(gvf, annotation_file):
 if __name__ == '__main__':
 
     args = parse_args()
+
+    # without a GVF, compile the annotations file once, for the tasks
+    # annotating each GVF to share
+    if args.ingvf is None:
+        if args.annotation_index is None:
+            raise SystemExit("--annotation_index is required without --ingvf")
+        load_annotation_index(args.functional_annotations,
+                              args.annotation_index)
+        print("Saved as: ", args.annotation_index)
+        raise SystemExit(0)
     
     # read in gvf file
     gvf = pd.read_csv(args.ingvf, sep='\t', names=gvf_columns, index_col=False)
@@ -136,7 +153,9 @@ if __name__ == '__main__':
     gvf = gvf[~gvf['#seqid'].astype(str).str.contains("#")]
 
     # add functional annotations
-    pokay_annotated_gvf = add_pokay_annotations(gvf, args.functional_annotations)
+    pokay_annotated_gvf = add_pokay_annotations(
+        gvf, args.functional_annotations,
+        annotation_index=args.annotation_index)
 
     # add pragmas to df, then save to .gvf
     # columns are now 0, 1, ...
@@ -15,29 +15,34 @@ import argparse
 import pandas as pd
 import numpy as np
 from functions import separate_attributes, rejoin_attributes, get_variant_info
+from functions import load_lineage_resolver
 from functions import empty_attributes, gvf_columns, vcf_columns
 
 
-def add_variant_information(clade_file, gvf, strain):    
+def add_variant_information(clade_file, gvf, strain, expanded=False,
+                            clades_cache=None):
     # get variant info from clades file
 
-    # expand #attributes into columns to fill in separately
-    gvf = separate_attributes(gvf)
+    # if expanded=True, the GVF already has one column per attribute and
+    # is returned that way, instead of with a single '#attributes' column
+    if not expanded:
+        # expand #attributes into columns to fill in separately
+        gvf = separate_attributes(gvf)
     
     variant_attributes = ["variant", "variant_type", "voi_designation_date",
                    "voc_designation_date", "vum_designation_date",
                    "status"]
     
     if clade_file=='n/a':
-        gvf[[variant_attributes]] = "n/a"
+        gvf[variant_attributes] = "n/a"
     
     elif clade_file != 'n/a':
-        # load variant info file
-        clades = pd.read_csv(clade_file, sep='\t', header=0)
-        clades = clades.fillna('')
+        # load variant info file, compiled for lineage lookup
+        # (or from the cache file of an earlier run)
+        resolver = load_lineage_resolver(clade_file, clades_cache)
         
         # retrieve relevant variant information from clades file
-        x = get_variant_info(strain, clades)
+        x = get_variant_info(strain, resolver=resolver)
         
         # if the strain is listed in the file,
         # add variant attributes to the GVF
@@ -49,8 +54,11 @@ def add_variant_information(clade_file, gvf, strain):
             gvf["vum_designation_date"] = x.vum_designation_date
             gvf["status"] = x.status
         else:
-            gvf[[variant_attributes]] = "n/a"
-    
+            gvf[variant_attributes] = "n/a"
+
+    if expanded:
+        return gvf
+
     # merge attributes back into a single column
     gvf = rejoin_attributes(gvf, empty_attributes)
 
@@ -72,6 +80,9 @@ def parse_args():
     parser.add_argument('--clades', type=str, default='n/a',
                         help='TSV file of WHO strain names and '
                              'VOC/VOI status')
+    parser.add_argument('--clades_cache', type=str, default=None,
+                        help='Cache file of the compiled clades file, '
+                             'created if missing or older than --clades')
     return parser.parse_args()
 
  
@@ -90,7 +101,7 @@ if __name__ == '__main__':
         
     # add variant info
     variant_annotated_gvf = add_variant_information(
-        args.clades, gvf, args.strain)
+        args.clades, gvf, args.strain, clades_cache=args.clades_cache)
     
     # add pragmas to df, then save to .gvf
     # columns are now 0, 1, ...
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+
+This script benchmarks the GVF #attributes codec in functions.py
+(separate_attributes / rejoin_attributes) against the original
+row-wise implementation, on synthetic GVFs of increasing size.
+
+Both implementations are checked to produce identical columns and
+an identical rejoined #attributes column before timings are reported.
+
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from functions import separate_attributes, rejoin_attributes
+from functions import empty_attributes, gvf_columns
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks separate_attributes/rejoin_attributes')
+    parser.add_argument('--rows', type=int, nargs='*',
+                        default=[1000, 10000, 100000],
+                        help='GVF sizes (number of rows) to benchmark')
+    parser.add_argument('--legacy_max_rows', type=int, default=20000,
+                        help='Skip the original implementation above '
+                             'this many rows, as it is very slow')
+    return parser.parse_args()
+
+
+def legacy_separate_attributes(df):
+    # original implementation, kept here for comparison
+    attributes = df['#attributes'].str.split(pat=';').apply(pd.Series)
+    attributes = attributes.drop(labels=len(attributes.columns) - 1,
+                                 axis=1)
+    for column in attributes.columns:
+        split = attributes[column].str.split(pat='=').apply(pd.Series)
+        title = split[0].drop_duplicates().tolist()[0]
+        attributes[column] = split[1]
+        attributes.rename(columns={column: title}, inplace=True)
+    df = pd.concat((df, attributes), axis=1)
+    return(df)
+
+
+def legacy_rejoin_attributes(df, empty_attributes_str):
+    # original implementation, kept here for comparison
+    columns_to_join = empty_attributes_str.split('=;')[:-1]
+    for col in columns_to_join:
+        df[col] = col + "=" + df[col].astype(str) + ';'
+    df['#attributes'] = df[columns_to_join].apply(
+        lambda row: ''.join(row.values.astype(str)), axis=1)
+    df = df.drop(columns=columns_to_join)
+    return(df)
+
+
+def make_gvf(n_rows, seed=0):
+    # synthetic GVF with every attribute filled in
+    rng = np.random.default_rng(seed)
+    gvf = pd.DataFrame(index=range(n_rows), columns=gvf_columns)
+    gvf['#seqid'] = 'NC_045512.2'
+    gvf['#source'] = '.'
+    gvf['#type'] = '.'
+    gvf['#start'] = rng.integers(1, 29903, n_rows).astype(str)
+    gvf['#end'] = gvf['#start']
+    gvf['#score'] = '.'
+    gvf['#strand'] = '+'
+    gvf['#phase'] = '.'
+    gvf['#attributes'] = ''
+    for i, key in enumerate(empty_attributes.split('=;')[:-1]):
+        values = pd.Series(rng.integers(0, 500, n_rows)).astype(str)
+        if i % 3 == 0:
+            values = key + '_' + values
+        gvf['#attributes'] = gvf['#attributes'] + key + '=' + values + ';'
+    return gvf
+
+
+def time_codec(separate, rejoin, gvf):
+    start = time.perf_counter()
+    separated = separate(gvf.copy())
+    mid = time.perf_counter()
+    rejoined = rejoin(separated.copy(), empty_attributes)
+    end = time.perf_counter()
+    return separated, rejoined, mid - start, end - mid
+
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    print("rows\tcodec\tseparate_s\trejoin_s")
+    for n_rows in args.rows:
+        gvf = make_gvf(n_rows)
+
+        new_sep, new_rejoin, sep_s, rejoin_s = time_codec(
+            separate_attributes, rejoin_attributes, gvf)
+        print("%d\tvectorized\t%.3f\t%.3f" % (n_rows, sep_s, rejoin_s))
+
+        if n_rows <= args.legacy_max_rows:
+            old_sep, old_rejoin, sep_s, rejoin_s = time_codec(
+                legacy_separate_attributes, legacy_rejoin_attributes, gvf)
+            print("%d\tlegacy\t%.3f\t%.3f" % (n_rows, sep_s, rejoin_s))
+
+            # outputs must match exactly
+            pd.testing.assert_frame_equal(new_sep, old_sep)
+            if not new_rejoin['#attributes'].equals(
+                    old_rejoin['#attributes']):
+                sys.exit("rejoined #attributes differ at " +
+                         str(n_rows) + " rows")
+
+        # round trip must give back the original #attributes
+        if not new_rejoin['#attributes'].equals(gvf['#attributes']):
+            sys.exit("round trip changed #attributes at " +
+                     str(n_rows) + " rows")
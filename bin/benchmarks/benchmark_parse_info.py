@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+
+This script benchmarks the single-pass INFO tokenizer used by
+parse_INFO in functions.py (tokenize_INFO) against the original
+per-key regex extraction, on synthetic INFO columns of increasing size.
+
+The two are checked to extract identical values before timings are
+reported. The synthetic INFO strings end in TYPE, which isn't extracted,
+as the original regex (which needs a trailing ';') never finds the last
+key.
+
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from functions import tokenize_INFO
+
+
+# keys extracted by parse_INFO
+cols_to_extract = ['DP', 'ps_filter', 'ps_exc', 'EFF', 'mat_pep',
+                   'mat_pep_desc', 'mat_pep_acc']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the INFO parsing in parse_INFO')
+    parser.add_argument('--records', type=int, nargs='*',
+                        default=[10000, 50000, 100000],
+                        help='VCF sizes (number of records) to benchmark')
+    return parser.parse_args()
+
+
+def legacy_extract_INFO(info, keys):
+    # original implementation, kept here for comparison
+    extracted = pd.DataFrame(columns=keys)
+    for col in keys:
+        pat = str(col) + "\\=(.*?)\;"
+        extracted[col] = info.str.extract(pat)
+    return extracted
+
+
+def make_info(n_records, seed=0):
+    # synthetic freeBayes/snpEff INFO strings, with some keys missing
+    rng = np.random.default_rng(seed)
+    dp = rng.integers(100, 5000, n_records)
+    ao = rng.integers(1, 100, n_records)
+    info = []
+    for i in range(n_records):
+        fields = ['AB=0', 'AO=' + str(ao[i]), 'DP=' + str(dp[i]),
+                  'DPB=' + str(dp[i]), 'MQM=60',
+                  'EFF=missense_variant(MODERATE|MISSENSE|Gat/Aat|p.D' +
+                  str(i % 1000) + 'N/c.G' + str(i) + 'A|1273|S|'
+                  'protein_coding|CODING|GU280_gp02|1|A)']
+        if i % 4 != 0:
+            fields += ['ps_filter=mask', 'ps_exc=homoplasic']
+        fields += ['mat_pep=nsp' + str(i % 16),
+                   'mat_pep_desc=nsp' + str(i % 16) + '%3B produced by pp1ab',
+                   'mat_pep_acc=YP_009725297.1', 'TYPE=snp']
+        info.append(';'.join(fields))
+    return pd.Series(info)
+
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    print("records\tparser\tseconds")
+    for n_records in args.records:
+        info = make_info(n_records)
+
+        start = time.perf_counter()
+        new = tokenize_INFO(info, cols_to_extract)
+        print("%d\tsingle-pass\t%.3f" % (n_records,
+                                        time.perf_counter() - start))
+
+        start = time.perf_counter()
+        old = legacy_extract_INFO(info, cols_to_extract)
+        print("%d\tregex\t%.3f" % (n_records, time.perf_counter() - start))
+
+        # extracted values must match exactly
+        pd.testing.assert_frame_equal(new, old)
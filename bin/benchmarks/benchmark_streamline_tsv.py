@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+
+This script benchmarks streamline_tsv in gvf2tsv.py against the original
+implementation (string joins per mutation, split again per row for each
+count column), on synthetic multi-lineage dataframes shaped like the
+concatenated output of gvf2tsv().
+
+Both implementations are checked to produce identical reports before
+timings are reported.
+
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from gvf2tsv import streamline_tsv
+
+# the original streamline_tsv reads the variant population size from a
+# global
+variant_pop_size = 'n/a'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks streamline_tsv')
+    parser.add_argument('--mutations', type=int, default=2000,
+                        help='Number of distinct mutations')
+    parser.add_argument('--lineages', type=int, nargs='*',
+                        default=[10, 50, 200],
+                        help='Numbers of lineages to benchmark')
+    parser.add_argument('--legacy_max_lineages', type=int, default=200,
+                        help='Skip the original implementation above '
+                             'this many lineages, as it is very slow')
+    return parser.parse_args()
+
+
+def legacy_add_ao_by_variant_seq(ao_str, variant_seq_str):
+    """
+    Takes a pair of strings like ao_str="7,7,24" and
+    variant_seq_str="T,T,T" or "8,21,3" and "T,T,A".
+    Output should be a string "T=38" (first case) or "T=29, A=3" (
+    second case).
+    """
+    ao_list = ao_str.split(',')
+    ao_list = [int(x) for x in ao_list]
+    var_str_list = variant_seq_str.split(',')
+    zipped_lists = list(zip(var_str_list, ao_list))
+
+    ao_dict = dict()
+    for pair in zipped_lists:
+        # if a variant seq isn't in the dictionary, add it
+        if pair[0] not in ao_dict:
+            ao_dict[pair[0]] = pair[1]
+        # if it's already there, add this ao to the existing key
+        else:
+            ao_dict[pair[0]] += pair[1]
+
+    # create 3 strings: one for ao, one for var_seq, one for both
+    # joined together with an '=' between
+    joined_string = ''
+    ao_string = ''
+    var_string = ''
+    for item in list(ao_dict.items()):
+        joined_string = joined_string + item[0] + '=' + str(item[1]) \
+                        + ', '
+        ao_string = ao_string + str(item[1]) + ','
+        var_string = var_string + item[0] + ','
+    joined_string = joined_string.rstrip(", ")
+    ao_string = ao_string.rstrip(", ")
+    var_string = var_string.rstrip(", ")
+
+    return joined_string, ao_string, var_string
+
+
+def legacy_add_one_from_each_lineage(count_str, lineage_str, mode):
+    """
+    Takes a pair of strings like count_str="7,7,24" and
+    lineage_str="Q.3,Q.3,Q.1".
+    Output should be a string "31", adding unique lineage
+    values only, if mode='add'.
+    If mode='comma', returns a comma-separated set of values,
+    like "7,24".
+    """
+    count_list = count_str.split(';')
+    if mode == 'add':
+        count_list = [int(x) for x in count_list]
+    lineage_str_list = lineage_str.replace(" ", "")
+    lineage_str_list = lineage_str.split(',')
+    zipped_lists = list(zip(lineage_str_list, count_list))
+
+    count_dict = dict()
+    for pair in zipped_lists:
+        # if a lineage isn't in the dictionary, add it
+        if pair[0] not in count_dict:
+            count_dict[pair[0]] = pair[1]
+        # if it's already there, do nothing
+
+    # if mode=='comma', return a comma-separated string of values
+    if mode == 'comma':
+        return_str = ','.join(list(count_dict.values()))
+    # elif mode=='add', add up all the keys and return the value as a
+    # string
+    elif mode == 'add':
+        return_str = str(sum(list(count_dict.values())))
+
+    return return_str
+
+
+def legacy_streamline_tsv(tsv_df):
+    # original implementation, kept here for comparison
+    # find identical rows across strains, and keep only one row.
+    # change n/a to 0 in 'ao' for counting purposes
+    tsv_df['ao'] = tsv_df['ao'].str.replace("n/a", "0")
+
+    '''
+    # make ro, dp, and obs_sample_size numeric
+    for colname in ['ro', 'dp', 'obs_sample_size']:
+        tsv_df[colname] = pd.to_numeric(tsv_df[colname],
+                                        errors='coerce')
+    '''
+    # make obs_sample_size numeric
+    tsv_df['obs_sample_size'] = pd.to_numeric(tsv_df['obs_sample_size'],
+                                              errors='coerce')
+
+    agg_dict = dict((col, 'first') for col in
+                    tsv_df.columns.values.tolist())
+
+    agg_dict['obs_sample_size'] = 'sum'
+    # join some columns with commas
+    agg_dict['viral_lineages'] = ', '.join
+    agg_dict['clade_defining'] = ','.join
+    agg_dict['ao'] = ';'.join
+    agg_dict['dp'] = ';'.join
+    agg_dict['ro'] = ';'.join
+    agg_dict['variant_seq'] = ','.join
+
+    cols_to_check = ['name', 'nt_name', 'aa_name', 'multi_aa_name',
+                     'multiaa_comb_mutation', 'start',
+                     'function_category', 'citation',
+                     'comb_mutation', 'function_description',
+                     'heterozygosity']
+
+    final_df = tsv_df.groupby(cols_to_check).agg(agg_dict)
+    final_df = final_df.rename(columns={'ao': 'ao_all',
+                                        'variant_seq':
+                                            'variant_seq_all',
+                                        'multiaa_comb_mutation':
+                                            'multiaa_mutation_split_names'})
+
+    # add dp, ro per mutation
+    for colname in ['dp', 'ro']:
+        final_df[colname] = [legacy_add_one_from_each_lineage(x, y, mode='add')
+                             for x, y in
+                             zip(final_df[colname],
+                                 final_df['viral_lineages'])]
+
+    # add ao, variant_seq per mutation
+    for colname in ['ao_all', 'variant_seq_all']:
+        final_df[colname] = [
+            legacy_add_one_from_each_lineage(x, y, mode='comma') for x, y in
+            zip(final_df[colname],
+                final_df['viral_lineages'])]
+
+    # add ao according to the heterogeneous mutations
+    final_df['ao_by_var_seq'] = [legacy_add_ao_by_variant_seq(x, y)[0] for x, y
+                                 in zip(final_df['ao_all'],
+                                        final_df['variant_seq_all'])]
+    final_df['ao'] = [legacy_add_ao_by_variant_seq(x, y)[1] for x, y in
+                      zip(final_df['ao_all'],
+                          final_df['variant_seq_all'])]
+    final_df['variant_seq'] = [legacy_add_ao_by_variant_seq(x, y)[2] for x, y
+                               in zip(final_df['ao_all'],
+                                      final_df['variant_seq_all'])]
+
+    # remove 'who_variant'; rename 'multiaa_comb_mutation'
+    final_df = final_df.drop(labels=['variant'], axis=1)
+    # add variant_pop_size
+    final_df['variant_pop_size'] = variant_pop_size
+
+    # combine viral_lineages and clade_defining into key-value pairs
+
+    # split viral_lineages and clade_defining by ','
+    split_lineages = final_df['viral_lineages'].str.split(
+        pat=',').apply(pd.Series)  # split at ,, form dataframe
+    split_clade_defining = final_df['clade_defining'].str.split(
+        pat=',').apply(pd.Series)  # split at ,, form dataframe
+    # go through and make key-value pairs of corresponding columns
+    # from each
+    final_df['clade_defining_status'] = ''
+    for col in split_clade_defining.columns:
+        final_df['clade_defining_status'] = final_df[
+                                                'clade_defining_status'] + \
+                                            split_lineages[col].astype(
+                                                str) + '=' + \
+                                            split_clade_defining[
+                                                col].astype(str) + '; '
+    # drop clade_defining status for n/a strains and empty nan=nan pairs
+    final_df.clade_defining_status = \
+        final_df.clade_defining_status.str.replace('n/a=n/a; ',
+                                                   'n/a; ')
+    final_df.clade_defining_status = \
+        final_df.clade_defining_status.str.replace('nan=nan; ', '')
+    # strip trailing spaces and semicolons
+    final_df.clade_defining_status = \
+        final_df.clade_defining_status.str.rstrip("; ")
+
+    # drop repeated key-value pairs in each row (find these rows as
+    # they contain spaces)
+    for row in final_df['clade_defining_status']:
+        if ' ' in row:
+            mylist = row.split('; ')
+            newlist = []
+            for pair in mylist:
+                pair = pair.replace(';', '')
+                pair = pair.lstrip(' ')
+                newlist.append(pair)
+            mylist = list(set(newlist))
+            row_str = ', '.join(str(e) for e in mylist)
+            mask = final_df['clade_defining_status'] == row
+            final_df.loc[mask, 'clade_defining_status'] = row_str
+
+    # drop repeated lineage names in each row of viral_lineages
+    # return an ordered list of lineages
+    for row in final_df['viral_lineages']:
+        if ' ' in row:
+            lineage_list = row.split(', ')
+            mylist = list(set(lineage_list))
+            '''
+            #order lineages alphanumerically
+            #split each element of mylist into a sublist, split at
+            the first '.'
+            split_list =
+            '''
+            row_str = ', '.join(str(e) for e in mylist)
+            mask = final_df['viral_lineages'] == row
+            final_df.loc[mask, 'viral_lineages'] = row_str
+
+    # reorder columns
+    cols = ['name', 'nt_name', 'aa_name', 'multi_aa_name',
+            'multiaa_mutation_split_names', 'start', 'vcf_gene',
+            'chrom_region', 'mutation_type', 'dp', 'obs_sample_size',
+            'variant_pop_size', 'ps_filter', 'ps_exc', 'mat_pep_id',
+            'mat_pep_desc', 'mat_pep_acc', 'ro', 'ao_by_var_seq', 'ao',
+            'variant_seq', 'reference_seq', 'function_category',
+            'citation',
+            'citation_url', 'comb_mutation', 'function_description',
+            'heterozygosity', 'viral_lineages',
+            'clade_defining_status', 'status',
+            'voi_designation_date', 'voc_designation_date',
+            'vum_designation_date']
+    final_df = final_df[cols]
+
+    return final_df
+
+
+def make_df(n_mutations, n_lineages, seed=0):
+    # each lineage has about half of the mutations; some mutations have
+    # more than one row per lineage (eg. several functional annotations
+    # or variant seqs), and some have missing ao values
+    rng = np.random.default_rng(seed)
+    lineages = ['n/a'] + ['BA.' + str(i) for i in range(1, n_lineages)]
+    frames = []
+    for lineage in lineages:
+        mutations = np.flatnonzero(rng.random(n_mutations) < 0.5)
+        repeats = rng.choice([1, 2, 3], size=len(mutations),
+                             p=[0.85, 0.1, 0.05])
+        mutations = np.repeat(mutations, repeats)
+        n_rows = len(mutations)
+        numbers = pd.Series(mutations).astype(str)
+        df = pd.DataFrame({
+            'start': pd.Series(mutations * 7 + 1).astype(str),
+            'name': 'g.A' + numbers + 'T',
+            'nt_name': 'A' + numbers + 'T',
+            'aa_name': 'p.X' + pd.Series(mutations // 3).astype(str) + 'Y',
+            'multi_aa_name': '',
+            'multiaa_comb_mutation': '',
+            'function_category': np.where(mutations % 5 == 0,
+                                          'transmissibility', ''),
+            'citation': '',
+            'comb_mutation': '',
+            'function_description': '',
+            'heterozygosity': '',
+            'viral_lineages': lineage,
+            'clade_defining': rng.choice(['True', 'False'], size=n_rows),
+            'ao': pd.Series(rng.integers(0, 500, n_rows)).astype(str),
+            'dp': pd.Series(rng.integers(500, 5000, n_rows)).astype(str),
+            'ro': pd.Series(rng.integers(0, 500, n_rows)).astype(str),
+            'variant_seq': rng.choice(['T', 'G', 'T,G'], size=n_rows,
+                                      p=[0.8, 0.15, 0.05]),
+            'obs_sample_size': pd.Series(
+                rng.integers(1, 100, n_rows)).astype(str),
+            'variant': 'Omicron'})
+        # ao per variant seq
+        multi = df['variant_seq'] == 'T,G'
+        df.loc[multi, 'ao'] = df.loc[multi, 'ao'] + ',' + \
+            pd.Series(rng.integers(0, 50, multi.sum()),
+                      index=df.index[multi]).astype(str)
+        df.loc[rng.random(n_rows) < 0.02, 'ao'] = 'n/a'
+        if lineage == 'n/a':
+            df['clade_defining'] = 'n/a'
+        frames.append(df)
+    df = pd.concat(frames, ignore_index=True)
+    for col in ['vcf_gene', 'chrom_region', 'mutation_type', 'ps_filter',
+                'ps_exc', 'mat_pep_id', 'mat_pep_desc', 'mat_pep_acc',
+                'reference_seq', 'citation_url', 'status',
+                'voi_designation_date', 'voc_designation_date',
+                'vum_designation_date']:
+        df[col] = 'n/a'
+    return df
+
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    print("lineages\trows\timplementation\tseconds")
+    for n_lineages in args.lineages:
+        df = make_df(args.mutations, n_lineages)
+
+        start = time.perf_counter()
+        new_df = streamline_tsv(df.copy(), variant_pop_size)
+        seconds = time.perf_counter() - start
+        print("%d\t%d\tlong_format\t%.3f" % (n_lineages, len(df), seconds))
+
+        if n_lineages <= args.legacy_max_lineages:
+            start = time.perf_counter()
+            old_df = legacy_streamline_tsv(df.copy())
+            seconds = time.perf_counter() - start
+            print("%d\t%d\tlegacy\t%.3f" % (n_lineages, len(df), seconds))
+
+            # outputs must match exactly
+            pd.testing.assert_frame_equal(new_df, old_df)
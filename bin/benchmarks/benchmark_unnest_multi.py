@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+
+This script benchmarks unnest_multi in functions.py against the
+original implementation (one list of [index, value] pairs per column,
+merged back on the index), on synthetic dataframes of increasing size
+shaped like parse_INFO's EFF/ao/ALT columns.
+
+Both implementations are checked to produce identical dataframes
+before timings are reported.
+
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from functions import unnest_multi
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks unnest_multi')
+    parser.add_argument('--rows', type=int, nargs='*',
+                        default=[10000, 100000, 500000],
+                        help='Dataframe sizes (number of rows) to benchmark')
+    return parser.parse_args()
+
+
+def legacy_unnest_multi(df, columns, reset_index=False):
+    # original implementation, kept here for comparison
+    # (with .items(), as iteritems() is gone in pandas 2)
+    df_flat = pd.DataFrame(columns=columns)
+    for col in columns:
+        col_flat = pd.DataFrame([[i, x]
+                       for i, y in df[col].apply(list).items()
+                           for x in y], columns=['I', col])
+        col_flat = col_flat.set_index('I')
+        df_flat[col] = col_flat
+    df = df.drop(labels=columns, axis=1)
+    df = df.merge(df_flat, left_index=True, right_index=True)
+    if reset_index:
+        df = df.reset_index(drop=True)
+    return df
+
+
+def make_df(n_rows, seed=0):
+    # mostly single-allele rows, some multi-allelic ones
+    rng = np.random.default_rng(seed)
+    lengths = rng.choice([1, 2, 3], size=n_rows, p=[0.9, 0.08, 0.02])
+    df = pd.DataFrame({'#CHROM': 'NC_045512.2',
+                       'POS': rng.integers(1, 29903, n_rows).astype(str),
+                       'dp': rng.integers(100, 5000, n_rows).astype(str)})
+    df['eff_result'] = [['missense_variant(MODERATE|MISSENSE|' + str(i) +
+                         '_' + str(j) + ')' for j in range(n)]
+                        for i, n in enumerate(lengths)]
+    df['ao'] = [[str(10 + j) for j in range(n)] for n in lengths]
+    df['ALT'] = [['ACGT'[j % 4] for j in range(n)] for n in lengths]
+    return df
+
+
+if __name__ == '__main__':
+
+    args = parse_args()
+    columns = ['eff_result', 'ao', 'ALT']
+
+    print("rows\timplementation\tseconds")
+    for n_rows in args.rows:
+        df = make_df(n_rows)
+
+        start = time.perf_counter()
+        new = unnest_multi(df, columns, reset_index=True)
+        print("%d\tlockstep\t%.3f" % (n_rows, time.perf_counter() - start))
+
+        start = time.perf_counter()
+        old = legacy_unnest_multi(df, columns, reset_index=True)
+        print("%d\tlegacy\t%.3f" % (n_rows, time.perf_counter() - start))
+
+        # outputs must match exactly
+        pd.testing.assert_frame_equal(new, old)
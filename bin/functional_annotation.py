@@ -13,10 +13,28 @@ annotation of variant called files.
 import json
 import os
 import argparse
+import itertools
+import hashlib
+import io
 from pathlib import Path
 import pandas as pd
+import numpy as np
 import csv
-from functions import map_pos_to_gene_protein, unnest_multi
+from concurrent.futures import ProcessPoolExecutor
+from functions import map_pos_to_gene_protein, unnest_multi, atomic_write
+from gene_positions import load_gene_position_indices
+from mutation_index_store import MutationIndexStore
+
+
+dataFrame_cols = ['organism', 'reference accession', 'reference database name', 'nucleotide position',
+'original mutation description', 'nucleotide mutation', 'amino acid mutation', 'amino acid mutation alias',
+'gene name', 'gene symbol', 'protein name', 'protein symbol', 'assay', 'mutation functional effect category',
+'mutation functional effect description', 'author', 'publication year', 'URL', 'DOI', 'PMID',
+'peer review status', 'curator', 'mutation functional annotation resource']
+
+# bump this when the parsing or annotation rules change, to ignore old
+# cache files
+pokay_cache_version = 1
 
 
 def parse_args():
@@ -30,7 +48,8 @@ def parse_args():
     parser.add_argument('--accession', type=str, required=True,
                         help='versioned reference accession from RefSeq')
     parser.add_argument('--mutation_index', type=str, required=True,
-                        help='index of all mutations (.TSV)')
+                        help='index of all mutations (.TSV), or a mutation '
+                             'index store directory')
     parser.add_argument('--gene_positions', type=str,
                         required=True,
                         help='gene positions in JSON format') 
@@ -38,6 +57,14 @@ def parse_args():
                         help='output file (.TSV) format')
     parser.add_argument('--save_dois', type=str, default=None,
                         help='output file (.TXT) format')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Number of processes used to parse the '
+                             'Pokay files in parallel')
+    parser.add_argument('--cache', type=str, default=None,
+                        help='JSON file of the parsed and annotated Pokay '
+                             'files of previous runs; only new or changed '
+                             'files are parsed again. Created or updated '
+                             'with this run\'s files')
     return parser.parse_args()
 
 
@@ -94,30 +121,15 @@ def extract_source_citation(dframe):
     return dframe
 
 
-def extract_metadata(inp_file, chunk, df):
+def extract_metadata(inp_file, chunk):
+    """
+    Returns the records of one mutation chunk of a Pokay file, as dicts
+    with the citation line ('url'), the lines describing its effect, and
+    the mutation, protein and category.
+    As in the original parser, the citations found so far are emitted
+    again after each citation line of the chunk.
+    """
     mutation_name = chunk[-1].strip()
-    '''
-    ## MRI: for now, removing 'comb_mutation' column and having 'mutation_name' comma-separated
-    check_combination = 0
-    if ";" in mutation_name:
-        mutation_name = mutation_name.split(";")
-        check_combination = 1
-    elif "," in mutation_name:
-        mutation_name = mutation_name.split(",")
-    else:
-        mutation_name = [mutation_name]
-    for x in mutation_name:
-        heterozygosity = ""
-        if x.startswith("[") or x.endswith("]"):
-            heterozygosity = "heterozygous"
-            x = x.replace("[", "")
-            x = x.replace("]", "")
-        if check_combination == 1:
-            comb_mutation = combination_mutation(
-                c_mutations=mutation_name, c_mutation=x)
-        else:
-            comb_mutation = ""
-    '''
     mutation_name = mutation_name.replace(';', ',')
     gene_name = inp_file.split('_')[0]
     function_category = Path(inp_file).stem
@@ -129,6 +141,7 @@ def extract_metadata(inp_file, chunk, df):
         if "http" in chunk[i]:
             url.append(i)
     function = {}
+    records = []
     for index_url in range(0, len(url)):
         if index_url == 0:
             function[chunk[url[index_url]]] = chunk[
@@ -148,87 +161,85 @@ def extract_metadata(inp_file, chunk, df):
                                         index_url - 1]]
                 del function[chunk[url[index_url - 1]]]
 
-        df_func = pd.DataFrame(function.items(), columns=['url',
-                                                          'mutation functional effect description'])
-
-        df_list = [mutation_name, gene_name,
-                   function_category] #, comb_mutation, heterozygosity]
-        # print(df_list)
-        df1 = pd.DataFrame(
-            columns=['original mutation description', 'protein symbol', 'mutation functional effect category'])
-                     #'comb_mutation', 'heterozygosity'])
-        df1.loc[len(df1)] = df_list
-
-        df_func['original mutation description'] = df1['original mutation description'].iloc[0]
-        df_func['protein symbol'] = df1['protein symbol'].iloc[0]
-        df_func['mutation functional effect category'] = df1['mutation functional effect category'].iloc[0]
-        #df_func['comb_mutation'] = str(df1['comb_mutation'].iloc[0])
-        #df_func['heterozygosity'] = str(df1['heterozygosity'].iloc[0])
-
-        df_func = data_cleanup(dframe=df_func)
-        df_func = extract_source_citation(dframe=df_func)
-
-        df = pd.concat([df, df_func], ignore_index=True)
-        df = df.drop(labels='url', axis=1)
-    return df
-
-
-def write_tsv(dframe):
-    dframe.to_csv(args.outputfile, sep="\t", escapechar='|',
-                  quoting=csv.QUOTE_ALL, index=False, header=True)
-
-
-if __name__ == '__main__':
-
-    args = parse_args()
-
-    # Folder Path
-    path = args.inputdir
-
-    # Change the directory
-    # os.chdir(path)
-
-    # Reading the gene & protein coordinates of SARS-CoV-2 genome
-    with open(args.gene_positions) as fp:
-        GENE_PROTEIN_POSITIONS_DICT = json.load(fp)
-
-
-    dataFrame_cols = ['organism', 'reference accession', 'reference database name', 'nucleotide position',
-'original mutation description', 'nucleotide mutation', 'amino acid mutation', 'amino acid mutation alias',
-'gene name', 'gene symbol', 'protein name', 'protein symbol', 'assay', 'mutation functional effect category',
-'mutation functional effect description', 'author', 'publication year', 'URL', 'DOI', 'PMID',
-'peer review status', 'curator', 'mutation functional annotation resource']
-    
-    dataFrame = pd.DataFrame(columns=dataFrame_cols)
-
-    for file in os.listdir(path):
-        if file.endswith(".txt") and "_" in file:
-            file_path = os.path.join(path, file)
-            print(file)
-            f = open(file_path, 'r')
-            lines = f.readlines()
-            mutations = []
-            for i in range(0, len(lines)):
-                if not lines[i].startswith("#") and lines[i] != "\n":
-                    mutations.append(i)
-            func_chunk = []
-            for index in range(0, len(mutations)):
-                # fetching function if there is only one mutation
-                if index == 0:
-                    func_chunk = lines[0:mutations[index] + 1]
-                    # print(function)
-                    dataFrame = extract_metadata(inp_file=file,
-                                                 chunk=func_chunk,
-                                                 df=dataFrame)
-                else:
-                    func_chunk = lines[mutations[index - 1] +
-                                       2:mutations[index] + 1]
-                    dataFrame = extract_metadata(inp_file=file,
-                                                 chunk=func_chunk,
-                                                 df=dataFrame)
-
+        records.extend(
+            {'url': key,
+             'mutation functional effect description': description,
+             'original mutation description': mutation_name,
+             'protein symbol': gene_name,
+             'mutation functional effect category': function_category}
+            for key, description in function.items())
+    return records
+
+
+def parse_pokay_file(file_path):
+    """
+    Returns the records of all mutation chunks of a Pokay .txt file.
+    """
+    file = os.path.basename(file_path)
+    with open(file_path, 'r') as f:
+        lines = f.readlines()
+    mutations = []
+    for i in range(0, len(lines)):
+        if not lines[i].startswith("#") and lines[i] != "\n":
+            mutations.append(i)
+    records = []
+    for index in range(0, len(mutations)):
+        # fetching function if there is only one mutation
+        if index == 0:
+            func_chunk = lines[0:mutations[index] + 1]
+        else:
+            func_chunk = lines[mutations[index - 1] +
+                               2:mutations[index] + 1]
+        records.extend(extract_metadata(inp_file=file, chunk=func_chunk))
+    return records
+
+
+def pokay_files(path):
+    """
+    Returns the names of the Pokay .txt files in a directory.
+    """
+    return [file for file in os.listdir(path)
+            if file.endswith(".txt") and "_" in file]
+
+
+def parse_pokay_files(file_paths, jobs=1):
+    """
+    Returns the records of each Pokay file, parsing up to 'jobs' files at
+    a time in separate processes.
+    """
+    if jobs > 1 and len(file_paths) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(parse_pokay_file, file_paths))
+    return [parse_pokay_file(file_path) for file_path in file_paths]
+
+
+def make_pokay_dataframe(file_records):
+    """
+    Returns one dataframe of the records of all Pokay files, with the
+    citations and descriptions cleaned up.
+    """
+    df_func = pd.DataFrame.from_records(
+        list(itertools.chain.from_iterable(file_records)),
+        columns=['url', 'mutation functional effect description',
+                 'original mutation description', 'protein symbol',
+                 'mutation functional effect category'])
+    df_func = data_cleanup(dframe=df_func)
+    df_func = extract_source_citation(dframe=df_func)
+    df_func = df_func.drop(labels='url', axis=1)
+
+    return pd.concat([pd.DataFrame(columns=dataFrame_cols), df_func],
+                     ignore_index=True)
+
+
+def annotate_pokay_dataframe(dataFrame, reference_accession, mutation_index,
+                             GENE_PROTEIN_POSITIONS_DICT, cds_index):
+    """
+    Fills in the mutation names, positions, genes and proteins of the
+    Pokay rows from the mutation index and gene positions.
+    Returns the rows found in the index, with the number of each row in
+    dataFrame in 'index1'.
+    """
     # fill in first three columns
-    reference_accession = args.accession
     dataFrame['reference accession'] = reference_accession
     dataFrame['reference database name'] = 'RefSeq'
     if reference_accession=='NC_045512.2':
@@ -246,7 +257,6 @@ if __name__ == '__main__':
     dataFrame['index1'] = dataFrame.index
 
     # add HGVS mutations names, nucleotide positions, protein name and protein symbol from mutation index
-    mutation_index = pd.read_csv(args.mutation_index, sep='\t')
     # merge on "mutation" and "gene" in index ("original mutation description" and "gene symbol" in functional annotation file)
     mutation_index = mutation_index.rename(columns={"mutation": "original mutation description", 'pos':'nucleotide position',
                                                     'hgvs_aa_mutation':'amino acid mutation','hgvs_nt_mutation':'nucleotide mutation',
@@ -270,7 +280,8 @@ if __name__ == '__main__':
     ###TO DO: these should be ontology names! Need to create a mapping.
     ## 'gene symbol' is the same as 'gene name' from the JSON for now
     json_df = map_pos_to_gene_protein(
-        merged_dataFrame["nucleotide position"], GENE_PROTEIN_POSITIONS_DICT)
+        merged_dataFrame["nucleotide position"], GENE_PROTEIN_POSITIONS_DICT,
+        cds_index)
     merged_dataFrame["gene name"] = json_df["gene"]
     merged_dataFrame["gene symbol"] = json_df["gene"]
 
@@ -303,11 +314,184 @@ if __name__ == '__main__':
     agg_dict.update(first_dict)
 
     # perform groupby and aggregation
+    # ('index1' is a string by now, so rows are in string order of index1)
     merged_dataFrame = merged_dataFrame.groupby(by=['index1'], as_index=False).agg(agg_dict)
 
-    # reorder columns and drop 'index1'
-    merged_dataFrame = merged_dataFrame[dataFrame_cols]
-    merged_dataFrame = merged_dataFrame.reindex()
+    return merged_dataFrame
+
+
+def read_mutation_index(mutation_index_file):
+    """
+    Reads the mutation index TSV, or the whole index from a mutation index
+    store directory, parsed the same way as the TSV.
+    """
+    if os.path.isdir(mutation_index_file):
+        index = MutationIndexStore(mutation_index_file).read()
+        return pd.read_csv(io.StringIO(index.to_csv(sep='\t', index=False)),
+                           sep='\t')
+    return pd.read_csv(mutation_index_file, sep='\t')
+
+
+def file_hash(file_path):
+    """
+    Returns the SHA-256 hash of a file's contents.
+    """
+    with open(file_path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_pokay_cache(cache_file, annotation_key):
+    """
+    Returns the entries of a Pokay cache file, keyed by file name: the
+    hash, parsed records and annotated rows of each file.
+    The annotated rows are dropped if they were made with another mutation
+    index, gene positions file or accession (annotation_key). A cache file
+    that can't be read (eg. one cut short) is ignored, and rebuilt.
+    """
+    if not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file) as fp:
+            saved = json.load(fp)
+    except (OSError, ValueError):
+        print("Ignoring unreadable cache file: " + cache_file)
+        return {}
+    if not isinstance(saved, dict) or \
+            saved.get('version') != pokay_cache_version or \
+            not isinstance(saved.get('files'), dict):
+        return {}
+    # entries missing their hash or records are parsed again
+    entries = dict((file, entry) for file, entry in saved['files'].items()
+                   if isinstance(entry, dict) and 'hash' in entry
+                   and 'records' in entry)
+    for entry in entries.values():
+        if saved.get('annotation_key') != annotation_key or \
+                'rows' not in entry or 'index' not in entry:
+            entry.pop('rows', None)
+            entry.pop('index', None)
+    return entries
+
+
+def save_pokay_cache(cache_file, annotation_key, entries):
+    saved = {'version': pokay_cache_version,
+             'annotation_key': annotation_key, 'files': entries}
+    with atomic_write(cache_file) as fp:
+        json.dump(saved, fp)
+
+
+def cached_pokay_annotations(path, cache_file, reference_accession,
+                             mutation_index_file, gene_positions_file,
+                             GENE_PROTEIN_POSITIONS_DICT, cds_index, jobs=1):
+    """
+    Returns the annotated Pokay rows, the same as parsing and annotating
+    all files, but only parsing the files that are new or changed since
+    the cache file was written, and only annotating their rows (or all
+    rows if the mutation index, gene positions or accession changed).
+    The cache file is created or updated.
+    """
+    files = pokay_files(path)
+    for file in files:
+        print(file)
+    annotation_key = '|'.join([reference_accession,
+                               MutationIndexStore(mutation_index_file).fingerprint()
+                               if os.path.isdir(mutation_index_file)
+                               else file_hash(mutation_index_file),
+                               file_hash(gene_positions_file)])
+    entries = load_pokay_cache(cache_file, annotation_key)
+
+    # re-parse new and changed files
+    hashes = dict((file, file_hash(os.path.join(path, file)))
+                  for file in files)
+    to_parse = [file for file in files if file not in entries
+                or entries[file]['hash'] != hashes[file]]
+    file_records = parse_pokay_files(
+        [os.path.join(path, file) for file in to_parse], jobs)
+    for file, records in zip(to_parse, file_records):
+        entries[file] = {'hash': hashes[file], 'records': records}
+
+    # annotate the rows of files without annotated rows, all at once
+    to_annotate = [file for file in files if 'rows' not in entries[file]]
+    for file in to_annotate:
+        entries[file]['index'] = []
+        entries[file]['rows'] = []
+    file_records = [entries[file]['records'] for file in to_annotate]
+    if sum(len(records) for records in file_records) > 0:
+        # file and row within the file of each row of the dataframe
+        row_file = np.repeat(np.arange(len(file_records)),
+                             [len(records) for records in file_records])
+        row_number = np.concatenate([np.arange(len(records))
+                                     for records in file_records])
+        annotated = annotate_pokay_dataframe(
+            make_pokay_dataframe(file_records), reference_accession,
+            read_mutation_index(mutation_index_file),
+            GENE_PROTEIN_POSITIONS_DICT, cds_index)
+        rows = annotated['index1'].astype(int).to_numpy()
+        values = annotated[dataFrame_cols].to_numpy(dtype=object).tolist()
+        for i, row in enumerate(rows):
+            entry = entries[to_annotate[row_file[row]]]
+            entry['index'].append(int(row_number[row]))
+            entry['rows'].append(values[i])
+
+    # put the rows of all files in the order of annotating them together,
+    # ie. by row number across all files, as a string
+    numbered_rows = []
+    offset = 0
+    for file in files:
+        for row, values in zip(entries[file]['index'], entries[file]['rows']):
+            numbered_rows.append((str(offset + row), values))
+        offset += len(entries[file]['records'])
+    numbered_rows.sort(key=lambda numbered_row: numbered_row[0])
+
+    save_pokay_cache(cache_file, annotation_key,
+                     dict((file, entries[file]) for file in files))
+
+    return pd.DataFrame([values for row, values in numbered_rows],
+                        columns=dataFrame_cols)
+
+
+def write_tsv(dframe):
+    dframe.to_csv(args.outputfile, sep="\t", escapechar='|',
+                  quoting=csv.QUOTE_ALL, index=False, header=True)
+
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    # Folder Path
+    path = args.inputdir
+
+    # Change the directory
+    # os.chdir(path)
+
+    # Reading the gene & protein coordinates of SARS-CoV-2 genome
+    with open(args.gene_positions) as fp:
+        GENE_PROTEIN_POSITIONS_DICT = json.load(fp)
+    # CDS lookup, from the compiled gene positions file if available
+    cds_index = load_gene_position_indices(
+        args.gene_positions, GENE_PROTEIN_POSITIONS_DICT)["CDS"]
+
+    if args.cache is not None:
+        # only parse and annotate what changed since the last run
+        merged_dataFrame = cached_pokay_annotations(
+            path, args.cache, args.accession, args.mutation_index,
+            args.gene_positions, GENE_PROTEIN_POSITIONS_DICT, cds_index,
+            args.jobs)
+    else:
+        files = pokay_files(path)
+        for file in files:
+            print(file)
+        dataFrame = make_pokay_dataframe(parse_pokay_files(
+            [os.path.join(path, file) for file in files], args.jobs))
+
+        mutation_index = read_mutation_index(args.mutation_index)
+        merged_dataFrame = annotate_pokay_dataframe(
+            dataFrame, args.accession, mutation_index,
+            GENE_PROTEIN_POSITIONS_DICT, cds_index)
+
+        # reorder columns and drop 'index1'
+        merged_dataFrame = merged_dataFrame[dataFrame_cols]
+        merged_dataFrame = merged_dataFrame.reindex()
 
     write_tsv(dframe=merged_dataFrame)
 
@@ -1,6 +1,13 @@
 import pandas as pd
 import numpy as np
 import logging
+import itertools
+import json
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+from gene_positions import GenePositionIndex
 
 # standard variables used by all scripts
 empty_attributes = 'ID=;Name=;alias=;gene=;protein_name=;protein_symbol=;\
@@ -13,6 +20,8 @@ empty_attributes = 'ID=;Name=;alias=;gene=;protein_name=;protein_symbol=;\
     clade_defining=;variant=;variant_type=;voi_designation_date=; \
     voc_designation_date=;vum_designation_date=;status=;'
 empty_attributes = empty_attributes.replace(" ", "")
+# attribute names, in the order they are written to '#attributes'
+gvf_attributes = empty_attributes.split('=;')[:-1]
 
 gvf_columns = ['#seqid', '#source', '#type', '#start', '#end',
                '#score', '#strand', '#phase', '#attributes']
@@ -35,11 +44,15 @@ amino_acid_codes_dict = {'*': 'Ter', 'A': 'Ala', 'B': 'Asx', 'C': 'Cys',
                          'V': 'Val', 'W': 'Trp', 'X': 'Xaa', 'Y': 'Tyr',
                          'Z': 'Glx'}
 
+# str.translate table for amino_acid_codes_dict; only uppercase letters
+# are converted ('*' is kept as is)
+amino_acid_codes_table = str.maketrans(
+    dict((code, name) for code, name in amino_acid_codes_dict.items()
+         if code.isupper()))
+
 def convert_amino_acid_codes(one_letter_mutation_name):
-    three_letter_code_result = "".join([
-        amino_acid_codes_dict[ch]
-        if (ch.isupper() and ch in amino_acid_codes_dict.keys()) 
-        else ch for ch in one_letter_mutation_name])
+    three_letter_code_result = one_letter_mutation_name.translate(
+        amino_acid_codes_table)
 
     return(three_letter_code_result)
 
@@ -68,6 +81,166 @@ def convert_nt_delins_to_hgvs():
     return(hgvs_name)
 '''
 
+# one pattern classifying nucleotide names; each named group is searched
+# for anywhere in the name (like str.contains), and is None if not found
+nt_name_regex = re.compile(
+    # for SNPs, eg. g.C45T, g.C-45T
+    "(?:(?=.*?(?P<snp>[a-z]\\.[A-Z][0-9\\-]+[A-Z])))?"
+    # for dels and dups, eg. g.254_259delTGGTTG, g.361delA
+    "(?:(?=.*?(?P<del_dup>[a-z]\\.[0-9\\-_]+(?P<del_dup_type>del|dup)[A-Z]+)))?"
+    # for ins
+    "(?:(?=.*?(?P<ins>[a-z]\\.[0-9\\-_]+ins[A-Z]+)))?"
+    # for delins, eg. g.GCC10182_10184ACA ##not quite right!
+    "(?:(?=.*?(?P<delins>[a-z]\\.[A-Z]{2,}[0-9\\-_][A-Z]+)))?")
+
+# amino acid names: SNPs, or del/delins/ins/dup/fs/ext
+aa_name_regex = re.compile("[A-Z*][0-9\\-]+[A-Z*]|"
+                           "[A-Z*]+[0-9\\-]+(del|delins|ins|dup|fs|ext)[A-Z*]*")
+
+# HGVS names already worked out, by type ('nt' or 'aa') and input name;
+# None where the name has no HGVS form. Can be saved to and loaded from
+# a file with save_hgvs_cache() and load_hgvs_cache().
+hgvs_names_cache = {'nt': {}, 'aa': {}}
+# input names looked up in this run, kept first when a saved cache is
+# trimmed to hgvs_cache_max_names
+hgvs_names_used = {'nt': set(), 'aa': set()}
+# bump this when the naming rules change, to ignore old cache files
+hgvs_cache_version = 1
+# most names of each type kept in a saved cache
+hgvs_cache_max_names = 200000
+
+
+@contextmanager
+def atomic_write(file_path, mode='w', exclusive=False):
+    # opens a temporary file next to file_path for writing, and moves it
+    # over file_path once written, so readers (and runs writing the same
+    # file in parallel) never see a partly written file, and an
+    # interrupted write leaves file_path as it was. With exclusive=True,
+    # the file is linked to file_path instead, which raises
+    # FileExistsError if file_path already exists
+    fd, tmp_file = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(file_path)),
+        prefix=os.path.basename(file_path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as fp:
+            yield fp
+        # mkstemp makes the file owner-only; give it the mode of the file
+        # it replaces, or the mode open() would have given a new file
+        if os.path.exists(file_path):
+            file_mode = os.stat(file_path).st_mode & 0o7777
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            file_mode = 0o666 & ~umask
+        os.chmod(tmp_file, file_mode)
+        if exclusive:
+            try:
+                os.link(tmp_file, file_path)
+            finally:
+                os.remove(tmp_file)
+        else:
+            os.replace(tmp_file, file_path)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+
+def classify_nt_name(nt_name):
+    # returns 'ins', 'del', 'dup', 'snp', 'delins' or None, in that order
+    # of precedence where a name matches more than one type
+    match = nt_name_regex.match(nt_name)
+    if match.group('ins'):
+        return 'ins'
+    elif match.group('del_dup'):
+        return match.group('del_dup_type')
+    elif match.group('snp'):
+        return 'snp'
+    elif match.group('delins'):
+        return 'delins'
+    return None
+
+
+def hgvs_nt_name(nt_name):
+    # HGVS form of a nucleotide name, without the reference sequence
+    hgvs_names_used['nt'].add(nt_name)
+    if nt_name not in hgvs_names_cache['nt']:
+        name_type = classify_nt_name(nt_name)
+        if name_type == 'ins':
+            hgvs_name = nt_name
+        elif name_type in ['del', 'dup']:
+            hgvs_name = remove_nts_from_nt_name(nt_name)
+        elif name_type == 'snp':
+            hgvs_name = rewrite_nt_snps_as_hgvs(nt_name)
+        else:
+            # delins: change to eg. g.123_129delinsAC (TBA!)
+            hgvs_name = None
+        hgvs_names_cache['nt'][nt_name] = hgvs_name
+    return hgvs_names_cache['nt'][nt_name]
+
+
+def hgvs_aa_name(aa_name):
+    # HGVS form of an amino acid name, without the protein ID
+    hgvs_names_used['aa'].add(aa_name)
+    if aa_name not in hgvs_names_cache['aa']:
+        if aa_name_regex.search(aa_name):
+            hgvs_name = convert_amino_acid_codes(aa_name)
+        else:
+            hgvs_name = None
+        hgvs_names_cache['aa'][aa_name] = hgvs_name
+    return hgvs_names_cache['aa'][aa_name]
+
+
+def map_hgvs_names(names, namer):
+    # applies namer once per unique string in names; NaN where there is
+    # no HGVS name
+    unique_names = [name for name in pd.unique(names) if isinstance(name, str)]
+    return names.map(dict((name, namer(name)) for name in unique_names))
+
+
+def read_hgvs_cache(cache_file):
+    # names in a saved HGVS names cache, by type; none if the file is
+    # missing, can't be parsed (eg. it was cut short) or was saved with
+    # other naming rules
+    try:
+        with open(cache_file) as fp:
+            saved = json.load(fp)
+        if saved.get('version') == hgvs_cache_version:
+            return dict((name_type, dict(saved[name_type]))
+                        for name_type in hgvs_names_cache.keys())
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        pass
+    return dict((name_type, {}) for name_type in hgvs_names_cache.keys())
+
+
+def load_hgvs_cache(cache_file):
+    # adds the names in a saved HGVS names cache to hgvs_names_cache
+    for name_type, names in read_hgvs_cache(cache_file).items():
+        hgvs_names_cache[name_type].update(names)
+
+
+def save_hgvs_cache(cache_file):
+    # merges the names of this run into the saved cache, which runs in
+    # parallel may have added to meanwhile, keeping at most
+    # hgvs_cache_max_names of each type: the names used in this run, then
+    # the most recently added others
+    saved = read_hgvs_cache(cache_file)
+    for name_type, names in hgvs_names_cache.items():
+        merged = saved[name_type]
+        merged.update(names)
+        if len(merged) > hgvs_cache_max_names:
+            used = [name for name in merged
+                    if name in hgvs_names_used[name_type]]
+            others = [name for name in merged
+                      if name not in hgvs_names_used[name_type]]
+            keep = used[:hgvs_cache_max_names] + \
+                others[len(others) - max(hgvs_cache_max_names - len(used), 0):]
+            saved[name_type] = dict((name, merged[name]) for name in keep)
+    saved['version'] = hgvs_cache_version
+    with atomic_write(cache_file) as fp:
+        json.dump(saved, fp)
+
+
 def add_hgvs_names(new_gvf):
     
     new_gvf['hgvs_nt'] = 'n/a'
@@ -75,60 +248,19 @@ def add_hgvs_names(new_gvf):
     new_gvf['hgvs_alias'] = 'n/a'
     
     # fill in 'hgvs_nt'
-    
-    # define nt regex patterns
-    # for SNPs, eg. g.C45T, g.C-45T
-    nt_snp_regex = "[a-z]\\.[A-Z][0-9\\-]+[A-Z]"
-    # for dels and dups, eg. g.254_259delTGGTTG, g.361delA
-    nt_del_dup_regex = "[a-z]\\.[0-9\\-_]+(del|dup)[A-Z]+"
-    # for ins
-    nt_ins_regex = "[a-z]\\.[0-9\\-_]+ins[A-Z]+"
-    # for delins, eg. g.GCC10182_10184ACA
-    nt_delins_regex = "[a-z]\\.[A-Z]{2,}[0-9\\-_][A-Z]+" ##not quite right!
-    
-    #df.loc[mask, 'val'] = df.loc[mask, 'val'].apply(f)
-    # add hgvs nt snp names
-    nt_snp_mask = new_gvf['nt_name'].str.contains(nt_snp_regex, regex=True)
-    new_gvf.loc[nt_snp_mask, 'hgvs_nt'] = new_gvf['#seqid'] + ":" + \
-                 new_gvf.loc[nt_snp_mask, 'nt_name'].apply(rewrite_nt_snps_as_hgvs)
-    # add hgvs nt dels and dups
-    nt_del_dup_mask = new_gvf['nt_name'].str.contains(nt_del_dup_regex, regex=True)
-    new_gvf.loc[nt_del_dup_mask,'hgvs_nt'] = new_gvf['#seqid'] + ":" + \
-                new_gvf.loc[nt_del_dup_mask, 'nt_name'].apply(remove_nts_from_nt_name)
-    # add hgvs nt ins
-    nt_ins_mask = new_gvf['nt_name'].str.contains(nt_ins_regex, regex=True)
-    new_gvf.loc[nt_ins_mask, 'hgvs_nt'] = new_gvf['#seqid'] + ":" + new_gvf['nt_name']  
-    # add hgvs nt delins: change to eg. g.123_129delinsAC
-    nt_delins_mask = new_gvf['nt_name'].str.contains(nt_delins_regex, regex=True)
-    #new_gvf.loc[nt_delins_mask, 'hgvs_nt'] = new_gvf['#seqid'] + ":" + "TBA!" #new_gvf['nt_name']  
-
-    # define aa regex patterns
-    aa_snp_regex = "[A-Z*][0-9\\-]+[A-Z*]"
-    aa_other_regex = "[A-Z*]+[0-9\\-]+(del|delins|ins|dup|fs|ext)[A-Z*]*"
-    
-    # fill in 'hgvs_aa' 
-    # add hgvs aa snps to rows with protein_id!=n/a
-    aa_snp_mask = (new_gvf['aa_name'].str.contains(aa_snp_regex, regex=True)) & (new_gvf['protein_id']!='n/a')
-    new_gvf.loc[aa_snp_mask, 'hgvs_aa'] = \
-                new_gvf["protein_id"] + ":" + \
-                new_gvf.loc[aa_snp_mask, 'aa_name'].apply(convert_amino_acid_codes)
-    # add hgvs aa names for non-snps
-    aa_non_snp_mask = (new_gvf['aa_name'].str.contains(aa_other_regex, regex=True)) & (new_gvf['protein_id']!='n/a')
-    new_gvf.loc[aa_non_snp_mask, 'hgvs_aa'] = \
-                new_gvf["protein_id"] + ":" + new_gvf.loc[aa_non_snp_mask, 'aa_name'].apply(
-                    convert_amino_acid_codes)
-
-    # fill in 'hgvs_alias'
-    # add hgvs alias snps to rows with protein_id!=n/a
-    alias_snp_mask = (new_gvf['alias'].str.contains(aa_snp_regex, regex=True)) & (new_gvf['protein_id']!='n/a') & (new_gvf['alias']!='n/a')
-    new_gvf.loc[alias_snp_mask, 'hgvs_alias'] = \
-                new_gvf["protein_id"] + ":" + new_gvf.loc[alias_snp_mask, 'alias'].apply(
-                    convert_amino_acid_codes)
-    # add hgvs alias names for non-snps
-    alias_non_snp_mask = (new_gvf['alias'].str.contains(aa_other_regex, regex=True)) & (new_gvf['protein_id']!='n/a') & (new_gvf['alias']!='n/a')
-    new_gvf.loc[alias_non_snp_mask, 'hgvs_alias'] = \
-                new_gvf["protein_id"] + ":" + new_gvf.loc[alias_non_snp_mask, 'alias'].apply(
-                    convert_amino_acid_codes)
+    hgvs_nt = map_hgvs_names(new_gvf['nt_name'], hgvs_nt_name)
+    nt_mask = hgvs_nt.notna()
+    new_gvf.loc[nt_mask, 'hgvs_nt'] = new_gvf['#seqid'] + ":" + hgvs_nt[nt_mask]
+
+    # fill in 'hgvs_aa' for rows with protein_id!=n/a
+    hgvs_aa = map_hgvs_names(new_gvf['aa_name'], hgvs_aa_name)
+    aa_mask = hgvs_aa.notna() & (new_gvf['protein_id']!='n/a')
+    new_gvf.loc[aa_mask, 'hgvs_aa'] = new_gvf["protein_id"] + ":" + hgvs_aa[aa_mask]
+
+    # fill in 'hgvs_alias' for rows with protein_id!=n/a
+    hgvs_alias = map_hgvs_names(new_gvf['alias'], hgvs_aa_name)
+    alias_mask = hgvs_alias.notna() & (new_gvf['protein_id']!='n/a') & (new_gvf['alias']!='n/a')
+    new_gvf.loc[alias_mask, 'hgvs_alias'] = new_gvf["protein_id"] + ":" + hgvs_alias[alias_mask]
                 
     return(new_gvf)
 
@@ -136,24 +268,45 @@ def add_hgvs_names(new_gvf):
 def separate_attributes(df):
     # expand #attributes column into multiple columns for each attribute,
     # keeping the original #attributes column
-    
-    # split #attributes column into separate columns for each tag
-    # split at ;, form dataframe
-    attributes = df['#attributes'].str.split(pat=';').apply(pd.Series)
-    # last column is a copy of the index so drop it
-    attributes = attributes.drop(labels=len(attributes.columns) - 1,
-                                 axis=1)
 
-    for column in attributes.columns:
-        split = attributes[column].str.split(pat='=').apply(pd.Series)
-        title = split[0].drop_duplicates().tolist()[0] #.lower()
-
-        content = split[1]
-
-        # ignore "tag=" in column content
-        attributes[column] = content
-        # make attribute tag as column label
-        attributes.rename(columns={column: title}, inplace=True)
+    # when every row has the same number of "tag=value;" fields, as in a
+    # GVF, the values of all rows are cut out of the joined #attributes
+    # column by one regular expression, as the text between the first
+    # and second '=' of each field. Values stay strings, as they are
+    # written back unchanged by rejoin_attributes
+    rows = df['#attributes'].tolist()
+    n_tags = rows[0].count(';') if len(rows) > 0 and \
+        isinstance(rows[0], str) else 0
+    if n_tags > 0:
+        try:
+            joined = '\n'.join(rows)
+        except TypeError:
+            # missing values
+            joined = ''
+        fields_regex = re.compile(
+            '^' + r'[^;=\n]*=([^;=\n]*)[^;\n]*;' * n_tags + '$', re.M)
+        values = fields_regex.findall(joined)
+        if len(values) == len(rows) and joined.count('\n') == len(rows) - 1:
+            # tag names are taken from the first row, as every row of a
+            # GVF carries the same tags in the same order
+            titles = [x.split('=')[0] for x in rows[0].split(';')[:-1]]
+            attributes = pd.DataFrame(values, index=df.index,
+                                      columns=range(n_tags))
+            attributes.columns = titles
+            return(pd.concat((df, attributes), axis=1))
+
+    # otherwise split #attributes column into separate columns for each
+    # tag; the last column is empty (trailing ';') so drop it
+    attributes = df['#attributes'].str.split(pat=';', expand=True)
+    if attributes.shape[1] < 2:
+        return(df)
+    attributes = attributes.iloc[:, :-1]
+    titles = [str(x).split('=')[0] for x in attributes.iloc[0]]
+
+    # strip "tag=" column by column; a cell without '=' gives NaN
+    attributes = attributes.apply(
+        lambda column: column.str.split(pat='=').str[1])
+    attributes.columns = titles
 
     # replace attributes column in the original df with the new
     # separated out attributes
@@ -165,10 +318,13 @@ def separate_attributes(df):
 def rejoin_attributes(df, empty_attributes_str):
     # get column names as list
     columns_to_join = empty_attributes_str.split('=;')[:-1] #last one will be empty
+    # build "tag=value;" strings column by column rather than row by row
+    attributes = np.full(len(df), '', dtype=object)
     for col in columns_to_join:
-        df[col] = col + "=" + df[col].astype(str) + ';'
+        attributes = attributes + (col + "=") + \
+            df[col].astype(str).to_numpy(dtype=object) + ';'
     # replace #attributes column with filled attributes
-    df['#attributes'] = df[columns_to_join].apply(lambda row: ''.join(row.values.astype(str)), axis=1)
+    df['#attributes'] = attributes
     df = df.drop(columns=columns_to_join)
     
     return(df)
@@ -189,6 +345,319 @@ def get_unknown_labels(df):
     return columns
         
 
+def expand_pango_lineage(var):
+    '''
+    Expands one pango_lineage entry of the clades file into a list
+    of lineage names: comma-separated entries are split up, and
+    bracketed children are expanded, eg. "B[A|B]" to "BA" and "BB".
+    '''
+    if "," in var:
+        lineages = []
+        for temp in var.split(","):
+            if not "[" in var:
+                lineages.append(temp)
+            else:
+                parent=temp[0]
+                child=temp[2:-1].split("|")
+                for c in child:
+                    lineages.append(parent + str(c))
+        return lineages
+    else:
+        return [var]
+
+
+def pango_lineage_patterns(var):
+    '''
+    Like expand_pango_lineage, but comma-separated entries also
+    get a "<lineage>.*" wildcard pattern for their sublineages.
+    '''
+    if "," in var:
+        patterns = []
+        for lineage in expand_pango_lineage(var):
+            patterns.append(lineage)
+            patterns.append(lineage + ".*")
+        return patterns
+    else:
+        return [var]
+
+
+class LineageResolver:
+    '''
+    Finds the clades file row for a pango lineage.
+
+    The pango_lineage column is compiled once into a prefix trie,
+    so a lineage is resolved in O(len(lineage)), and the resolver
+    can be saved to and loaded from a cache file.
+
+    By default (as in parse_pango_lineages), a lineage matches a
+    row if it starts with any of the row's expanded lineages. With
+    wildcards=True (as in parse_variants.py), it must instead equal
+    one of pango_lineage_patterns(), where "<lineage>.*" matches
+    any sublineage. Where several rows match, the last one is used.
+    '''
+
+    # trie keys marking the end of an exact and a prefix pattern; the
+    # other keys are single characters, so these can't clash with them
+    exact = "<exact>"
+    prefix = "<prefix>"
+    # bump this when the saved trie changes, to ignore old cache files
+    cache_version = 2
+
+    def __init__(self, clades=None, wildcards=False):
+        self.trie = {}
+        # position of the first row with the same pango_lineage entry
+        self.first_rows = []
+        # clades file rows, as dicts
+        self.records = []
+        if clades is not None:
+            first_row = {}
+            for position, var in enumerate(clades["pango_lineage"]):
+                self.first_rows.append(first_row.setdefault(var, position))
+                if wildcards:
+                    for pattern in pango_lineage_patterns(var):
+                        if pattern.endswith("*"):
+                            self.add(pattern[:-1], self.prefix, position)
+                        else:
+                            self.add(pattern, self.exact, position)
+                else:
+                    for lineage in expand_pango_lineage(var):
+                        self.add(lineage, self.prefix, position)
+            self.records = clades.to_dict("records")
+
+    def add(self, pattern, kind, position):
+        node = self.trie
+        for ch in pattern:
+            node = node.setdefault(ch, {})
+        # rows are added in order, so this keeps the last row
+        node[kind] = position
+
+    def resolve(self, lineage):
+        '''Returns the position of the (first row with the same
+        pango_lineage as the) last matching row, or None.'''
+        best = -1
+        node = self.trie
+        for ch in lineage:
+            best = max(best, node.get(self.prefix, -1))
+            node = node.get(ch)
+            if node is None:
+                break
+        else:
+            best = max(best, node.get(self.prefix, -1),
+                       node.get(self.exact, -1))
+        if best == -1:
+            return None
+        return self.first_rows[best]
+
+    def save(self, cache_file):
+        with atomic_write(cache_file) as fp:
+            json.dump({"version": self.cache_version, "trie": self.trie,
+                       "first_rows": self.first_rows,
+                       "records": self.records}, fp)
+
+    @classmethod
+    def load(cls, cache_file):
+        '''Returns the resolver saved in cache_file, or None if it was
+        saved by another version or can't be read.'''
+        resolver = cls()
+        try:
+            with open(cache_file) as fp:
+                saved = json.load(fp)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(saved, dict) or \
+                saved.get("version") != cls.cache_version:
+            return None
+        resolver.trie = saved["trie"]
+        resolver.first_rows = saved["first_rows"]
+        resolver.records = saved["records"]
+        return resolver
+
+
+def load_lineage_resolver(clade_file, cache_file=None):
+    '''
+    Returns a LineageResolver for the clades file, read from
+    cache_file if that is at least as new as the clades file.
+    Otherwise the clades file is parsed, and cache_file (if given)
+    is written for next time.
+    '''
+    if cache_file is not None and os.path.exists(cache_file) and \
+            os.path.getmtime(cache_file) >= os.path.getmtime(clade_file):
+        resolver = LineageResolver.load(cache_file)
+        if resolver is not None:
+            return resolver
+
+    clades = pd.read_csv(clade_file, sep='\t', header=0)
+    clades = clades.fillna('')
+    resolver = LineageResolver(clades)
+    if cache_file is not None:
+        resolver.save(cache_file)
+    return resolver
+
+
+def read_functional_annotations(annotation_file):
+    '''
+    Reads the functional annotations TSV, cleaned up and renamed for
+    merging into a GVF on 'Name' and 'protein_symbol'. All values
+    are strings.
+    '''
+    df = pd.read_csv(annotation_file, sep='\t', header=0)
+    # remove any leading/trailing spaces
+    for column in df.columns:
+        df[column] = df[column].astype(str).str.strip()
+
+    df = df.rename(columns={"original mutation description": "Name", "amino acid mutation alias":"Pokay_alias", 'mutation functional effect category':"function_category", \
+                            'mutation functional effect description':"function_description", 'URL':"source", 'protein symbol':'protein_symbol'})
+    df['citation'] = df['author'] + ' et al. (' + df['publication year'].str.replace(".0", "", regex=False) + ')'
+    return df
+
+
+def encode_strings(values):
+    '''
+    Encodes an array of strings as positions in a table of its unique
+    strings, kept as UTF-8 bytes and offsets so it can be saved to an
+    .npz file. Returns (codes, offsets, data).
+    '''
+    codes, strings = pd.factorize(
+        np.asarray(values, dtype=object).ravel())
+    encoded = [string.encode() for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(string) for string in encoded])
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return codes.astype(np.int32).reshape(np.shape(values)), offsets, data
+
+
+def decode_strings(codes, offsets, data):
+    '''
+    Returns the strings at positions 'codes' in a table made by
+    encode_strings(), as an object array. Only the strings used are
+    decoded.
+    '''
+    unique_codes, inverse = np.unique(codes, return_inverse=True)
+    data = data.tobytes()
+    strings = np.array([data[offsets[code]:offsets[code + 1]].decode()
+                        for code in unique_codes], dtype=object)
+    return strings[inverse].reshape(np.shape(codes))
+
+
+class FunctionalAnnotationIndex:
+    '''
+    The functional annotations, looked up by ('Name', 'protein_symbol').
+
+    Values are stored column by column as positions in one table of
+    unique strings (UTF-8 bytes and offsets), and the rows are
+    grouped by key, so the rows matching a GVF are found with one
+    np.searchsorted call and only their strings are decoded. The
+    index can be saved to and loaded from an uncompressed .npz file.
+    '''
+
+    def __init__(self, annotations=None):
+        if annotations is None:
+            return
+        self.columns = np.array(annotations.columns, dtype=str)
+        self.values, self.string_offsets, self.string_data = \
+            encode_strings(annotations.to_numpy(dtype=object))
+
+        # row numbers grouped by key, in row order within each key
+        row_keys = (annotations['Name'] + '\t' +
+                    annotations['protein_symbol']).to_numpy(dtype=str)
+        self.keys, key_rows = np.unique(row_keys, return_inverse=True)
+        self.key_order = np.argsort(key_rows, kind='stable')
+        self.key_starts = np.searchsorted(key_rows[self.key_order],
+                                          np.arange(len(self.keys) + 1))
+
+    def decode(self, codes):
+        '''Returns the strings at positions 'codes' in the string
+        table, as an object array.'''
+        return decode_strings(codes, self.string_offsets, self.string_data)
+
+    def lookup(self, names, protein_symbols):
+        '''Returns the annotation rows whose key is any of the given
+        ('Name', 'protein_symbol') pairs, in their order in the
+        annotations file.'''
+        keys = np.unique((pd.Series(names).astype(str).to_numpy() + '\t' +
+                          pd.Series(protein_symbols).astype(str).to_numpy())
+                         .astype(str))
+        positions = np.searchsorted(self.keys, keys)
+        found = positions < len(self.keys)
+        found[found] = self.keys[positions[found]] == keys[found]
+        positions = positions[found]
+
+        # concatenate the row ranges of the keys found
+        starts = self.key_starts[positions]
+        lengths = self.key_starts[positions + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        rows = np.sort(self.key_order[offsets + np.arange(lengths.sum())])
+
+        values = self.decode(self.values[rows])
+        return pd.DataFrame(dict((column, values[:, i])
+                                 for i, column in enumerate(self.columns)),
+                            columns=list(self.columns), dtype=object)
+
+    def save(self, index_file):
+        # np.savez adds '.npz' to names without it, so write to an
+        # open file instead
+        with atomic_write(index_file, "wb") as fp:
+            np.savez(fp, columns=self.columns, values=self.values,
+                     string_offsets=self.string_offsets,
+                     string_data=self.string_data, keys=self.keys,
+                     key_order=self.key_order, key_starts=self.key_starts)
+
+    @classmethod
+    def load(cls, index_file):
+        index = cls()
+        with np.load(index_file) as saved:
+            for name in ["columns", "values", "string_offsets",
+                         "string_data", "keys", "key_order", "key_starts"]:
+                setattr(index, name, saved[name])
+        return index
+
+
+class FunctionalAnnotationTable:
+    '''
+    The functional annotations as read from the TSV, with the same
+    lookup() as FunctionalAnnotationIndex. Used when there is no
+    index file to reuse, as encoding the strings of the whole table
+    costs more than one lookup saves.
+    '''
+
+    def __init__(self, annotations):
+        self.annotations = annotations
+        self.row_keys = annotations['Name'] + '\t' + \
+            annotations['protein_symbol']
+
+    def lookup(self, names, protein_symbols):
+        '''Returns the annotation rows whose key is any of the given
+        ('Name', 'protein_symbol') pairs, in their order in the
+        annotations file.'''
+        keys = pd.Series(names).astype(str).to_numpy() + '\t' + \
+            pd.Series(protein_symbols).astype(str).to_numpy()
+        rows = self.annotations[self.row_keys.isin(keys)]
+        return rows.reset_index(drop=True).astype(object)
+
+
+def load_annotation_index(annotation_file, index_file=None):
+    '''
+    Returns a FunctionalAnnotationIndex for the functional
+    annotations file, read from index_file if that is at least as
+    new as the annotations file. Otherwise the annotations file is
+    read, and index_file is written for next time. Without an
+    index_file, the annotations are looked up as read
+    (FunctionalAnnotationTable).
+    '''
+    if index_file is None:
+        return FunctionalAnnotationTable(
+            read_functional_annotations(annotation_file))
+
+    if os.path.exists(index_file) and \
+            os.path.getmtime(index_file) >= os.path.getmtime(annotation_file):
+        return FunctionalAnnotationIndex.load(index_file)
+
+    index = FunctionalAnnotationIndex(
+        read_functional_annotations(annotation_file))
+    index.save(index_file)
+    return index
+
+
 def parse_pango_lineages(strain, dataframe):
     '''
     Expands the pango_lineage column in the clades file into
@@ -198,63 +667,37 @@ def parse_pango_lineages(strain, dataframe):
     Returns the nested list, as well as the row index for
     the input strain (if found).
     '''
-    # initialize variables
-    who_lineages = []
-    var_to_match = 'None'
-    
-    # for each who_variant, expand the lineage names in
-    # pango_lineages and save these to a list
-    for var in dataframe["pango_lineage"]:
-        var_pango_lineages = []
-        if "," in var:
-            for temp in var.split(","):
-                if not "[" in var:
-                    var_pango_lineages.append(temp)
-                    var_pango_lineages.append(temp + ".*")
-                    if strain.startswith(temp):
-                        var_to_match = var
-                else:
-                    parent=temp[0]
-                    child=temp[2:-1].split("|")
-                    for c in child:
-                        var_pango_lineages.append(parent + str(c))
-                        var_pango_lineages.append(parent+str(c)+".*")
-                        if strain.startswith(parent + str(c)):
-                            var_to_match = var
-        else:
-            var_pango_lineages.append(var)
-            if strain.startswith(var):
-                var_to_match = var    
-        
-        # append the list for each variant to the larger
-        # list for all variants
-        who_lineages.append(var_pango_lineages)
-        
-        # get the row index for information on the input strain
-        if var_to_match != 'None':
-            strain_index = dataframe.index[dataframe['pango_lineage'] == \
-                                 var_to_match].tolist()[0]
-        else:
-            strain_index = 'n/a'
+    who_lineages = [pango_lineage_patterns(var)
+                    for var in dataframe["pango_lineage"]]
+
+    # get the row index for information on the input strain
+    position = LineageResolver(dataframe).resolve(strain)
+    if position is not None:
+        strain_index = dataframe.index[position]
+    else:
+        strain_index = 'n/a'
         
     return who_lineages, strain_index
 
 
 class get_variant_info:
 
-    def __init__(self, strain, clades):
+    def __init__(self, strain, clades=None, resolver=None):
 
-        # retrieve row number that matches the input strain
-        who_lineages, var_index = parse_pango_lineages(strain, clades)
+        # retrieve row that matches the input strain
+        if resolver is None:
+            resolver = LineageResolver(clades)
+        position = resolver.resolve(strain)
 
         # save status, WHO strain name, etc. from clades file
-        if var_index != 'n/a':
-            self.who_variant = clades.loc[var_index, 'variant']
-            self.variant_type = clades.loc[var_index, 'variant_type']
-            self.voi_designation_date = clades.loc[var_index, 'voi_designation_date']
-            self.voc_designation_date = clades.loc[var_index, 'voc_designation_date']
-            self.vum_designation_date = clades.loc[var_index, 'vum_designation_date']
-            self.status = clades.loc[var_index, 'status']
+        if position is not None:
+            record = resolver.records[position]
+            self.who_variant = record['variant']
+            self.variant_type = record['variant_type']
+            self.voi_designation_date = record['voi_designation_date']
+            self.voc_designation_date = record['voc_designation_date']
+            self.vum_designation_date = record['vum_designation_date']
+            self.status = record['status']
             self.strain_in_cladefile = True # flag
         else:
             self.strain_in_cladefile = False
@@ -264,20 +707,24 @@ def unnest_multi(df, columns, reset_index=False):
 # expands out columns of lists into 1d, as well as
 # duplicating other non-specified rows as needed.
 # all the lists must be the same length across columns in a given row, but
-# can vary between rows
-# adapted from https://stackoverflow.com/questions/21160134/flatten-a-column-with-value-of-type-list-while-duplicating-the-other-columns-va
-    df_flat = pd.DataFrame(columns=columns)
+# can vary between rows; rows with empty lists are dropped.
+# the list columns are exploded in lockstep: each row is repeated once per
+# list element (keeping its index label), and each column's lists are
+# concatenated into one flat column in the same order
+    lengths = df[columns[0]].str.len().to_numpy()
+    for col in columns[1:]:
+        if not np.array_equal(df[col].str.len().to_numpy(), lengths):
+            raise ValueError("lists in columns " + str(columns) +
+                             " must be the same length in each row")
+    rows = np.repeat(np.arange(len(df)), lengths)
+    df_flat = df.drop(labels=columns, axis=1).iloc[rows]
     for col in columns:
-        col_flat = pd.DataFrame([[i, x] 
-                       for i, y in df[col].apply(list).iteritems() 
-                           for x in y], columns=['I', col])
-        col_flat = col_flat.set_index('I')
-        df_flat[col] = col_flat
-    df = df.drop(labels=columns, axis=1)
-    df = df.merge(df_flat, left_index=True, right_index=True)
+        values = pd.Series(list(itertools.chain.from_iterable(df[col])),
+                           dtype=None if len(rows) > 0 else object)
+        df_flat[col] = values.to_numpy()
     if reset_index:
-        df = df.reset_index(drop=True)
-    return df
+        df_flat = df_flat.reset_index(drop=True)
+    return df_flat
 
 
 def select_snpeff_records(eff_string, ao_count):
@@ -344,16 +791,29 @@ def find_sample_size(table, lineage, vcf_file, wastewater):
     return sample_size
 
 
+def tokenize_INFO(info, keys):
+    # splits each INFO string into its key=value pairs in a single pass,
+    # returning a dataframe with one column per key in keys (NaN where
+    # a record doesn't have the key). If a key is repeated, the first
+    # value is used.
+    keys_to_keep = set(keys)
+    rows = []
+    for info_str in info:
+        values = {}
+        if isinstance(info_str, str):
+            for field in info_str.split(';'):
+                key, sep, value = field.partition('=')
+                if sep and key in keys_to_keep and key not in values:
+                    values[key] = value
+        rows.append([values.get(key, np.nan) for key in keys])
+    return pd.DataFrame(rows, columns=keys, index=info.index)
+
 
-    
 def parse_INFO(df, var_cols): # return INFO dataframe with named columns, including EFF split apart
 
     # extract these key-value pairs in INFO into their own columns
     cols_to_extract = ['DP', 'ps_filter', 'ps_exc', 'EFF', 'mat_pep', 'mat_pep_desc', 'mat_pep_acc']
-    info = pd.DataFrame(columns=cols_to_extract)
-    for col in cols_to_extract:
-        pat = str(col) + "\=(.*?)\;"
-        info[col] = df['INFO'].str.extract(pat)
+    info = tokenize_INFO(df['INFO'], cols_to_extract)
     # rename uppercase columns as lowercase
     info = info.rename(columns={'DP':'dp', 'EFF':'eff'})
 
@@ -392,6 +852,18 @@ def parse_INFO(df, var_cols): # return INFO dataframe with named columns, includ
         df = unnest_multi(df, ["eff_result", "ao", "ALT", "type"], reset_index=True)
     else:
         df = unnest_multi(df, ["eff_result", "ao", "ALT"], reset_index=True)
+
+    df = parse_EFF_records(df)
+
+    return(df)
+
+
+def parse_EFF_records(df):
+    # second half of parse_INFO, on one row per alternate allele:
+    # names the selected EFF record's fields and derives the mutation
+    # names from them. 'eff_result', 'ao', 'dp', 'REF', 'ALT' and 'POS'
+    # must all be strings.
+
     # calculate Alternate Frequency
     df['AF'] = df['ao'].astype(int) / df['dp'].astype(int)
 
@@ -478,12 +950,14 @@ def split_names(names_to_split, new_gvf, col_to_split):
     return(new_gvf)
 
 
-def map_pos_to_gene_protein(pos, GENE_PROTEIN_POSITIONS_DICT):
+def map_pos_to_gene_protein(pos, GENE_PROTEIN_POSITIONS_DICT, cds_index=None):
     """This function is inspired/lifted from Ivan's code.
     Map a series of nucleotide positions to SARS-CoV-2 genes.
     See https://www.ncbi.nlm.nih.gov/nuccore/MN908947.
     :param pos: Nucleotide position pandas series from VCF
     :param GENE_PROTEIN_POSITIONS_DICT: Dictionary of gene positions from cov_lineages
+    :param cds_index: optional prebuilt GenePositionIndex of CDS regions,
+    eg. from gene_positions.load_gene_position_indices()
     :type pos: int
     :return: series containing SARS-CoV-2 chromosome region names at each
     nucleotide position in ``pos``
@@ -491,29 +965,18 @@ def map_pos_to_gene_protein(pos, GENE_PROTEIN_POSITIONS_DICT):
     # make nucleotide positions series into a df
     df = pos.to_frame()
     pos_column = df.columns[0]
-    # add new empty (NaN) columns
-    cols_to_use = [pos_column, "gene", "protein_name", "protein_symbol", "protein_id"]
-    df = df.reindex(columns = cols_to_use) 
-
-    # loop through all CDS regions in dict to get attributes
-    for entry in GENE_PROTEIN_POSITIONS_DICT.keys():
-        if GENE_PROTEIN_POSITIONS_DICT[entry]["type"]=="CDS" and ("protein_alias" in GENE_PROTEIN_POSITIONS_DICT[entry].keys()):
-            # extract values from JSON entry
-            start = GENE_PROTEIN_POSITIONS_DICT[entry]["start"]
-            end = GENE_PROTEIN_POSITIONS_DICT[entry]["end"]
-            #aa_start = GENE_PROTEIN_POSITIONS_DICT[entry]["aa_start"]
-            #aa_end = GENE_PROTEIN_POSITIONS_DICT[entry]["aa_end"]
-            gene = GENE_PROTEIN_POSITIONS_DICT[entry]["gene"]
-            protein_name = GENE_PROTEIN_POSITIONS_DICT[entry]["product"]
-            protein_symbol = GENE_PROTEIN_POSITIONS_DICT[entry]["protein_alias"]
-            protein_id = GENE_PROTEIN_POSITIONS_DICT[entry]["protein_id"]
-
-            # fill in attributes for mutations in this CDS region
-            cds_mask = df[pos_column].astype(int).between(start, end, inclusive="both")
-            df.loc[cds_mask, "gene"] = gene
-            df.loc[cds_mask, "protein_name"] = protein_name
-            df.loc[cds_mask, "protein_symbol"] = protein_symbol
-            df.loc[cds_mask, "protein_id"] = protein_id
+
+    # index all CDS regions in dict that have a protein alias
+    if cds_index is None:
+        cds_index = GenePositionIndex(GENE_PROTEIN_POSITIONS_DICT, "CDS",
+                                      required_keys=["protein_alias"])
+
+    # fill in attributes for mutations in each CDS region
+    positions = df[pos_column].astype(int)
+    df["gene"] = cds_index.lookup_values(positions, "gene")
+    df["protein_name"] = cds_index.lookup_values(positions, "product")
+    df["protein_symbol"] = cds_index.lookup_values(positions, "protein_alias")
+    df["protein_id"] = cds_index.lookup_values(positions, "protein_id")
 
     # label all mutations that didn't belong to any gene as "intergenic"
     df.loc[df["gene"].isna(), "gene"] = "intergenic"
@@ -541,57 +1004,46 @@ def add_alias_names(df, GENE_PROTEIN_POSITIONS_DICT):
     '''Creates alias names for Orf1ab mutations, reindexing the amino acid numbers.'''
     df.loc[:, 'alias'] = 'n/a'
 
-    # get list of all NSP, 3CL, and PlPro proteins in the file:
-    alias_mask = (df['gene'].str.contains("ORF1ab")) & (df['mat_pep']!='n/a')
-    nsps_list = sorted(list(set(df[alias_mask]['mat_pep'].tolist())))
-    if len(nsps_list) > 0:
-        
-        ## note: gene and protein_name are based on our gene positions JSON
-
-        # split up all names in alias_mask into letter-number-letter columns
-        # hacky workaround to fix later: in rows that begin with a number, add "PLACEHOLDER" to the front before splitting them up, to stop NaNs
-        df.loc[df['Name'].str[0].str.isdigit(), 'Name'] = "PLACEHOLDER" + df['Name'].astype(str)
-
-        # split at underscores
-        if df['Name'].str.contains("_").any():
-            df[['mutation_1', 'mutation_2']] = df['Name'].str.split('_', expand=True)
-        else:
-            df['mutation_1'] = df['Name']
-            df['mutation_2'] = None
-        
-        df[['1_start', '1_num', '1_end']] = df['mutation_1'].str.extract('([A-Za-z]+)(\\d+\\.?\\d*)([A-Za-z]*)', expand=True)
-        df['1_num'] = df['1_num'].fillna(0)
-        df['1_newnum'] = 0
-        
-        df[['2_start', '2_num', '2_end']] = df['mutation_2'].str.extract('([A-Za-z]+)(\\d+\\.?\\d*)([A-Za-z]*)', expand=True)
-        df['2_num'] = df['2_num'].fillna(0)
-        df['2_newnum'] = 0
-        
-        # for each nsp in nsps_list, operate on the number column based on the nsp start coordinates
-        for nsp in nsps_list:
-            nsp_start_aa = int(GENE_PROTEIN_POSITIONS_DICT[nsp]["aa_start"])
-            nsp_mask = df['mat_pep']==nsp
-            # for each half of the mutation name...
-            # update the numeric part
-            df.loc[nsp_mask, '1_newnum'] = df['1_num'].astype(int) - nsp_start_aa + 1
-            df.loc[nsp_mask, '2_newnum'] = df['2_num'].astype(int) - nsp_start_aa + 1
-            # put the three columns back together into a column called '1_alias' or '2_alias'
-            df.loc[nsp_mask, '1_alias'] = df['1_start'] + df['1_newnum'].astype(str) + df['1_end']
-            df.loc[nsp_mask, '2_alias'] = df['2_start'] + df['2_newnum'].astype(str) + df['2_end']
-        
-        # put both halves of the alias back together with a new underscore in the middle, for all ORF1ab rows
-        df.loc[alias_mask, 'alias'] = df['1_alias'].astype(str) + '_' + df['2_alias'].astype(str)
+    # aa_start of each mature peptide in the gene positions JSON
+    aa_starts = pd.Series(dict(
+        (entry, int(values["aa_start"]))
+        for entry, values in GENE_PROTEIN_POSITIONS_DICT.items()
+        if "aa_start" in values), dtype=np.int64)
 
-        # remove the placeholder
-        df['Name'] = df['Name'].str.replace("PLACEHOLDER","")
-        df['alias'] = df['alias'].str.replace("PLACEHOLDER","")
-        
-        # remove nans
-        df['alias'] = df['alias'].str.replace("nan_nan", "")
-        df['alias'] = df['alias'].str.replace("_nan", "")
-        
-        cols_to_drop = [col for col in df.columns if (("1" in col) or ("2" in col))]
-        df = df.drop(columns=cols_to_drop)
+    ## note: gene and protein_name are based on our gene positions JSON
+    # all NSP, 3CL, and PlPro mutations in the file
+    alias_mask = (df['gene'].str.contains("ORF1ab")) & (df['mat_pep']!='n/a')
+    if alias_mask.any():
+        # a mature peptide without an aa_start can not be renumbered
+        unknown = sorted(set(df.loc[alias_mask, 'mat_pep']) -
+                         set(aa_starts.index))
+        if len(unknown) > 0:
+            raise KeyError("no aa_start in the gene positions JSON for "
+                           "mat_pep " + ", ".join(map(str, unknown)))
+        nsp_start_aa = df.loc[alias_mask, 'mat_pep'].map(aa_starts)
+
+        # names that begin with a number get a letter prefix, so they
+        # still split up into letter-number-letter parts below
+        names = df.loc[alias_mask, 'Name'].astype(str)
+        names = names.where(~names.str[0].str.isdigit(), "PLACEHOLDER" + names)
+
+        # renumber each half of the name (split at the underscore) from
+        # the start of its mature peptide
+        halves = names.str.split('_', n=1, expand=True).reindex(
+            columns=[0, 1]).astype(object)
+        half_aliases = []
+        for half in [0, 1]:
+            parts = halves[half].str.extract('([A-Za-z]+)(\\d+\\.?\\d*)([A-Za-z]*)', expand=True)
+            new_num = parts[1].fillna(0).astype(int) - nsp_start_aa + 1
+            half_aliases.append(parts[0] + new_num.astype(str) + parts[2])
+
+        # put both halves of the alias back together with a new underscore
+        # in the middle, then remove the placeholder and missing halves
+        alias = half_aliases[0].astype(str) + '_' + half_aliases[1].astype(str)
+        alias = alias.str.replace("PLACEHOLDER", "", regex=False)
+        alias = alias.str.replace("nan_nan", "", regex=False)
+        alias = alias.str.replace("_nan", "", regex=False)
+        df.loc[alias_mask, 'alias'] = alias
     
     return df
         
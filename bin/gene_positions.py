@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+
+Lookup structures for the gene positions JSON written by gff2json.py.
+
+gff2json.py also writes a compiled copy of the JSON next to it (same
+name, '.npz' extension): feature coordinates as NumPy arrays, attribute
+values as indices into one interned string table, and the ready-made
+segment arrays of each GenePositionIndex. load_gene_position_indices()
+reads it when it is present and up to date, and otherwise builds the same
+lookup structures from the JSON.
+
+This module only depends on numpy, so it can be used by the cyvcf2-based
+scripts as well as by functions.py.
+
+"""
+
+import os
+import json
+import numpy as np
+
+
+# feature types indexed by default, with the keys a feature must have to
+# be included (CDS regions without a protein alias are not mapped)
+indexed_features = {"CDS": ["protein_alias"],
+                    "mature_protein_region_of_CDS": []}
+
+# string attributes of each feature kept in the compiled file
+compiled_attributes = ["gene", "product", "protein_alias", "protein_id",
+                       "Note", "ID", "Name"]
+# integer attributes of each feature kept in the compiled file
+compiled_int_attributes = ["aa_start", "aa_end"]
+
+
+class GenePositionIndex:
+    """Precomputed lookup of nucleotide positions to the features of one
+    type in the gene positions JSON.
+    The features' start/end coordinates are cut into non-overlapping
+    segments, each labelled with the feature covering it, so a batch of
+    positions is resolved with one np.searchsorted call.
+    Where features overlap, the one listed last in the JSON is used, the
+    same as when looping over the JSON and overwriting earlier matches.
+    :param GENE_PROTEIN_POSITIONS_DICT: Dictionary of gene positions
+    :param feature_type: JSON "type" of the features to index, eg. "CDS"
+    :param required_keys: only index features that have all these keys
+    """
+
+    def __init__(self, GENE_PROTEIN_POSITIONS_DICT, feature_type,
+                 required_keys=()):
+        self.features = [entry for entry in GENE_PROTEIN_POSITIONS_DICT.keys()
+                         if GENE_PROTEIN_POSITIONS_DICT[entry]["type"] == feature_type
+                         and all(key in GENE_PROTEIN_POSITIONS_DICT[entry].keys()
+                                 for key in required_keys)]
+        self.feature_values = [GENE_PROTEIN_POSITIONS_DICT[entry]
+                               for entry in self.features]
+        starts = np.array([int(GENE_PROTEIN_POSITIONS_DICT[entry]["start"])
+                           for entry in self.features], dtype=np.int64)
+        ends = np.array([int(GENE_PROTEIN_POSITIONS_DICT[entry]["end"])
+                         for entry in self.features], dtype=np.int64)
+
+        # segment boundaries; segment i covers [bounds[i], bounds[i+1])
+        self.bounds = np.unique(np.concatenate([starts, ends + 1]))
+        # label each segment with the last feature (in JSON order)
+        # that covers it, or -1 if no feature does
+        self.segment_feature = np.full(len(self.bounds), -1, dtype=np.int64)
+        for i in range(len(self.features)):
+            first = np.searchsorted(self.bounds, starts[i])
+            last = np.searchsorted(self.bounds, ends[i] + 1)
+            self.segment_feature[first:last] = i
+
+    @classmethod
+    def from_arrays(cls, features, feature_values, bounds, segment_feature):
+        """Creates an index from precomputed segment arrays, eg. as read
+        from a compiled gene positions file."""
+        index = cls.__new__(cls)
+        index.features = features
+        index.feature_values = feature_values
+        index.bounds = bounds
+        index.segment_feature = segment_feature
+        return index
+
+    def lookup(self, pos):
+        """Returns the position in self.features of the feature that each
+        nucleotide position falls in, or -1 for positions outside all
+        features."""
+        pos = np.asarray(pos, dtype=np.int64)
+        if len(self.bounds) == 0:
+            return np.full(pos.shape, -1, dtype=np.int64)
+        segment = np.searchsorted(self.bounds, pos, side="right") - 1
+        found = self.segment_feature[np.clip(segment, 0, None)]
+        return np.where(segment >= 0, found, -1)
+
+    def lookup_values(self, pos, key):
+        """Returns the value of 'key' of the feature that each nucleotide
+        position falls in, or NaN for positions outside all features."""
+        values = np.array([feature[key] for feature in self.feature_values]
+                          + [np.nan], dtype=object)
+        # -1 (no feature) picks the trailing NaN
+        return values[self.lookup(pos)]
+
+
+def build_gene_position_indices(GENE_PROTEIN_POSITIONS_DICT):
+    """Returns a GenePositionIndex for each feature type in
+    indexed_features, keyed by feature type."""
+    return dict((feature_type, GenePositionIndex(GENE_PROTEIN_POSITIONS_DICT,
+                                                 feature_type, required_keys))
+                for feature_type, required_keys in indexed_features.items())
+
+
+def compiled_path(json_file_path):
+    """Returns the path of the compiled copy of a gene positions JSON."""
+    return os.path.splitext(json_file_path)[0] + ".npz"
+
+
+def save_compiled_gene_positions(GENE_PROTEIN_POSITIONS_DICT, npz_file_path):
+    """Writes the features of the gene positions JSON and the segment
+    arrays of each GenePositionIndex to an uncompressed .npz file."""
+    entries = list(GENE_PROTEIN_POSITIONS_DICT.keys())
+
+    # intern all strings into one table, referred to by position
+    strings = {}
+    def intern(value):
+        if value not in strings:
+            strings[value] = len(strings)
+        return strings[value]
+
+    arrays = {}
+    arrays["entries"] = np.array([intern(entry) for entry in entries],
+                                 dtype=np.int32)
+    arrays["types"] = np.array(
+        [intern(GENE_PROTEIN_POSITIONS_DICT[entry]["type"]) for entry in entries],
+        dtype=np.int32)
+    for coordinate in ["start", "end"] + compiled_int_attributes:
+        arrays[coordinate] = np.array(
+            [int(GENE_PROTEIN_POSITIONS_DICT[entry].get(coordinate, -1))
+             for entry in entries], dtype=np.int64)
+    # -1 marks attributes the feature doesn't have
+    arrays["attributes"] = np.array(
+        [[intern(str(GENE_PROTEIN_POSITIONS_DICT[entry][key]))
+          if key in GENE_PROTEIN_POSITIONS_DICT[entry] else -1
+          for key in compiled_attributes] for entry in entries],
+        dtype=np.int32).reshape(len(entries), len(compiled_attributes))
+
+    # ready-made segment arrays of each index
+    position = dict((entry, i) for i, entry in enumerate(entries))
+    indices = build_gene_position_indices(GENE_PROTEIN_POSITIONS_DICT)
+    for feature_type, index in indices.items():
+        arrays[feature_type + "_features"] = np.array(
+            [position[entry] for entry in index.features], dtype=np.int32)
+        arrays[feature_type + "_bounds"] = index.bounds
+        arrays[feature_type + "_segment_feature"] = index.segment_feature
+
+    arrays["strings"] = np.array(list(strings.keys()), dtype=str)
+    np.savez(npz_file_path, **arrays)
+
+
+def load_compiled_gene_positions(npz_file_path):
+    """Reads a compiled gene positions file, returning a GenePositionIndex
+    for each feature type in indexed_features, keyed by feature type."""
+    with np.load(npz_file_path) as compiled:
+        strings = compiled["strings"].tolist()
+        entries = [strings[i] for i in compiled["entries"]]
+        types = compiled["types"]
+        attributes = compiled["attributes"]
+        int_attributes = dict((key, compiled[key])
+                              for key in ["start", "end"] + compiled_int_attributes)
+
+        def feature_values(i):
+            # rebuild the compiled part of one JSON entry
+            values = {"type": strings[types[i]]}
+            for key in ["start", "end"] + compiled_int_attributes:
+                if int_attributes[key][i] != -1:
+                    values[key] = int(int_attributes[key][i])
+            for j, key in enumerate(compiled_attributes):
+                if attributes[i, j] != -1:
+                    values[key] = strings[attributes[i, j]]
+            return values
+
+        indices = {}
+        for feature_type in indexed_features.keys():
+            features = compiled[feature_type + "_features"].tolist()
+            indices[feature_type] = GenePositionIndex.from_arrays(
+                [entries[i] for i in features],
+                [feature_values(i) for i in features],
+                compiled[feature_type + "_bounds"],
+                compiled[feature_type + "_segment_feature"])
+
+    return indices
+
+
+def load_gene_position_indices(json_file_path, GENE_PROTEIN_POSITIONS_DICT=None):
+    """Returns a GenePositionIndex for each feature type in
+    indexed_features, keyed by feature type.
+    The compiled copy of the JSON is used if it exists and is not older
+    than the JSON; otherwise the indices are built from the JSON (read
+    from json_file_path if GENE_PROTEIN_POSITIONS_DICT is not given)."""
+    npz_file_path = compiled_path(json_file_path)
+    if os.path.exists(npz_file_path) and \
+            os.path.getmtime(npz_file_path) >= os.path.getmtime(json_file_path):
+        return load_compiled_gene_positions(npz_file_path)
+
+    if GENE_PROTEIN_POSITIONS_DICT is None:
+        with open(json_file_path) as fp:
+            GENE_PROTEIN_POSITIONS_DICT = json.load(fp)
+    return build_gene_position_indices(GENE_PROTEIN_POSITIONS_DICT)
@@ -5,6 +5,7 @@ import os
 import json
 import argparse
 import math
+from gene_positions import save_compiled_gene_positions, compiled_path
 
 
 def add_color(dict, colors):
@@ -149,6 +150,9 @@ def gff_to_json(gff_file_path, json_file_path, colors_list, alias_dic):
     with open(json_file_path, "w") as json_file:
         json_file.write(json_str)
 
+    # Write the compiled copy (NumPy arrays) next to the JSON file
+    save_compiled_gene_positions(features, compiled_path(json_file_path))
+
 
 def parse_args():
     parser = argparse.ArgumentParser(
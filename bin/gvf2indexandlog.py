@@ -7,19 +7,32 @@ Created on Fri Feb 16 12:00:04 2024
 @author: madeline
 
 Given one GVF, creates a mutation index TSV and a logfile TSV.
+
+Given many GVFs (--gvf_files), their index rows are extracted in parallel
+and one index and one log are written for the whole batch, each merged and
+sorted by pos the same as merge_indices.py and merge_logfiles.py would
+merge the per-GVF files.
 '''
 
 import pandas as pd
 import numpy as np
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 from functions import separate_attributes
+from mutation_index_store import merge_rows
 
 
 def parse_args():
     parser = argparse.ArgumentParser(
-        description='Creates an index TSV and a log TSV from one GVF')
+        description='Creates an index TSV and a log TSV from one or more GVFs')
     parser.add_argument('--gvf_file', type=str, default=None,
                         help='Path to one GVF file to process')
+    parser.add_argument('--gvf_files', type=str, default=None, nargs='*',
+                        help='Paths to a batch of GVF files, merged into '
+                             'one index and one log')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Number of processes used to read the GVF '
+                             'files of a batch in parallel')
     parser.add_argument('--index_savefile', type=str,
                         default=None, help='Filename to save updated index of all mutations to')
     parser.add_argument('--log_savefile', type=str,
@@ -28,14 +41,10 @@ def parse_args():
     return parser.parse_args()
 
 
-if __name__ == '__main__':
-
-    args = parse_args()
-    gvf_file = args.gvf_file
-    index_savefile = args.index_savefile
-    log_savefile = args.log_savefile
-
-
+def gvf2index(gvf_file):
+    '''
+    Returns the mutation index rows of one GVF, sorted by pos.
+    '''
     # read in gvf
     gvf_columns = ['#seqid', '#source', '#type', '#start', '#end',
                 '#score', '#strand', '#phase', '#attributes']
@@ -67,10 +76,15 @@ if __name__ == '__main__':
     # tidying
     index = index.drop_duplicates()
     index = index.dropna(axis=0)
-    # save index
-    index.to_csv(index_savefile, sep='\t', header=True, index=False)
+    # sort by pos, so indices and logs can be merged with --presorted
+    index = index.iloc[np.argsort(index['pos'].astype(int).to_numpy(), kind='stable')]
+    return index
+
 
-    # create log from index
+def index2log(index):
+    '''
+    Returns the log rows ('pos', 'new_mutations', 'lineages') of an index.
+    '''
     log = index.copy()
     # fill in 'new_mutations' column like: "gene:mutation"
     log['new_mutations'] = log["gene"] + ":" + log["mutation"]
@@ -82,6 +96,48 @@ if __name__ == '__main__':
     log = log[log['pos'].notna()]
     # ensure pos is integer type
     log['pos'] = log['pos'].astype(int)
+    return log
+
+
+def gvf2indexandlog(gvf_file):
+    # index and log rows of one GVF, with pos as an integer
+    index = gvf2index(gvf_file)
+    index['pos'] = index['pos'].astype(int)
+    return index, index2log(index)
+
+
+def batch2indexandlog(gvf_files, jobs=1):
+    '''
+    Returns one index and one log for a batch of GVFs, each sorted by pos,
+    with the rows of each mutation merged and their lineages joined in the
+    order of gvf_files.
+    '''
+    if jobs > 1 and len(gvf_files) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(gvf2indexandlog, gvf_files))
+    else:
+        results = [gvf2indexandlog(gvf_file) for gvf_file in gvf_files]
+    # missing values are filled in as 'n/a', as when merging indices and logs
+    index = merge_rows(pd.concat([index for index, _ in results],
+                                 ignore_index=True).fillna('n/a'))
+    log = merge_rows(pd.concat([log for _, log in results],
+                               ignore_index=True).fillna('n/a'))
+    return index, log
+
+
+if __name__ == '__main__':
+
+    args = parse_args()
+    index_savefile = args.index_savefile
+    log_savefile = args.log_savefile
+
+    if args.gvf_files is not None:
+        index, log = batch2indexandlog(args.gvf_files, args.jobs)
+    else:
+        index = gvf2index(args.gvf_file)
+        log = index2log(index)
+
+    # save index
+    index.to_csv(index_savefile, sep='\t', header=True, index=False)
     # save log with column headers: ['pos', 'new_mutations', 'lineages']
     log.to_csv(log_savefile, sep='\t', header=True, index=False)
-
@@ -13,7 +13,16 @@ import argparse
 import pandas as pd
 import os
 import re
-from functions import separate_attributes
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functions import separate_attributes, pango_lineage_patterns
+
+# GVF files converted by gvf2tsv() and stats tables read for
+# find_variant_pop_size(), keyed by file path and modification time, so
+# that each file is only read once when making several variant reports
+gvf_cache = dict()
+stats_table_cache = dict()
 
 
 def parse_args():
@@ -41,38 +50,91 @@ def parse_args():
                              'workflow that contains num_seqs column')
     parser.add_argument('--user', action="store_true",
                         help='Use user-uploaded file')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Number of processes used to read GVF files '
+                             'and make variant reports in parallel')
 
     return parser.parse_args()
 
 
+class LineageFileIndex:
+    """
+    Index of GVF (or stats table) filenames for matching them to pango
+    lineages: a sorted list for prefix matches, and buckets of files by
+    the lineage before the first '_' of their name for exact matches.
+    :param files: list of filenames, named <lineage>_<...>
+    """
+
+    def __init__(self, files):
+        self.files = list(files)
+        self.sorted_files = sorted(set(self.files))
+        self.by_lineage = dict()
+        for i in self.files:
+            self.by_lineage.setdefault(i[:i.find("_")], []).append(i)
+
+    def startswith(self, prefix):
+        """Returns the (sorted, unique) filenames starting with prefix."""
+        first = bisect_left(self.sorted_files, prefix)
+        last = first
+        while last < len(self.sorted_files) and \
+                self.sorted_files[last].startswith(prefix):
+            last += 1
+        return self.sorted_files[first:last]
+
+    def lineage(self, lineage):
+        """Returns the filenames of one lineage, in their original
+        order."""
+        return list(self.by_lineage.get(lineage, []))
+
+
 def match_gvfs_to_who_variant(pango_lineage_list, gvf_files_list):
+    # gvf_files_list is a list of filenames or a LineageFileIndex of them
+    if not isinstance(gvf_files_list, LineageFileIndex):
+        gvf_files_list = LineageFileIndex(gvf_files_list)
+
     matched_files = []
     if len(pango_lineage_list) > 1:
+        # files starting with any of the lineages ('*' removed)
+        matched_files = set()
         for lineage in pango_lineage_list:
             if "*" in lineage:
                 lineage = lineage.replace("*", "")
-            matched_files.extend([i for i in gvf_files_list if
-                                  i.startswith(lineage)])
-
-            matched_files = sorted(set(matched_files))
+            matched_files.update(gvf_files_list.startswith(lineage))
+        matched_files = sorted(matched_files)
     else:
+        # files of exactly this lineage
         for lineage in pango_lineage_list:
-        #    matched_files.extend([i for i in gvf_files_list if
-        #                          i.startswith(lineage)])
-            matched_files = ([i for i in gvf_files_list if
-                            i[:i.find("_")]==lineage])
+            matched_files = gvf_files_list.lineage(lineage)
 
     return matched_files
 
 
+def file_key(path):
+    # cache key of a file: its path and modification time
+    return (os.path.abspath(path), os.path.getmtime(path))
+
+
+def read_stats_table(table):
+    """
+    Reads the file and num_seqs columns of a multi-strain stats table,
+    only once per table, with a LineageFileIndex of its files.
+    """
+    key = file_key(table)
+    if key not in stats_table_cache:
+        strain_tsv_df = pd.read_csv(table, header=0,
+                                    delim_whitespace=True, thousands=r',',
+                                    usecols=['file', 'num_seqs'])
+        stats_table_cache[key] = (strain_tsv_df, LineageFileIndex(
+            strain_tsv_df['file'].tolist()))
+    return stats_table_cache[key]
+
+
 def find_variant_pop_size(table, pango_lineage_list):
-    strain_tsv_df = pd.read_csv(table, header=0,
-                                delim_whitespace=True, thousands=r',',
-                                usecols=['file', 'num_seqs'])
+    strain_tsv_df, file_index = read_stats_table(table)
 
     files = match_gvfs_to_who_variant(
         pango_lineage_list=pango_lineage_list,
-        gvf_files_list=strain_tsv_df['file'].tolist())
+        gvf_files_list=file_index)
     # print(files)
 
     pop_size = strain_tsv_df.loc[strain_tsv_df['file'].isin(
@@ -80,78 +142,6 @@ def find_variant_pop_size(table, pango_lineage_list):
     return pop_size
 
 
-def add_ao_by_variant_seq(ao_str, variant_seq_str):
-    """
-    Takes a pair of strings like ao_str="7,7,24" and
-    variant_seq_str="T,T,T" or "8,21,3" and "T,T,A".
-    Output should be a string "T=38" (first case) or "T=29, A=3" (
-    second case).
-    """
-    ao_list = ao_str.split(',')
-    ao_list = [int(x) for x in ao_list]
-    var_str_list = variant_seq_str.split(',')
-    zipped_lists = list(zip(var_str_list, ao_list))
-
-    ao_dict = dict()
-    for pair in zipped_lists:
-        # if a variant seq isn't in the dictionary, add it
-        if pair[0] not in ao_dict:
-            ao_dict[pair[0]] = pair[1]
-        # if it's already there, add this ao to the existing key
-        else:
-            ao_dict[pair[0]] += pair[1]
-
-    # create 3 strings: one for ao, one for var_seq, one for both
-    # joined together with an '=' between
-    joined_string = ''
-    ao_string = ''
-    var_string = ''
-    for item in list(ao_dict.items()):
-        joined_string = joined_string + item[0] + '=' + str(item[1]) \
-                        + ', '
-        ao_string = ao_string + str(item[1]) + ','
-        var_string = var_string + item[0] + ','
-    joined_string = joined_string.rstrip(", ")
-    ao_string = ao_string.rstrip(", ")
-    var_string = var_string.rstrip(", ")
-
-    return joined_string, ao_string, var_string
-
-
-def add_one_from_each_lineage(count_str, lineage_str, mode):
-    """
-    Takes a pair of strings like count_str="7,7,24" and
-    lineage_str="Q.3,Q.3,Q.1".
-    Output should be a string "31", adding unique lineage
-    values only, if mode='add'.
-    If mode='comma', returns a comma-separated set of values,
-    like "7,24".
-    """
-    count_list = count_str.split(';')
-    if mode == 'add':
-        count_list = [int(x) for x in count_list]
-    lineage_str_list = lineage_str.replace(" ", "")
-    lineage_str_list = lineage_str.split(',')
-    zipped_lists = list(zip(lineage_str_list, count_list))
-
-    count_dict = dict()
-    for pair in zipped_lists:
-        # if a lineage isn't in the dictionary, add it
-        if pair[0] not in count_dict:
-            count_dict[pair[0]] = pair[1]
-        # if it's already there, do nothing
-
-    # if mode=='comma', return a comma-separated string of values
-    if mode == 'comma':
-        return_str = ','.join(list(count_dict.values()))
-    # elif mode=='add', add up all the keys and return the value as a
-    # string
-    elif mode == 'add':
-        return_str = str(sum(list(count_dict.values())))
-
-    return return_str
-
-
 def gvf2tsv(gvf):
     # read in gvf
     gvf_columns = ['#seqid', '#source', '#type', '#start', '#end',
@@ -204,70 +194,138 @@ def streamline_user(tsv_df):
     return tsv_df
 
 
-def streamline_tsv(tsv_df):
+def unique_pairs(row):
+    """
+    Drops repeated key-value pairs from a clade_defining_status string
+    like "Q.1=False;  Q.1=False; Q.3=True", returning "Q.1=False, Q.3=True"
+    (in set order).
+    """
+    if ' ' not in row:
+        return row
+    newlist = [pair.replace(';', '').lstrip(' ') for pair in row.split('; ')]
+    return ', '.join(str(e) for e in list(set(newlist)))
+
+
+def unique_lineages(row):
+    """
+    Drops repeated lineage names from a viral_lineages string like
+    "Q.1, Q.1, Q.3", returning "Q.1, Q.3" (in set order).
+    """
+    if ' ' not in row:
+        return row
+    return ', '.join(str(e) for e in list(set(row.split(', '))))
+
+
+def drop_repeats(values, dedup):
+    """
+    Applies dedup (unique_pairs or unique_lineages) to a column, going
+    through the rows in order and updating every row that holds the same
+    value at the time, like masking the whole column once per row would.
+    A row can be deduplicated more than once this way, and as set order
+    depends on insertion order, that can change its order again.
+    Returns a list of the new values.
+    """
+    codes, distinct = pd.factorize(values)
+    # current value of each distinct original value, and the distinct
+    # original values holding each current value
+    current = list(distinct)
+    holders = dict()
+    for i, value in enumerate(current):
+        holders.setdefault(value, []).append(i)
+    deduped = dict()
+    for code in codes:
+        value = current[code]
+        if value not in deduped:
+            deduped[value] = dedup(value)
+        if deduped[value] == value:
+            continue
+        moved = holders.pop(value)
+        for i in moved:
+            current[i] = deduped[value]
+        holders.setdefault(deduped[value], []).extend(moved)
+    return [current[code] for code in codes]
+
+
+def join_by_group(values, groups, sep):
+    # join string values within each group, keeping row order
+    return values.groupby(groups).agg(sep.join)
+
+
+def streamline_tsv(tsv_df, variant_pop_size='n/a'):
     # find identical rows across strains, and keep only one row.
     # change n/a to 0 in 'ao' for counting purposes
     tsv_df['ao'] = tsv_df['ao'].str.replace("n/a", "0")
 
-    '''
-    # make ro, dp, and obs_sample_size numeric
-    for colname in ['ro', 'dp', 'obs_sample_size']:
-        tsv_df[colname] = pd.to_numeric(tsv_df[colname],
-                                        errors='coerce')
-    '''
     # make obs_sample_size numeric
     tsv_df['obs_sample_size'] = pd.to_numeric(tsv_df['obs_sample_size'],
                                               errors='coerce')
 
-    agg_dict = dict((col, 'first') for col in
-                    tsv_df.columns.values.tolist())
-
-    agg_dict['obs_sample_size'] = 'sum'
-    # join some columns with commas
-    agg_dict['viral_lineages'] = ', '.join
-    agg_dict['clade_defining'] = ','.join
-    agg_dict['ao'] = ';'.join
-    agg_dict['dp'] = ';'.join
-    agg_dict['ro'] = ';'.join
-    agg_dict['variant_seq'] = ','.join
-
     cols_to_check = ['name', 'nt_name', 'aa_name', 'multi_aa_name',
                      'multiaa_comb_mutation', 'start',
                      'function_category', 'citation',
                      'comb_mutation', 'function_description',
                      'heterozygosity']
+    # columns merged across lineages below; all others keep the first
+    # value of each mutation
+    merged_cols = ['viral_lineages', 'clade_defining', 'ao', 'dp', 'ro',
+                   'variant_seq']
 
-    final_df = tsv_df.groupby(cols_to_check).agg(agg_dict)
-    final_df = final_df.rename(columns={'ao': 'ao_all',
-                                        'variant_seq':
-                                            'variant_seq_all',
-                                        'multiaa_comb_mutation':
-                                            'multiaa_mutation_split_names'})
+    agg_dict = dict((col, 'first') for col in
+                    tsv_df.columns.values.tolist() if col not in merged_cols)
+    agg_dict['obs_sample_size'] = 'sum'
 
-    # add dp, ro per mutation
+    groupby = tsv_df.groupby(cols_to_check)
+    final_df = groupby.agg(agg_dict)
+    final_df = final_df.rename(columns={'multiaa_comb_mutation':
+                                            'multiaa_mutation_split_names'})
+    n_mutations = len(final_df)
+
+    # long format: one row per mutation and lineage, with the mutation's
+    # row number in final_df as an integer key (rows with missing keys
+    # are left out of final_df by groupby, so drop them here too)
+    group = groupby.ngroup()
+    long_df = tsv_df.loc[group.notna(), merged_cols].copy()
+    long_df['group'] = group[group.notna()].astype(int)
+    # lineages are told apart as they appear in the ', '-joined list of
+    # each mutation, where all but the first have a leading space
+    first_row = long_df.groupby('group').cumcount() == 0
+    long_df['lineage'] = long_df['viral_lineages'].where(
+        first_row, ' ' + long_df['viral_lineages'])
+
+    # dp, ro per mutation: sum of the first value of each lineage
+    first_of_lineage = long_df[~long_df.duplicated(['group', 'lineage'])]
     for colname in ['dp', 'ro']:
-        final_df[colname] = [add_one_from_each_lineage(x, y, mode='add')
-                             for x, y in
-                             zip(final_df[colname],
-                                 final_df['viral_lineages'])]
-
-    # add ao, variant_seq per mutation
-    for colname in ['ao_all', 'variant_seq_all']:
-        final_df[colname] = [
-            add_one_from_each_lineage(x, y, mode='comma') for x, y in
-            zip(final_df[colname],
-                final_df['viral_lineages'])]
-
-    # add ao according to the heterogeneous mutations
-    final_df['ao_by_var_seq'] = [add_ao_by_variant_seq(x, y)[0] for x, y
-                                 in zip(final_df['ao_all'],
-                                        final_df['variant_seq_all'])]
-    final_df['ao'] = [add_ao_by_variant_seq(x, y)[1] for x, y in
-                      zip(final_df['ao_all'],
-                          final_df['variant_seq_all'])]
-    final_df['variant_seq'] = [add_ao_by_variant_seq(x, y)[2] for x, y
-                               in zip(final_df['ao_all'],
-                                      final_df['variant_seq_all'])]
+        final_df[colname] = first_of_lineage[colname].astype(int).groupby(
+            first_of_lineage['group']).sum().astype(str).to_numpy()
+
+    # ao according to the heterogeneous mutations: pair the ao values of
+    # the first row of each lineage with the variant seqs of all rows, by
+    # position within the mutation, then sum ao per variant seq in order
+    # of first appearance
+    ao_values = first_of_lineage[['group']].assign(
+        ao=first_of_lineage['ao'].str.split(',')).explode('ao')
+    seq_values = long_df[['group']].assign(
+        variant_seq=long_df['variant_seq'].str.split(',')).explode(
+        'variant_seq')
+    for values in [ao_values, seq_values]:
+        values['position'] = values.groupby('group').cumcount()
+    pairs = ao_values.merge(seq_values, on=['group', 'position'])
+    pairs['ao'] = pairs['ao'].astype(int)
+    ao_by_seq = pairs.groupby(['group', 'variant_seq'],
+                              sort=False)['ao'].sum().reset_index()
+    ao_by_seq['ao'] = ao_by_seq['ao'].astype(str)
+    ao_by_seq['joined'] = ao_by_seq['variant_seq'] + '=' + ao_by_seq['ao']
+
+    by_group = dict(
+        (colname, join_by_group(ao_by_seq[colname], ao_by_seq['group'], sep)
+         .reindex(range(n_mutations), fill_value='').to_numpy())
+        for colname, sep in [('joined', ', '), ('ao', ','),
+                             ('variant_seq', ',')])
+    final_df['ao_by_var_seq'] = by_group['joined']
+    final_df['ao'] = by_group['ao']
+    # trailing commas of empty variant seqs are stripped, as before
+    final_df['variant_seq'] = pd.Series(
+        by_group['variant_seq'] + ',').str.rstrip(", ").to_numpy()
 
     # remove 'who_variant'; rename 'multiaa_comb_mutation'
     final_df = final_df.drop(labels=['variant'], axis=1)
@@ -275,62 +333,24 @@ def streamline_tsv(tsv_df):
     final_df['variant_pop_size'] = variant_pop_size
 
     # combine viral_lineages and clade_defining into key-value pairs
-
-    # split viral_lineages and clade_defining by ','
-    split_lineages = final_df['viral_lineages'].str.split(
-        pat=',').apply(pd.Series)  # split at ,, form dataframe
-    split_clade_defining = final_df['clade_defining'].str.split(
-        pat=',').apply(pd.Series)  # split at ,, form dataframe
-    # go through and make key-value pairs of corresponding columns
-    # from each
-    final_df['clade_defining_status'] = ''
-    for col in split_clade_defining.columns:
-        final_df['clade_defining_status'] = final_df[
-                                                'clade_defining_status'] + \
-                                            split_lineages[col].astype(
-                                                str) + '=' + \
-                                            split_clade_defining[
-                                                col].astype(str) + '; '
+    clade_defining_status = join_by_group(
+        long_df['lineage'] + '=' + long_df['clade_defining'] + '; ',
+        long_df['group'], '')
     # drop clade_defining status for n/a strains and empty nan=nan pairs
-    final_df.clade_defining_status = \
-        final_df.clade_defining_status.str.replace('n/a=n/a; ',
-                                                   'n/a; ')
-    final_df.clade_defining_status = \
-        final_df.clade_defining_status.str.replace('nan=nan; ', '')
+    clade_defining_status = clade_defining_status.str.replace('n/a=n/a; ',
+                                                              'n/a; ')
+    clade_defining_status = clade_defining_status.str.replace('nan=nan; ',
+                                                              '')
     # strip trailing spaces and semicolons
-    final_df.clade_defining_status = \
-        final_df.clade_defining_status.str.rstrip("; ")
-
-    # drop repeated key-value pairs in each row (find these rows as
-    # they contain spaces)
-    for row in final_df['clade_defining_status']:
-        if ' ' in row:
-            mylist = row.split('; ')
-            newlist = []
-            for pair in mylist:
-                pair = pair.replace(';', '')
-                pair = pair.lstrip(' ')
-                newlist.append(pair)
-            mylist = list(set(newlist))
-            row_str = ', '.join(str(e) for e in mylist)
-            mask = final_df['clade_defining_status'] == row
-            final_df.loc[mask, 'clade_defining_status'] = row_str
-
-    # drop repeated lineage names in each row of viral_lineages
-    # return an ordered list of lineages
-    for row in final_df['viral_lineages']:
-        if ' ' in row:
-            lineage_list = row.split(', ')
-            mylist = list(set(lineage_list))
-            '''
-            #order lineages alphanumerically
-            #split each element of mylist into a sublist, split at
-            the first '.'
-            split_list =
-            '''
-            row_str = ', '.join(str(e) for e in mylist)
-            mask = final_df['viral_lineages'] == row
-            final_df.loc[mask, 'viral_lineages'] = row_str
+    clade_defining_status = clade_defining_status.str.rstrip("; ")
+    viral_lineages = join_by_group(long_df['viral_lineages'],
+                                   long_df['group'], ', ')
+
+    # drop repeated key-value pairs and lineage names in each row
+    final_df['clade_defining_status'] = drop_repeats(clade_defining_status,
+                                                     unique_pairs)
+    final_df['viral_lineages'] = drop_repeats(viral_lineages,
+                                              unique_lineages)
 
     # reorder columns
     cols = ['name', 'nt_name', 'aa_name', 'multi_aa_name',
@@ -350,6 +370,94 @@ def streamline_tsv(tsv_df):
     return final_df
 
 
+def read_gvf_files(gvf_files, executor=None):
+    """
+    Converts GVF files to TSV format and concatenates them once, reading
+    the files in parallel if a process pool executor is given.
+    Converted files are kept in gvf_cache, so a GVF shared by several
+    variants is only read once.
+    """
+    for gvf in gvf_files:
+        print(gvf)
+    to_read = [gvf for gvf in dict.fromkeys(gvf_files)
+               if file_key(gvf) not in gvf_cache]
+    if executor is not None and len(to_read) > 1:
+        gvf_dfs = executor.map(gvf2tsv, to_read)
+    else:
+        gvf_dfs = [gvf2tsv(gvf=gvf) for gvf in to_read]
+    for gvf, gvf_df in zip(to_read, gvf_dfs):
+        gvf_cache[file_key(gvf)] = gvf_df
+    # concat copies the cached dataframes, which are left unchanged
+    return pd.concat([gvf_cache[file_key(gvf)] for gvf in gvf_files],
+                     ignore_index=True)
+
+
+def format_variant_name(who_variant):
+    # capitalize WHO variant names, eg. "omicron" -> "Omicron"
+    if "_" in who_variant:
+        who_variant = who_variant[0:who_variant.find(
+            "_")].capitalize() + who_variant[who_variant.find(
+            "_"):]
+    else:
+        who_variant = who_variant.capitalize()
+    return who_variant
+
+
+def save_variant_report(gvf_df, who_variant, outfile, variant_pop_size):
+    # streamline concatenated df and save report as a .tsv
+    out_df = streamline_tsv(tsv_df=gvf_df, variant_pop_size=variant_pop_size)
+    filename = who_variant + '_' + outfile
+    out_df.to_csv(filename, sep='\t', index=False)
+    print("Processing complete.")
+    print(who_variant + " surveillance report saved as: " +
+          filename)
+    print("")
+
+
+def make_variant_report(who_variant, clades, gvf_list, outfile,
+                        table=None, executor=None):
+    """
+    Creates the surveillance report of one WHO variant from the GVF files
+    of its pango lineages (found in gvf_list, a list of filenames or a
+    LineageFileIndex), saved as <who_variant>_<outfile>.
+    If a process pool executor is given, the GVF files are read in
+    parallel and the report is streamlined and saved by a worker; the
+    Future of that step is returned (None if no GVF files are found).
+    """
+    # get list of relevant pango lineages
+    pango_lineages = []
+    for var in clades[clades['variant']==who_variant]['pango_lineage'].tolist():
+        pango_lineages.extend(pango_lineage_patterns(var))
+
+    # get list of gvf files pertaining to variant
+    gvf_files = match_gvfs_to_who_variant(
+        pango_lineage_list=pango_lineages,
+        gvf_files_list=gvf_list)
+    print(str(len(gvf_files)) + " GVF files found for " +
+          who_variant + " variant.")
+
+    if len(gvf_files) == 0:
+        return None
+
+    # convert all gvf files to tsv and concatenate them
+    print("")
+    print("Processing:")
+    gvf_df = read_gvf_files(gvf_files, executor)
+
+    variant_pop_size = "n/a"
+    if table:
+        # get variant population size
+        variant_pop_size = find_variant_pop_size(table=table,
+                                                 pango_lineage_list=
+                                                 pango_lineages)
+
+    if executor is not None:
+        return executor.submit(save_variant_report, gvf_df, who_variant,
+                               outfile, variant_pop_size)
+    save_variant_report(gvf_df, who_variant, outfile, variant_pop_size)
+    return None
+
+
 if __name__ == '__main__':
 
     args = parse_args()
@@ -382,69 +490,36 @@ if __name__ == '__main__':
                     who_variants_list.append(clades.loc[i,
                                                         'variant'])
 
+        # each variant's report is only made once
+        who_variants_list = list(dict.fromkeys(
+            format_variant_name(who_variant)
+            for who_variant in who_variants_list))
+
+        # index the GVF filenames once for all variants
+        gvf_index = LineageFileIndex(gvf_list)
+
         # for each variant, create a surveillance report
-        for who_variant in who_variants_list:
-            if "_" in who_variant:
-                who_variant = who_variant[0:who_variant.find(
-                "_")].capitalize() + who_variant[who_variant.find(
-                "_"):]
-            else:
-                who_variant = who_variant.capitalize()
-            
-            # get list of relevant pango lineages
-            pango_lineages = []
-            for var in clades[clades['variant']==who_variant]['pango_lineage'].tolist():
-                if "," in var:
-                    for temp in var.split(","):
-                        if "[" not in var:
-                            pango_lineages.append(temp)
-                        else:
-                            parent = temp[0]
-                            child = temp[2:-3].split("|")
-                            for c in child:
-                                pango_lineages.append(parent + str(c))
-                                pango_lineages.append(parent + str(c) + ".*")
-                else:
-                    pango_lineages.append(var)
-
-            #print(pango_lineages)
-
-            # get list of gvf files pertaining to variant
-            gvf_files = []
-            gvf_files = match_gvfs_to_who_variant(
-                pango_lineage_list=pango_lineages,
-                gvf_files_list=gvf_list)
-            print(str(len(gvf_files)) + " GVF files found for " +
-                  who_variant + " variant.")
-
-
-            if len(gvf_files) > 0:
-                # convert all gvf files to tsv and concatenate them
-                print("")
-                print("Processing:")
-                print(gvf_files[0])
-                gvf_df = gvf2tsv(gvf=gvf_files[0])
-                if len(gvf_files) > 1:
-                    for gvf in gvf_files[1:]:
-                        print(gvf)
-                        new_gvf_df = gvf2tsv(gvf=gvf)
-                        gvf_df = pd.concat([gvf_df, new_gvf_df],
-                                           ignore_index=True)
-
-
-                if args.table:
-                    # get variant population size
-                    variant_pop_size = find_variant_pop_size(table=args.table,
-                                                             pango_lineage_list=
-                                                             pango_lineages)
-
-                out_df = streamline_tsv(tsv_df=gvf_df)
-                filename = who_variant + '_' + outfile
-                out_df.to_csv(filename, sep='\t', index=False)
-                print("Processing complete.")
-                print(who_variant + " surveillance report saved as: " +
-                      filename)
-                print("")
+        if args.jobs > 1:
+            # variants share no state, so while one variant's report is
+            # streamlined by a worker, the next variant's GVF files are
+            # already being read. Each pending report holds its variant's
+            # dataframe, so at most args.jobs are pending at a time.
+            with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+                reports = deque()
+                for who_variant in who_variants_list:
+                    report = make_variant_report(who_variant, clades,
+                                                 gvf_index, outfile,
+                                                 args.table, executor)
+                    if report is not None:
+                        reports.append(report)
+                    while len(reports) > args.jobs:
+                        reports.popleft().result()
+                for report in reports:
+                    report.result()
+        else:
+            for who_variant in who_variants_list:
+                make_variant_report(who_variant, clades, gvf_index,
+                                    outfile, args.table)
 
 
     # if user-provided, who_variant is the provided filename
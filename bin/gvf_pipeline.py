@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+
+This script runs the GVF conversion and annotation steps in a single
+process: vcf2gvf.py -> splitmutationnames_gvf.py -> addfunctions2gvf.py
+-> addvariantinfo2gvf.py.
+
+The GVF is kept in memory with one column per attribute between steps,
+and is only joined back into '#attributes' and written out once, at the
+end. The output is the same as running the four scripts one after the
+other.
+
+"""
+
+import argparse
+import json
+import pandas as pd
+import numpy as np
+from functions import find_sample_size, rejoin_attributes
+from functions import load_hgvs_cache, save_hgvs_cache
+from functions import empty_attributes, gvf_columns, gvf_attributes
+from vcf2gvf import vcftogvf, make_pragmas
+from splitmutationnames_gvf import split_gvf_names
+from addfunctions2gvf import add_pokay_annotations
+from addvariantinfo2gvf import add_variant_information
+from gene_positions import load_gene_position_indices
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Converts an annotated VCF file to a GVF file and '
+                    'adds functional and variant annotations to it')
+    parser.add_argument('--vcffile', type=str, default=None, required=True,
+                        help='Path to a snpEFF-annotated VCF file')
+    parser.add_argument('--sample_desc', type=str, default=None, required=True,
+                        choices=['Wastewater', 'Clinical'],
+                        help="The sample group type")
+    parser.add_argument('--sample_group', type=str, default=None, required=True,
+                        help='sample group name, ie. lineage, date range')
+    parser.add_argument('--size_stats', type=str, default=None,
+                        help='Statistics file for for size extraction')
+    parser.add_argument('--clades_threshold', type=float,
+                        default=0.75,
+                        help='Alternate frequency cutoff for '
+                             'clade-defining mutations')
+    parser.add_argument('--gene_positions', type=str,
+                        default=None,
+                        help='gene positions in JSON format')
+    parser.add_argument('--strain', type=str,
+                        default=None,
+                        help='Lineage; user mode is if strain="n/a"')
+    parser.add_argument("--wastewater", help="Activate wastewater data mode",
+                        action="store_true")
+    parser.add_argument('--names_to_split', type=str,
+                        default=None,
+                        help='.tsv of multi-aa mutation names to '
+                             'split up into individual aa names; '
+                             'names are not split if not given')
+    parser.add_argument('--functional_annotations', type=str,
+                        default=None, help='TSV file of functional '
+                                           'annotations; functional '
+                                           'annotations are not added '
+                                           'if not given')
+    parser.add_argument('--annotation_index', type=str, default=None,
+                        help='Compiled index (.npz) of the functional '
+                             'annotations file, created if missing or '
+                             'older than --functional_annotations')
+    parser.add_argument('--clades', type=str, default='n/a',
+                        help='TSV file of WHO strain names and '
+                             'VOC/VOI status')
+    parser.add_argument('--clades_cache', type=str, default=None,
+                        help='Cache file of the compiled clades file, '
+                             'created if missing or older than --clades')
+    parser.add_argument('--outgvf', type=str, required=True,
+                        help='Filename for the output GVF file')
+    parser.add_argument('--hgvs_cache', type=str, default=None,
+                        help='JSON file of HGVS names worked out in '
+                             'previous runs; created or updated with '
+                             'this run\'s names')
+
+    return parser.parse_args()
+
+
+def attributes_as_str(gvf):
+    # attributes written to and read back from a GVF are always strings
+    # (eg. NaN becomes 'nan'), so convert them the same way between steps
+    gvf[gvf_attributes] = gvf[gvf_attributes].astype(str)
+    return gvf
+
+
+def gvf_pipeline(vcf, strain, GENE_PROTEIN_POSITIONS_DICT, sample_size,
+                 clades_threshold=0.75, names_to_split=None,
+                 functional_annotations=None, clades='n/a', cds_index=None,
+                 clades_cache=None, annotation_index=None):
+    # create gvf from annotated vcf, keeping attributes in separate columns
+    gvf = vcftogvf(vcf, strain, GENE_PROTEIN_POSITIONS_DICT, sample_size,
+                   clades_threshold, expanded=True, cds_index=cds_index)
+    gvf = gvf[gvf_columns + gvf_attributes]
+
+    # split names in "Names" attribute into separate rows
+    if names_to_split is not None:
+        gvf = split_gvf_names(attributes_as_str(gvf), names_to_split,
+                              expanded=True)
+
+    # add functional annotations
+    if functional_annotations is not None:
+        gvf = add_pokay_annotations(attributes_as_str(gvf),
+                                    functional_annotations, expanded=True,
+                                    annotation_index=annotation_index)
+
+    # add variant info
+    gvf = add_variant_information(clades, attributes_as_str(gvf), strain,
+                                  expanded=True, clades_cache=clades_cache)
+
+    # merge attributes back into a single column, only once
+    gvf = rejoin_attributes(gvf, empty_attributes)
+
+    return gvf[gvf_columns]
+
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    # Reading the gene & protein coordinates of SARS-CoV-2 genome
+    with open(args.gene_positions) as fp:
+        GENE_PROTEIN_POSITIONS_DICT = json.load(fp)
+    # CDS lookup, from the compiled gene positions file if available
+    cds_index = load_gene_position_indices(
+        args.gene_positions, GENE_PROTEIN_POSITIONS_DICT)["CDS"]
+
+    # If the strain and/or stats file are None, set them as 'n/a'
+    size_stats = args.size_stats
+    strain = args.strain
+
+    if size_stats == None:
+            size_stats='n/a'
+    if strain == None:
+            strain='n/a'
+
+    sample_size = find_sample_size(size_stats, strain, args.vcffile,
+                                   args.wastewater)
+
+    # reuse HGVS names from previous runs
+    if args.hgvs_cache is not None:
+        load_hgvs_cache(args.hgvs_cache)
+
+    # create and annotate gvf
+    gvf = gvf_pipeline(args.vcffile, strain, GENE_PROTEIN_POSITIONS_DICT,
+                       sample_size, args.clades_threshold,
+                       args.names_to_split, args.functional_annotations,
+                       args.clades, cds_index, args.clades_cache,
+                       args.annotation_index)
+
+    # add species and sample description to pragmas
+    species = GENE_PROTEIN_POSITIONS_DICT['Src']['species']
+    gvf_pragmas = make_pragmas(species, args.sample_desc, args.sample_group)
+
+    # combine pragmas, header, GVF contents
+    final_gvf = pd.DataFrame(np.vstack([gvf.columns, gvf]))
+    final_gvf = gvf_pragmas.append(final_gvf)
+
+    # save GVF
+    filepath = args.outgvf
+    print("Saved as: ", filepath)
+    print("")
+    final_gvf.to_csv(filepath, sep='\t', index=False, header=False)
+    if args.hgvs_cache is not None:
+        save_hgvs_cache(args.hgvs_cache)
+
+    print("")
+    print("Processing complete.")
@@ -12,7 +12,7 @@ from NCBI.
 
 import argparse
 from cyvcf2 import VCF, Writer
-import json
+from gene_positions import load_gene_position_indices
 
 def parse_args():
     """
@@ -49,8 +49,10 @@ if __name__ == '__main__':
     # The above code checks if all the required arguments are provided, and raises an error if any of them is missing.
 
     
-    with open(json_file, 'r') as f:
-        gene_protein = json.load(f)
+    # mature peptide lookup, from the compiled gene positions file if
+    # available (the JSON is only read if it isn't)
+    mat_pep_index = load_gene_position_indices(json_file)[
+        "mature_protein_region_of_CDS"]
     
     data_vcf = VCF(vcf_file)
     data_vcf.add_info_to_header(
@@ -71,12 +73,12 @@ if __name__ == '__main__':
         record.INFO["mat_pep"] = "n/a"
         record.INFO["mat_pep_desc"] = "n/a"
         record.INFO["mat_pep_acc"] = "n/a"
-        for key in gene_protein:
-            if gene_protein[key]["type"] == "mature_protein_region_of_CDS":
-                if int(gene_protein[key]["start"]) <= int(record.POS) <= int(gene_protein[key]["end"]):
-                    record.INFO["mat_pep"] = str("".join(gene_protein[key]["protein_alias"])).replace(";", ",")
-                    record.INFO["mat_pep_desc"] = str("".join(gene_protein[key]["Note"])).replace(";", ",")
-                    record.INFO["mat_pep_acc"] = str("".join(gene_protein[key]["ID"])).replace(";", ",")
+        feature = int(mat_pep_index.lookup(int(record.POS)))
+        if feature != -1:
+            mat_pep = mat_pep_index.feature_values[feature]
+            record.INFO["mat_pep"] = str("".join(mat_pep["protein_alias"])).replace(";", ",")
+            record.INFO["mat_pep_desc"] = str("".join(mat_pep["Note"])).replace(";", ",")
+            record.INFO["mat_pep_acc"] = str("".join(mat_pep["ID"])).replace(";", ",")
         w.write_record(record)    
     w.close()
     data_vcf.close()
\ No newline at end of file
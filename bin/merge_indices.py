@@ -7,11 +7,17 @@ Created on Fri Feb 16 12:00:04 2024
 
 This script merges multiple mutation indices into one.
 If an existing mutation index is provided, the new indices are added to it.
+With --presorted, indices that are already sorted by pos (as written by
+gvf2indexandlog.py) are merged in one streaming pass, without dask; an
+existing mutation index that isn't sorted by pos is sorted first.
 """
-import dask
-dask.config.set({'dataframe.query-planning': True})
-import dask.dataframe as dd
+import os
+import tempfile
+import pandas as pd
 import argparse
+from mutation_index_store import MutationIndexStore, read_index_tsv, fill_na_strings
+from mutation_index_store import tsv_header, merge_sorted_tsvs, write_tsv_rows
+from mutation_index_store import tsv_is_sorted, sort_tsv
 
 
 def parse_args():
@@ -25,6 +31,13 @@ def parse_args():
     parser.add_argument('--index_savefile', type=str,
                         default=None, help='TSV filename to save updated \
                             index of all mutations to')
+    parser.add_argument('--index_store', type=str, default=None,
+                        help='Mutation index store directory to add the \
+                            GVF indices to as a new segment. A new store \
+                            is started with --original_index, if given')
+    parser.add_argument('--presorted', action='store_true',
+                        help='The indices are all sorted by pos; merge them \
+                            with a streaming k-way merge instead of dask')
 
     return parser.parse_args()
 
@@ -36,23 +49,62 @@ if __name__ == '__main__':
     gvf_indices_list = args.gvf_indices
     index_savefile = args.index_savefile
 
-    # if an original index is provided, merge the new indices with it
-    if original_index!=None:
-        indices_to_merge = [original_index] + gvf_indices_list
-    # if an original index is not provided, make an entirely new index
+    # with an index store, only the new indices are read and added to it
+    if args.index_store!=None:
+        store = MutationIndexStore(args.index_store)
+        # an original index can only start a new store, as an existing
+        # store already holds the index
+        if original_index!=None:
+            if len(store.segments()) > 0:
+                raise SystemExit("--original_index can't be merged into "
+                                 "the existing index store " +
+                                 args.index_store)
+            store.append(fill_na_strings(read_index_tsv(original_index)))
+        new_index = pd.concat([read_index_tsv(index) for index in gvf_indices_list])
+        # fill missing values, as for the groupby below
+        store.append(fill_na_strings(new_index))
+        if index_savefile!=None:
+            store.read().to_csv(index_savefile, sep='\t', index=False)
+
     else:
-        indices_to_merge = gvf_indices_list
-
-    # read all indices into dask df
-    ddf = dd.read_csv(indices_to_merge, sep='\t', dtype={'alias': 'object', 'alias_protein': 'object', 'hgvs_aa_mutation': 'object', 'hgvs_alias': 'object', 'protein_name': 'object'}) 
-    # fillna to make groupby() work
-    ddf = ddf.fillna('n/a')
-    # specify which columns to group by
-    group_cols = [x for x in ddf.columns if x!='lineages']
-    # do groupby operation
-    ddf = ddf.groupby(by=group_cols)['lineages'].apply(','.join).reset_index()
-    # sort by 'pos'
-    ddf = ddf.sort_values("pos")
-
-    # save ddf as a single TSV
-    ddf.to_csv(index_savefile, single_file=True, sep='\t', index=False)
+        # if an original index is provided, merge the new indices with it
+        if original_index!=None:
+            indices_to_merge = [original_index] + gvf_indices_list
+        # if an original index is not provided, make an entirely new index
+        else:
+            indices_to_merge = gvf_indices_list
+
+        # indices sorted by pos are merged row by row, coalescing the rows
+        # of each mutation as the groupby below does
+        if args.presorted:
+            columns = tsv_header(indices_to_merge[0])
+            with tempfile.TemporaryDirectory(dir='.') as tmp_dir:
+                # the original index may be user-supplied and not sorted
+                # by pos, so sort a copy of it first
+                if original_index!=None and not tsv_is_sorted(original_index):
+                    print("Sorting " + original_index + " by pos")
+                    indices_to_merge[0] = os.path.join(tmp_dir, "original_index.tsv")
+                    sort_tsv(original_index, indices_to_merge[0])
+                write_tsv_rows(index_savefile, [columns])
+                write_tsv_rows(index_savefile,
+                               merge_sorted_tsvs(indices_to_merge, columns),
+                               mode='a')
+
+        else:
+            import dask
+            dask.config.set({'dataframe.query-planning': True})
+            import dask.dataframe as dd
+
+            # read all indices into dask df
+            ddf = dd.read_csv(indices_to_merge, sep='\t', dtype={'alias': 'object', 'alias_protein': 'object', 'hgvs_aa_mutation': 'object', 'hgvs_alias': 'object', 'protein_name': 'object'}) 
+            # fillna to make groupby() work
+            ddf = ddf.fillna('n/a')
+            # specify which columns to group by
+            group_cols = [x for x in ddf.columns if x!='lineages']
+            # do groupby operation
+            ddf = ddf.groupby(by=group_cols)['lineages'].apply(','.join).reset_index()
+            # sort by 'pos'
+            ddf = ddf.sort_values("pos")
+
+            # save ddf as a single TSV
+            ddf.to_csv(index_savefile, single_file=True, sep='\t', index=False)
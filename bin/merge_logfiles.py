@@ -13,12 +13,18 @@ If an existing mutation log is provided, the new logs are added to it.
 Total sequences:	508910
 New sequences:	171
 New lineages:	['HH.1.1', 'FT.3.1.1']
+
+With --presorted, logs that are already sorted by pos (as written by
+gvf2indexandlog.py) are merged in one streaming pass, without dask.
 """
-import dask
-dask.config.set({'dataframe.query-planning-warning': False}) # this recommends dask-exp install which we don't want to use as it's unstable
-import dask.dataframe as dd
 import pandas as pd
+import numpy as np
 import argparse
+import json
+import os
+from functions import atomic_write
+from mutation_index_store import MutationIndexStore, fill_na_strings
+from mutation_index_store import tsv_header, merge_sorted_tsvs, write_tsv_rows
 
 
 def parse_args():
@@ -26,6 +32,7 @@ def parse_args():
         description='Merges mutation logs into one.')
     parser.add_argument('--original_index', type=str, default=None,
                         help='Path to an existing TSV index of all mutations, \
+                            or to a mutation index store directory, \
                             used to determine which mutations to log as new')
     parser.add_argument('--log_header', type=str, default=None,
                         help='Path to a text file containing the log header')
@@ -34,10 +41,87 @@ def parse_args():
     parser.add_argument('--log_savefile', type=str,
                         default=None, help='TSV filename to save updated \
                             log of all mutations to')
+    parser.add_argument('--index_keys_cache', type=str, default=None,
+                        help='JSON cache of the mutations in --original_index, \
+                            created if missing or made from another version \
+                            of the index')
+    parser.add_argument('--presorted', action='store_true',
+                        help='The logs are all sorted by pos; merge them \
+                            with a streaming k-way merge instead of dask')
 
     return parser.parse_args()
 
 
+def original_index_mutations(original_index):
+    '''
+    Returns the mutations in the original index in the format of the
+    logfile ('pos', 'new_mutations').
+    '''
+    # convert original_index to match the logfile columns
+    # read index into pandas df
+    if os.path.isdir(original_index):
+        # only the columns needed, with missing values as 'n/a'
+        og_index = fill_na_strings(MutationIndexStore(original_index).read(
+            columns=['pos', 'mutation', 'gene', 'alias', 'alias_protein']))
+    else:
+        og_index = pd.read_csv(original_index, sep='\t').fillna('n/a')
+    # fill in 'new_mutations' column like: "gene:mutation"
+    og_index['new_mutations'] = og_index["gene"] + ":" + og_index["mutation"]
+    # for orf1ab mutations, fill in 'new_mutations' column like: "gene:mutation / nsp:alias"
+    og_index.loc[og_index['alias']!='n/a', 'new_mutations'] = og_index['new_mutations'] + " / " + og_index["alias_protein"] + ":" + og_index["alias"]
+    # drop duplicates (there shouldn't be any)
+    og_index = og_index[['pos', 'new_mutations']].drop_duplicates()
+    # drop any NaN rows
+    og_index = og_index[og_index['pos'].notna()]
+    # ensure pos is integer type
+    og_index['pos'] = og_index['pos'].astype(int)
+    return og_index
+
+
+def index_version(original_index):
+    # changes whenever the original index (file or store) does; the
+    # modification time is in nanoseconds, so an index rewritten at the
+    # same size within a second still gets a new version
+    if os.path.isdir(original_index):
+        return MutationIndexStore(original_index).fingerprint()
+    stat = os.stat(original_index)
+    return "%d:%d" % (stat.st_size, stat.st_mtime_ns)
+
+
+def load_original_index_keys(original_index, cache_file=None):
+    '''
+    Returns the set of (pos, new_mutations) keys of the mutations in
+    the original index, read from cache_file if it was made from the
+    same version of the index. Otherwise the index is read, and
+    cache_file (if given) is written for next time.
+    '''
+    version = index_version(original_index)
+    if cache_file is not None and os.path.exists(cache_file):
+        # a cache file that can't be read is rebuilt
+        try:
+            with open(cache_file) as fp:
+                saved = json.load(fp)
+            if saved.get("index_version") == version:
+                return set((pos, mutation) for pos, mutation in saved["keys"])
+        except (ValueError, AttributeError, KeyError, TypeError):
+            pass
+
+    og_index = original_index_mutations(original_index)
+    keys = set(zip(og_index['pos'].tolist(), og_index['new_mutations']))
+    if cache_file is not None:
+        with atomic_write(cache_file) as fp:
+            json.dump({"index_version": version, "keys": sorted(keys)}, fp)
+    return keys
+
+
+def drop_known_mutations(log, og_keys):
+    # anti-join: keeps the rows of log whose (pos, new_mutations) is not
+    # in og_keys
+    known = [(pos, mutation) in og_keys for pos, mutation
+             in zip(log['pos'].tolist(), log['new_mutations'])]
+    return log[~np.array(known, dtype=bool)]
+
+
 if __name__ == '__main__':
 
     args = parse_args()
@@ -46,58 +130,64 @@ if __name__ == '__main__':
     gvf_logs_list = args.gvf_logs
     log_savefile = args.log_savefile
 
-    # read all logs into dask df
-    ddf = dd.read_csv(gvf_logs_list, sep='\t') 
-    # fillna to make groupby() work
-    ddf = ddf.fillna('n/a')
-    # groupby all columns except 'lineages'...
-    group_cols = [x for x in ddf.columns if x!='lineages']
-    ddf = ddf.groupby(by=group_cols)['lineages'].apply(','.join).reset_index()
+    # log header
+    log_header_df = pd.read_csv(log_header, sep='\t', names=["pos", "new_mutations", "lineages"])
+    log_header_df.loc[len(log_header_df)] = ["New mutations:", "", ""]
 
-    # sort by 'pos'
-    ddf = ddf.sort_values("pos")
+    # logs sorted by pos are merged row by row, coalescing rows as the
+    # groupby below does, and previously-identified mutations are skipped
+    if args.presorted:
+        columns = tsv_header(gvf_logs_list[0])
+        pos_col = columns.index('pos')
+        mutations_col = columns.index('new_mutations')
+        lineages_col = columns.index('lineages')
+        og_keys = set()
+        if original_index!=None:
+            og_keys = load_original_index_keys(original_index, args.index_keys_cache)
 
-    # if a mutation index is provided, remove
-    # previously-identified mutations from the logfile
-    if original_index!=None:
+        num_lineages = []
+        def new_rows():
+            for row in merge_sorted_tsvs(gvf_logs_list, columns):
+                if (int(row[pos_col]), row[mutations_col]) not in og_keys:
+                    num_lineages.append(row[lineages_col].count(',') + 1)
+                    yield [row[pos_col], row[mutations_col], row[lineages_col]]
+
+        log_header_df.to_csv(log_savefile, sep='\t', index=False, header=False)
+        write_tsv_rows(log_savefile, new_rows(), mode='a')
+        # print number of new mutations in >=5 lineages
+        print("New mutations in >=5 lineages: ", sum(n>=5 for n in num_lineages))
+
+    else:
+        import dask
+        dask.config.set({'dataframe.query-planning-warning': False}) # this recommends dask-exp install which we don't want to use as it's unstable
+        import dask.dataframe as dd
+
+        # read all logs into dask df
+        ddf = dd.read_csv(gvf_logs_list, sep='\t') 
+        # fillna to make groupby() work
+        ddf = ddf.fillna('n/a')
+        # groupby all columns except 'lineages'...
+        group_cols = [x for x in ddf.columns if x!='lineages']
+        ddf = ddf.groupby(by=group_cols)['lineages'].apply(','.join).reset_index()
 
-        # convert original_index to match the logfile columns
-        # read index into pandas df
-        og_index = pd.read_csv(original_index, sep='\t').fillna('n/a')
-        # fill in 'new_mutations' column like: "gene:mutation"
-        og_index['new_mutations'] = og_index["gene"] + ":" + og_index["mutation"]
-        # for orf1ab mutations, fill in 'new_mutations' column like: "gene:mutation / nsp:alias"
-        og_index.loc[og_index['alias']!='n/a', 'new_mutations'] = og_index['new_mutations'] + " / " + og_index["alias_protein"] + ":" + og_index["alias"]
-        # drop duplicates (there shouldn't be any)
-        og_index = og_index[['pos', 'new_mutations', 'lineages']].drop_duplicates()
-        # drop any NaN rows
-        og_index = og_index[og_index['pos'].notna()]
-        # ensure pos is integer type
-        og_index['pos'] = og_index['pos'].astype(int)
-        # rename 'lineages' column entries
-        og_index['lineages'] = 'OG_index'
-        # concatenate original index to logfiles, with the og index first
-        ddf = dd.concat([og_index, ddf], axis=0)
-
-        # delete all duplicated rows, based on 'pos' and 'new_mutations'
-        # by default, the first ('OG_index') duplicate is kept here
-        ddf = ddf.drop_duplicates(subset=['pos', 'new_mutations']) 
-        # remove 'OG_index' rows, thereby removing all duplicates
-        ddf = ddf[ddf['lineages']!='OG_index']
         # sort by 'pos'
         ddf = ddf.sort_values("pos")
-        ddf = ddf[['pos', 'new_mutations', 'lineages']]
-        ddf['pos'] = ddf['pos'].astype(int)
+
+        # if a mutation index is provided, remove
+        # previously-identified mutations from the logfile
+        if original_index!=None:
+            og_keys = load_original_index_keys(original_index, args.index_keys_cache)
+            ddf = ddf.map_partitions(drop_known_mutations, og_keys)
+            ddf = ddf[['pos', 'new_mutations', 'lineages']]
+            ddf['pos'] = ddf['pos'].astype(int)
+
+        # compute the log once, for both the statistics and the file
+        log = ddf.compute()
+
+        # print number of new mutations in >=5 lineages
+        num_lineages = log['lineages'].str.split(',').str.len()
+        print("New mutations in >=5 lineages: ", (num_lineages>=5).sum())
         
-    # print number of new mutations in >=5 lineages
-    num_lineages = ddf['lineages'].compute()
-    num_lineages = num_lineages.str.split(',').str.len()
-    print("New mutations in >=5 lineages: ", (num_lineages>=5).sum())
-    
-    # add log header
-    log_header_df = pd.read_csv(log_header, sep='\t', names=["pos", "new_mutations", "lineages"])
-    log_header_df.loc[len(log_header_df)] = ["New mutations:", "", ""]
-    ddf = dd.concat([log_header_df, ddf])
-    # save ddf as a single TSV
-    ddf.to_csv(log_savefile, single_file=True, sep='\t', index=False, header=False)
-    
+        # add log header and save
+        log = pd.concat([log_header_df, log])
+        log.to_csv(log_savefile, sep='\t', index=False, header=False)
@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+
+On-disk store for the mutation index, so that adding new lineages does
+not mean reading and rewriting the whole index TSV.
+
+A store is a directory of segments (segment_000000.npz, ...), each one a
+batch of index rows sorted by position: 'pos' as an integer array, and
+every other column as positions in a table of its unique strings. New
+rows are appended as a new segment, and reading a store groups the rows of
+all segments by mutation (all columns but 'lineages') and joins their
+lineages, the same as merging index TSVs with merge_indices.py. Once a
+store has more than max_segments segments, they are compacted into one,
+named after the segments it replaces (eg. segment_000000-000016.npz), so
+that segments left behind by an interrupted compaction are ignored.
+
+Rows can be read for a range of positions and/or a set of genes, which
+only reads the codes of the rows in the range, and only decodes the
+matching rows. 'pos' and the string tables of each segment are still read
+whole, and a gene filter still reads the codes of the whole range for
+'gene'. Values are kept as they are written in the TSV (eg. 'n/a' and
+empty values stay strings).
+
+merge_sorted_tsvs() merges index or log TSVs that are already sorted by
+pos (as written by gvf2indexandlog.py) in a single streaming pass;
+sort_tsv() sorts any other TSV (eg. a user-supplied index) once.
+
+Run as a script, it imports an index TSV into a store, exports a store to
+a TSV, or compacts a store.
+
+"""
+
+import os
+import re
+import csv
+import glob
+import heapq
+import argparse
+import itertools
+from contextlib import ExitStack, closing
+import numpy as np
+import pandas as pd
+from functions import encode_strings, decode_strings, atomic_write
+
+
+# compact a store once it has more segments than this
+max_segments = 16
+
+# values read as missing by pandas.read_csv (and so dask), which are
+# filled in as 'n/a' when merging indices and logs
+na_strings = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN',
+              '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN',
+              'n/a', 'nan', 'null'}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Imports, exports or compacts a mutation index store')
+    parser.add_argument('--store', type=str, required=True,
+                        help='Directory of the mutation index store')
+    parser.add_argument('--import_tsv', type=str, default=None,
+                        nargs='*', help='Index TSVs to append to the '
+                                        'store, one segment each')
+    parser.add_argument('--export_tsv', type=str, default=None,
+                        help='Filename to save the whole index to')
+    parser.add_argument('--compact', action='store_true',
+                        help='Rewrite the segments of the store as one')
+    return parser.parse_args()
+
+
+def read_index_tsv(index_file):
+    # reads an index TSV with the values as written, like the store
+    index = pd.read_csv(index_file, sep='\t', dtype=str,
+                        keep_default_na=False)
+    index['pos'] = index['pos'].astype(int)
+    return index
+
+
+def fill_na_strings(index):
+    # fills in missing values, and the values read as missing by pandas
+    # (na_strings), as 'n/a', the same as merging indices with fillna()
+    return index.mask(index.isna() | index.isin(na_strings), 'n/a')
+
+
+def merge_rows(index):
+    # merges the rows of each mutation (all columns but 'lineages'),
+    # joining their lineages in order, and sorts them by pos; rows with
+    # missing values are kept
+    group_cols = [x for x in index.columns if x != 'lineages']
+    if 'lineages' in index.columns:
+        index = index.groupby(by=group_cols, as_index=False, sort=False,
+                              dropna=False)['lineages'].agg(','.join)
+    else:
+        index = index.drop_duplicates(subset=group_cols)
+    index = index.sort_values(by=['pos'], kind='mergesort')
+    return index.reset_index(drop=True)
+
+
+segment_regex = re.compile(r'^segment_(\d+)(?:-(\d+))?\.npz$')
+
+
+def segment_range(segment_file):
+    # returns the first and last segment numbers a segment file covers;
+    # only a compacted segment covers more than one
+    match = segment_regex.match(os.path.basename(segment_file))
+    first = int(match.group(1))
+    return first, int(match.group(2) or first)
+
+
+def write_segment(segment_file, index, exclusive=False):
+    # writes index rows to a segment file, one row per mutation; with
+    # exclusive=True, raises FileExistsError if the file already exists
+    index = merge_rows(index)
+    arrays = {"columns": np.array(index.columns, dtype=str),
+              "pos": index['pos'].to_numpy(dtype=np.int64)}
+    for column in index.columns:
+        if column != 'pos':
+            codes, offsets, data = encode_strings(
+                index[column].astype(str).to_numpy(dtype=object))
+            arrays[column + ".codes"] = codes
+            arrays[column + ".offsets"] = offsets
+            arrays[column + ".data"] = data
+    with atomic_write(segment_file, "wb", exclusive=exclusive) as fp:
+        np.savez(fp, **arrays)
+
+
+def read_array_slice(segment, name, first, last):
+    # reads elements first:last of an array in an (uncompressed) segment
+    # file, without reading the elements before or after them
+    with segment.zip.open(name + ".npy") as fp:
+        version = np.lib.format.read_magic(fp)
+        if version == (1, 0):
+            header = np.lib.format.read_array_header_1_0(fp)
+        elif version == (2, 0):
+            header = np.lib.format.read_array_header_2_0(fp)
+        else:
+            return segment[name][first:last]
+        dtype = header[2]
+        fp.seek(first * dtype.itemsize, os.SEEK_CUR)
+        return np.frombuffer(fp.read((last - first) * dtype.itemsize),
+                             dtype=dtype)
+
+
+def read_segment(segment_file, columns=None, pos_range=None, genes=None):
+    # reads the rows of a segment file in pos_range (first, last) and
+    # genes, if given. 'pos' and the string tables are read whole, the
+    # codes of the other columns only for the rows in pos_range
+    with np.load(segment_file) as segment:
+        all_columns = segment["columns"].tolist()
+        pos = segment["pos"]
+        first, last = 0, len(pos)
+        if pos_range is not None:
+            first = np.searchsorted(pos, pos_range[0], side="left")
+            last = np.searchsorted(pos, pos_range[1], side="right")
+        rows = np.arange(last - first)
+
+        def decode(column):
+            codes = read_array_slice(segment, column + ".codes", first,
+                                     last)
+            return decode_strings(codes[rows],
+                                  segment[column + ".offsets"],
+                                  segment[column + ".data"])
+
+        if genes is not None:
+            rows = rows[np.isin(decode('gene'), list(genes))]
+        index = pd.DataFrame(dict(
+            (column, pos[first:last][rows] if column == 'pos'
+             else decode(column))
+            for column in (all_columns if columns is None else columns)))
+    return index
+
+
+def tsv_header(tsv_file):
+    # returns the column names of a TSV
+    with open(tsv_file, newline='') as fp:
+        return next(csv.reader(fp, delimiter='\t'))
+
+
+def sorted_tsv_rows(tsv_file, columns):
+    # yields (pos, row) for the rows of a TSV sorted by pos, with the
+    # values in the order of 'columns' and missing values as 'n/a'
+    with open(tsv_file, newline='') as fp:
+        reader = csv.reader(fp, delimiter='\t')
+        header = next(reader)
+        if sorted(header) != sorted(columns):
+            raise ValueError(tsv_file + " has columns " + str(header) +
+                             ", not " + str(columns))
+        order = [header.index(column) for column in columns]
+        pos_col = columns.index('pos')
+        last_pos = None
+        for row in reader:
+            row = ['n/a' if row[i] in na_strings else row[i] for i in order]
+            pos = int(float(row[pos_col]))
+            if last_pos is not None and pos < last_pos:
+                raise ValueError(tsv_file + " is not sorted by pos")
+            last_pos = pos
+            yield pos, row
+
+
+def tsv_is_sorted(tsv_file):
+    # whether the rows of a TSV are sorted by pos
+    with open(tsv_file, newline='') as fp:
+        reader = csv.reader(fp, delimiter='\t')
+        pos_col = next(reader).index('pos')
+        last_pos = None
+        for row in reader:
+            pos = int(float(row[pos_col]))
+            if last_pos is not None and pos < last_pos:
+                return False
+            last_pos = pos
+    return True
+
+
+def sort_tsv(tsv_file, sorted_file):
+    # writes the rows of a TSV to sorted_file sorted by pos, keeping the
+    # order of rows with the same pos and the values as written
+    tsv = pd.read_csv(tsv_file, sep='\t', dtype=str, keep_default_na=False)
+    order = np.argsort(tsv['pos'].astype(float).astype(int).to_numpy(),
+                       kind='stable')
+    write_tsv_rows(sorted_file, [list(tsv.columns)])
+    write_tsv_rows(sorted_file, tsv.iloc[order].values.tolist(), mode='a')
+
+
+def merge_sorted_tsvs(tsv_files, columns):
+    '''
+    Merges TSVs that are each sorted by pos into one stream of rows
+    (lists of values in the order of 'columns'), sorted by pos.
+    Rows with the same values in all columns but 'lineages' are
+    coalesced, joining their lineages in the order of tsv_files, the
+    same as a groupby over all files. This is a k-way merge that only
+    holds the rows of one position in memory.
+    '''
+    lineages_col = columns.index('lineages')
+    with ExitStack() as stack:
+        streams = [stack.enter_context(closing(sorted_tsv_rows(tsv_file,
+                                                               columns)))
+                   for tsv_file in tsv_files]
+        # heapq.merge keeps rows with the same pos in the order of
+        # tsv_files
+        merged = heapq.merge(*streams, key=lambda item: item[0])
+        for pos, items in itertools.groupby(merged, key=lambda item: item[0]):
+            rows = {}
+            for _, row in items:
+                key = tuple(row[:lineages_col] + row[lineages_col + 1:])
+                if key in rows:
+                    rows[key][lineages_col] += ',' + row[lineages_col]
+                else:
+                    rows[key] = row
+            yield from rows.values()
+
+
+def write_tsv_rows(tsv_file, rows, mode='w'):
+    # writes rows (lists of values) to a TSV, quoting values as pandas does
+    with open(tsv_file, mode, newline='') as fp:
+        csv.writer(fp, delimiter='\t', lineterminator='\n').writerows(rows)
+
+
+class MutationIndexStore:
+    '''
+    The mutation index, stored as a directory of segment files.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+    def segment_files(self):
+        return [segment for segment in
+                glob.glob(os.path.join(self.path, "segment_*.npz"))
+                if segment_regex.match(os.path.basename(segment))]
+
+    def segments(self):
+        '''Returns the segment files in order, leaving out any segment
+        that a compacted segment covers.'''
+        ranges = dict((segment, segment_range(segment))
+                      for segment in self.segment_files())
+        return sorted((segment for segment, (first, last) in ranges.items()
+                       if not any(other != segment and
+                                  other_first <= first and
+                                  last <= other_last
+                                  for other, (other_first, other_last)
+                                  in ranges.items())),
+                      key=lambda segment: ranges[segment])
+
+    def fingerprint(self):
+        '''Returns a string that changes whenever the segments do.'''
+        return ';'.join("%s:%d:%d" % (os.path.basename(segment),
+                                      os.stat(segment).st_size,
+                                      os.stat(segment).st_mtime_ns)
+                        for segment in self.segments())
+
+    def columns(self):
+        segments = self.segments()
+        if len(segments) == 0:
+            return None
+        with np.load(segments[0]) as segment:
+            return segment["columns"].tolist()
+
+    def append(self, index):
+        '''Adds index rows to the store, as a new segment.'''
+        os.makedirs(self.path, exist_ok=True)
+        columns = self.columns()
+        if columns is not None:
+            if sorted(columns) != sorted(index.columns):
+                raise ValueError("columns " + str(list(index.columns)) +
+                                 " do not match the store's columns " +
+                                 str(columns))
+            index = index[columns]
+        number = max([segment_range(segment)[1] + 1
+                      for segment in self.segment_files()], default=0)
+        # another process appending at the same time may take the same
+        # number; the segment is only written under a name not yet taken
+        while True:
+            try:
+                write_segment(os.path.join(self.path,
+                                           "segment_%06d.npz" % number),
+                              index, exclusive=True)
+                break
+            except FileExistsError:
+                number += 1
+        if len(self.segments()) > max_segments:
+            self.compact()
+
+    def compact(self):
+        '''Rewrites the segments of the store as one. The store should
+        not be read or appended to by another process meanwhile.'''
+        segments = self.segments()
+        if len(segments) > 1:
+            index = self.read()
+            # the new segment is named after the numbers of the segments
+            # it replaces, and written before they are removed, so if this
+            # is interrupted no rows are lost, and segments() leaves the
+            # old segments out rather than reading their rows twice
+            first = segment_range(segments[0])[0]
+            last = segment_range(segments[-1])[1]
+            write_segment(os.path.join(self.path, "segment_%06d-%06d.npz" %
+                                       (first, last)), index)
+        # remove the replaced segments, and any left behind by an
+        # interrupted compaction
+        segments = self.segments()
+        for segment in self.segment_files():
+            if segment not in segments:
+                os.remove(segment)
+
+    def read(self, columns=None, pos_range=None, genes=None):
+        '''Returns the index as a dataframe sorted by pos, with only the
+        given columns, and only the rows with positions in pos_range
+        (first, last) and genes in 'genes', if given.'''
+        segments = self.segments()
+        if len(segments) == 0:
+            raise FileNotFoundError("no mutation index segments in " +
+                                    self.path)
+        all_columns = self.columns()
+        if len(segments) > 1:
+            # all other columns are needed to tell mutations apart
+            read_columns = [x for x in all_columns if x != 'lineages']
+            if columns is None or 'lineages' in columns:
+                read_columns = all_columns
+        else:
+            read_columns = all_columns if columns is None else columns
+        index = pd.concat([read_segment(segment, read_columns, pos_range,
+                                        genes) for segment in segments],
+                          ignore_index=True)
+
+        # merge the rows of each mutation, with lineages in segment order
+        # (each segment only has one row per mutation)
+        if len(segments) > 1:
+            index = merge_rows(index)
+        if columns is not None:
+            index = index[columns]
+        return index
+
+
+if __name__ == '__main__':
+
+    args = parse_args()
+    store = MutationIndexStore(args.store)
+
+    if args.import_tsv is not None:
+        for index_file in args.import_tsv:
+            print("Importing: " + index_file)
+            store.append(read_index_tsv(index_file))
+
+    if args.compact:
+        store.compact()
+
+    if args.export_tsv is not None:
+        store.read().to_csv(args.export_tsv, sep='\t', header=True,
+                            index=False)
@@ -9,6 +9,7 @@ import argparse
 import pandas as pd
 import csv
 import datetime
+from functions import pango_lineage_patterns, LineageResolver
 
 # Defining a function to parse the command line arguments
 def parse_args():
@@ -37,20 +38,7 @@ def parse_args():
 def parse_variant_file(dataframe):
     who_lineages = []
     for var in dataframe["pango_lineage"]:
-        if "," in var:
-            for temp in var.split(","):
-                if not "[" in var:
-                    who_lineages.append(temp)
-                    who_lineages.append(temp+".*")
-                    
-                else:
-                    parent=temp[0]
-                    child=temp[2:-1].split("|")
-                    for c in child:
-                        who_lineages.append(parent + str(c))
-                        who_lineages.append(parent+str(c)+".*")
-        else:
-            who_lineages.append(var)
+        who_lineages.extend(pango_lineage_patterns(var))
     return who_lineages
 
 # Defining a function to group the data by lineage
@@ -89,17 +77,14 @@ def group_by_lineage(dataframe, log, virusseq, end_date):
         # parse variant file and return lineages that match with metadata lineages
         if args.variants is not None:
             variants = pd.read_csv(args.variants, sep="\t", low_memory=False)
-            lineages = parse_variant_file(dataframe = variants)
+            # compile the variant file's lineages and wildcards
+            # (see parse_variant_file) for lookup
+            resolver = LineageResolver(variants, wildcards=True)
 
             for metadata_lineage in metadata_lineages:
-                for who_lin in lineages:
-                    if "*" in who_lin:
-                        who_lin = who_lin[:-1]
-                        if isinstance(metadata_lineage, str) and metadata_lineage.startswith(who_lin):
-                            parsed_lineages.append(metadata_lineage)
-                    else:
-                        if metadata_lineage == who_lin:
-                            parsed_lineages.append(metadata_lineage)
+                if isinstance(metadata_lineage, str) and \
+                        resolver.resolve(metadata_lineage) is not None:
+                    parsed_lineages.append(metadata_lineage)
             
             new_lineages = None
 
@@ -13,41 +13,37 @@ is used in nf-ncov-voc workflow.
 
 import itertools
 import argparse
+import time
+import numpy as np
 import pysam
 import sys
 import os
-from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
-# fromhttps://www.geeksforgeeks.org/python-make-a-list-of-intervals-with-sequential-numbers/
-# via artic-mask
+# start and end (0-based, inclusive) of each run of True values in a
+# boolean array, found from where the array changes value
 
 
-def intervals_extract(iterable):
-    iterable = sorted(set(iterable))
-    for _, group in itertools.groupby(enumerate(iterable), lambda t: t[1] - t[0]):
-        group = list(group)
-        yield [group[0][1], group[-1][1]]
+def intervals_extract(mask):
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+    return starts, ends
 
 # write the depth mask used with bcftools to turn consensus positions
 # into Ns
 
 
 def write_depth_mask(out_filename, contig_depths, min_coverage):
-    maskfh = open(out_filename, 'w')
+    lines = []
     for contig_name, depths in contig_depths.items():
-        # from artic-mask, create list of positions that fail the
+        # from artic-mask, the intervals of positions that fail the
         # depth check
-        mask_vector = []
-        for pos, depth in enumerate(depths):
-            if depth < min_coverage:
-                mask_vector.append(pos)
-
-        # get the intervals from the mask_vector
-        intervals = list(intervals_extract(mask_vector))
-
-        for i in intervals:
-            maskfh.write("%s\t%s\t%s\n" % (contig_name, i[0]+1, i[1]+1))
-    maskfh.close()
+        starts, ends = intervals_extract(depths < min_coverage)
+        lines.extend("%s\t%s\t%s\n" % (contig_name, start + 1, end + 1)
+                     for start, end in zip(starts.tolist(), ends.tolist()))
+    with open(out_filename, 'w') as maskfh:
+        maskfh.write(''.join(lines))
 
 # calculate the variant allele fraction for each alt allele using
 # freebayes' read/alt observation tags
@@ -158,62 +154,168 @@ def handle_sub(vcf_header, record):
     return output
 
 
-def main():
-
-    description = 'Process a .gvcf file to create a file of consensus '\
-                  'variants, low-frequency variants and a coverage ' \
-                  'mask '
-    parser = argparse.ArgumentParser(description=description)
-
-    parser.add_argument('-m', '--mask-output', required=True,
-                        help=f"The output file name for the coverage "
-                             f"mask\n")
-
-    parser.add_argument('-v', '--variants-output', required=True,
-                        help=f"The output file name for variants ("
-                             f"non-reference gVCF records)\n")
-
-    parser.add_argument('-c', '--consensus-sites-output',
-                        required=True, help=f"The output file name "
-                                            f"for variants that will "
-                                            f"be applied to generate "
-                                            f"the consensus "
-                                            f"sequence\n")
-
-    parser.add_argument('-d', '--min-depth', type=int, default=10,
-                        help=f"Mask reference positions with depth "
-                             f"less than this threshold")
-
-    parser.add_argument('-l', '--lower-ambiguity-frequency',
-                        type=float, default=0.15, help=f"Variants "
-                                                       f"with "
-                                                       f"frequency "
-                                                       f"less than -l "
-                                                       f"will be "
-                                                       f"discarded")
-
-    parser.add_argument('-u', '--upper-ambiguity-frequency',
-                        type=float, default=0.75, help=f"Substitution "
-                                                       f"variants "
-                                                       f"with "
-                                                       f"frequency "
-                                                       f"less than -u "
-                                                       f"will be "
-                                                       f"encoded with "
-                                                       f"IUPAC "
-                                                       f"ambiguity "
-                                                       f"codes")
-
-    parser.add_argument('file', action='store', nargs=1)
-
-    args = parser.parse_args()
-    vcf = pysam.VariantFile(open(args.file[0],'r'))
+# columnar processing of the variant records of a gVCF: the records are
+# loaded into arrays and classified all at once with the same rules as
+# handle_indel, handle_sub and the VAF cutoffs in process_gvcf
+
+# position of each base in the base frequency arrays (4 for any other
+# character)
+base_codes = np.full(256, 4, dtype=np.int64)
+for code, base in enumerate("ACGT"):
+    base_codes[ord(base)] = code
+
+
+def segment_positions(lengths):
+    # position of each element within its segment, for segments of the
+    # given lengths laid end to end
+    lengths = np.asarray(lengths, dtype=np.int64)
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.arange(lengths.sum(), dtype=np.int64) - starts
+
+
+def classify_variants(records, lower_ambiguity_frequency,
+                      upper_ambiguity_frequency):
+    # load the records into arrays, one entry per record or per alt
+    chroms = np.array([r.chrom for r in records], dtype=object)
+    pos = np.array([r.pos for r in records], dtype=np.int64)
+    refs = np.array([r.ref for r in records], dtype=object)
+    alts = np.array([alt for r in records for alt in r.alts], dtype=object)
+    n_alts = np.array([len(r.alts) for r in records], dtype=np.int64)
+    ao = np.array([int(r.info["AO"][i]) for r in records
+                   for i in range(0, len(r.alts))], dtype=np.float64)
+    dp = np.array([r.info["DP"] for r in records], dtype=np.int64)
+
+    alt_record = np.repeat(np.arange(len(records)), n_alts)
+    ref_lengths = np.array([len(ref) for ref in refs], dtype=np.int64)
+    alt_lengths = np.array([len(alt) for alt in alts], dtype=np.int64)
+    vafs = ao / dp[alt_record].astype(np.float64)
+
+    # a record is an indel if any of its alleles is
+    has_indel = np.zeros(len(records), dtype=bool)
+    has_indel[alt_record[alt_lengths != ref_lengths[alt_record]]] = True
+
+    # indels: apply the first alt with the highest VAF, if the VAF
+    # summed over all alts is >= 0.5
+    indel = np.flatnonzero(has_indel)
+    indel_alts = np.flatnonzero(has_indel[alt_record])
+    max_alt = np.zeros(len(indel), dtype=np.int64)
+    max_vaf = np.zeros(len(indel), dtype=np.float64)
+    keep = np.zeros(len(indel), dtype=bool)
+    if len(indel) > 0:
+        offsets = np.cumsum(n_alts[indel]) - n_alts[indel]
+        keep = np.add.reduceat(vafs[indel_alts], offsets) >= 0.5
+        max_vaf = np.maximum.reduceat(vafs[indel_alts], offsets)
+        is_max = vafs[indel_alts] == np.repeat(max_vaf, n_alts[indel])
+        max_alt = indel_alts[np.minimum.reduceat(
+            np.where(is_max, np.arange(len(indel_alts)), len(indel_alts)),
+            offsets)]
+    indel, max_alt, max_vaf = indel[keep], max_alt[keep], max_vaf[keep]
+
+    # subs (SNPs and MNPs): at each position, sum the VAF of the alts
+    # by base, and apply the base with the highest VAF other than the
+    # reference
+    sub = np.flatnonzero(~has_indel)
+    sub_alts = np.flatnonzero(~has_indel[alt_record])
+    assert(np.all(alt_lengths[sub_alts] ==
+                  ref_lengths[alt_record[sub_alts]]))
+    first_site = np.zeros(len(records), dtype=np.int64)
+    first_site[sub] = np.cumsum(ref_lengths[sub]) - ref_lengths[sub]
+    site_record = np.repeat(sub, ref_lengths[sub])
+    site_offset = segment_positions(ref_lengths[sub])
+    ref_bases = np.array(list(''.join(refs[sub])), dtype=object)
+    alt_bases = base_codes[np.frombuffer(
+        ''.join(alts[sub_alts]).encode(), dtype=np.uint8)]
+    assert(np.all(alt_bases < 4))
+    alt_sites = np.repeat(first_site[alt_record[sub_alts]],
+                          alt_lengths[sub_alts]) + \
+        segment_positions(alt_lengths[sub_alts])
+    # VAFs are added up in alt order, as in handle_sub
+    base_frequency = np.zeros((len(site_record), 5), dtype=np.float64)
+    np.add.at(base_frequency, (alt_sites, alt_bases),
+              np.repeat(vafs[sub_alts], alt_lengths[sub_alts]))
+    sites = np.arange(len(site_record))
+    base_frequency[sites, base_codes[np.frombuffer(
+        ''.join(refs[sub]).encode(), dtype=np.uint8)]] = 0.0
+    # first of "ACGT" with the highest VAF, if any is above 0
+    max_base = np.argmax(base_frequency[:, :4], axis=1)
+    base_vaf = base_frequency[sites, max_base]
+    has_base = base_vaf > 0.0
+
+    # one consensus site per indel and per changed base of each sub,
+    # in record order
+    out_record = np.concatenate([indel, site_record[has_base]])
+    out_pos = np.concatenate([pos[indel],
+                              (pos[site_record] + site_offset)[has_base]])
+    out_ref = np.concatenate([refs[indel], ref_bases[has_base]])
+    out_alt = np.concatenate([
+        alts[max_alt],
+        np.array(list("ACGT"), dtype=object)[max_base[has_base]]])
+    # VAFs are classified as stored in the VCF, as float32
+    out_vaf = np.concatenate([max_vaf, base_vaf[has_base]]).astype(
+        np.float32)
+    out_is_indel = np.concatenate([
+        ref_lengths[indel] != alt_lengths[max_alt],
+        np.zeros(has_base.sum(), dtype=bool)])
+
+    # discard low frequency variants; high-frequency subs and indels are
+    # fixed, the rest are ambiguous
+    order = np.argsort(out_record, kind='stable')
+    order = order[out_vaf[order].astype(np.float64) >=
+                  lower_ambiguity_frequency]
+    fixed = (out_vaf.astype(np.float64) > upper_ambiguity_frequency) | \
+        out_is_indel
+    tags = np.where(fixed, "fixed", "ambiguous")
+
+    consensus_sites = dict(chrom=chroms[out_record[order]],
+                           pos=out_pos[order], ref=out_ref[order],
+                           alt=out_alt[order], dp=dp[out_record[order]],
+                           vaf=out_vaf[order], tag=tags[order])
+
+    # records with at least one consensus site, with the VAF of each alt
+    accepted = np.unique(out_record[order])
+    alt_offsets = np.cumsum(n_alts) - n_alts
+    accepted_vafs = [vafs[alt_offsets[r]:alt_offsets[r] + n_alts[r]].tolist()
+                     for r in accepted]
+    return consensus_sites, accepted, accepted_vafs
+
+# write the consensus sites VCF as text in one go, formatted the way
+# htslib (as of pysam 0.24) formats the records make_simple_record makes:
+# no ID, QUAL or FILTER, INFO in header order, the float32 VAF as '%g',
+# and '.' for FORMAT and each sample of a header with samples.
+# test_columnar_matches_record_by_record checks the output is identical
+# to the record-by-record path
+
+
+def write_consensus_sites(out_filename, out_header, consensus_sites):
+    n_samples = len(out_header.samples)
+    missing_samples = "\t." * (n_samples + 1) if n_samples > 0 else ""
+    lines = ["%s\t%d\t.\t%s\t%s\t.\t.\tDP=%d;VAF=%s;ConsensusTag=%s%s\n"
+             % (chrom, pos, ref, alt, dp, '%g' % vaf, tag, missing_samples)
+             for chrom, pos, ref, alt, dp, vaf, tag in zip(
+                 consensus_sites["chrom"], consensus_sites["pos"].tolist(),
+                 consensus_sites["ref"], consensus_sites["alt"],
+                 consensus_sites["dp"].tolist(),
+                 consensus_sites["vaf"].tolist(), consensus_sites["tag"])]
+    with open(out_filename, 'w') as consensus_fh:
+        consensus_fh.write(str(out_header) + ''.join(lines))
+
+# process one gVCF into its coverage mask, variants and consensus sites
+# files
+
+
+def process_gvcf(gvcf_file, mask_output, variants_output,
+                 consensus_sites_output, min_depth=10,
+                 lower_ambiguity_frequency=0.15,
+                 upper_ambiguity_frequency=0.75, columnar=False):
+    gvcf_fh = open(gvcf_file,'r')
+    vcf = pysam.VariantFile(gvcf_fh)
 
     # Initialize depth mask to all zeros for all contigs
-    contig_depth = defaultdict(list)
+    contig_depth = dict()
     for r in vcf.header.records:
         if r.type == "CONTIG":
-            contig_depth[r['ID']] = [0] * int(r['length'])
+            contig_depth[r['ID']] = np.zeros(int(r['length']),
+                                             dtype=np.int32)
 
     out_header = vcf.header
 
@@ -222,7 +324,7 @@ def main():
                         description="Variant allele fraction, called "
                                     "from observed reference/alt "
                                     "reads")
-    variants_out = pysam.VariantFile(args.variants_output, 'w',
+    variants_out = pysam.VariantFile(variants_output, 'w',
                                      header=out_header)
 
     # open the output file with the changes to apply to the consensus
@@ -231,8 +333,12 @@ def main():
                         description="The type of base to be included "
                                     "in the consensus sequence (IUPAC"
                                     " or Fixed)")
-    consensus_sites_out = pysam.VariantFile(
-        args.consensus_sites_output, 'w', header=out_header)
+    # in columnar mode, variant records are kept and classified after
+    # reading the whole file, and the consensus sites are written at once
+    variant_records = list()
+    if not columnar:
+        consensus_sites_out = pysam.VariantFile(
+            consensus_sites_output, 'w', header=out_header)
 
     for record in vcf:
 
@@ -249,15 +355,19 @@ def main():
         assert(not is_gvcf_ref or v_start == v_end)
 
         # update depth mask
-        for i in range(v_start, v_end + 1):
-            assert(i > 0)
-            # VCF coordinates are 1-based, we record the depth vector
-            # as 0-based to be consistent with artic-mask
-            contig_depth[record.chrom][i - 1] = depth
+        assert(v_start > 0)
+        assert(v_end <= len(contig_depth[record.chrom]))
+        # VCF coordinates are 1-based, we record the depth vector
+        # as 0-based to be consistent with artic-mask
+        contig_depth[record.chrom][v_start - 1:v_end] = depth
 
         # do nothing else with ref records, or records that don't
         # meet our minimum depth
-        if is_gvcf_ref or depth < args.min_depth:
+        if is_gvcf_ref or depth < min_depth:
+            continue
+
+        if columnar:
+            variant_records.append(record)
             continue
 
         # determine if any allele in the variant is an indel
@@ -288,7 +398,7 @@ def main():
             is_indel = len(out_r.ref) != len(out_r.alts[0])
 
             # discard low frequency variants
-            if vaf < args.lower_ambiguity_frequency:
+            if vaf < lower_ambiguity_frequency:
                 continue
 
             # Write a tag describing what to do with the variant
@@ -298,7 +408,7 @@ def main():
             # without ambiguity
             # we don't have to do an indel VAF check here as it is
             # dealt with in handle_indel
-            if vaf > args.upper_ambiguity_frequency or is_indel:
+            if vaf > upper_ambiguity_frequency or is_indel:
                 # always apply these to the consensus
                 consensus_tag = "fixed"
             else:
@@ -313,7 +423,172 @@ def main():
             record.info["VAF"] = calculate_vafs(record)
             variants_out.write(record)
 
-    write_depth_mask(args.mask_output, contig_depth, args.min_depth)
+    if columnar:
+        consensus_sites, accepted, accepted_vafs = classify_variants(
+            variant_records, lower_ambiguity_frequency,
+            upper_ambiguity_frequency)
+        write_consensus_sites(consensus_sites_output, out_header,
+                              consensus_sites)
+        for r, vafs in zip(accepted, accepted_vafs):
+            variant_records[r].info["VAF"] = vafs
+            variants_out.write(variant_records[r])
+    else:
+        consensus_sites_out.close()
+
+    vcf.close()
+    gvcf_fh.close()
+    variants_out.close()
+    write_depth_mask(mask_output, contig_depth, min_depth)
+
+# output file names of a gVCF in manifest mode, named after the gVCF
+# without its extension as in the per-sample workflow step
+
+
+def sample_outputs(gvcf_file, outdir):
+    sample = os.path.splitext(os.path.basename(gvcf_file))[0]
+    prefix = os.path.join(outdir, sample)
+    return (sample, prefix + ".mask.txt", prefix + ".variants.vcf",
+            prefix + ".consensus.vcf")
+
+# process one gVCF of a manifest, returning the sample name and the
+# time it took in seconds
+
+
+def process_sample(gvcf_file, outdir, settings):
+    start = time.perf_counter()
+    sample, mask_output, variants_output, consensus_sites_output = \
+        sample_outputs(gvcf_file, outdir)
+    process_gvcf(gvcf_file, mask_output, variants_output,
+                 consensus_sites_output, **settings)
+    return sample, time.perf_counter() - start
+
+# read the gVCF paths of a manifest, one per line; blank lines and
+# lines starting with '#' are skipped
+
+
+def read_manifest(manifest):
+    with open(manifest) as fh:
+        return [line.strip() for line in fh
+                if line.strip() and not line.startswith('#')]
+
+# process all gVCFs of a manifest with a pool of worker processes,
+# printing the time taken by each sample
+
+
+def process_manifest(manifest, outdir, jobs, settings):
+    gvcf_files = read_manifest(manifest)
+    # outputs are named after the sample, so gVCFs with the same file
+    # name (eg. in different directories) would overwrite each other
+    samples = {}
+    for gvcf_file in gvcf_files:
+        samples.setdefault(sample_outputs(gvcf_file, outdir)[0],
+                           []).append(gvcf_file)
+    duplicates = [files for files in samples.values() if len(files) > 1]
+    if duplicates:
+        raise ValueError("gVCFs in %s with the same sample name: %s" % (
+            manifest, "; ".join(", ".join(files) for files in duplicates)))
+    start = time.perf_counter()
+    print("sample\tseconds")
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for sample, seconds in executor.map(
+                process_sample, gvcf_files,
+                itertools.repeat(outdir), itertools.repeat(settings)):
+            print("%s\t%.3f" % (sample, seconds))
+            sys.stdout.flush()
+    print("total (%d samples)\t%.3f" % (len(gvcf_files),
+                                        time.perf_counter() - start))
+
+
+def main():
+
+    description = 'Process a .gvcf file to create a file of consensus '\
+                  'variants, low-frequency variants and a coverage ' \
+                  'mask '
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument('-m', '--mask-output',
+                        help=f"The output file name for the coverage "
+                             f"mask\n")
+
+    parser.add_argument('-v', '--variants-output',
+                        help=f"The output file name for variants ("
+                             f"non-reference gVCF records)\n")
+
+    parser.add_argument('-c', '--consensus-sites-output',
+                        help=f"The output file name "
+                                            f"for variants that will "
+                                            f"be applied to generate "
+                                            f"the consensus "
+                                            f"sequence\n")
+
+    parser.add_argument('-d', '--min-depth', type=int, default=10,
+                        help=f"Mask reference positions with depth "
+                             f"less than this threshold")
+
+    parser.add_argument('-l', '--lower-ambiguity-frequency',
+                        type=float, default=0.15, help=f"Variants "
+                                                       f"with "
+                                                       f"frequency "
+                                                       f"less than -l "
+                                                       f"will be "
+                                                       f"discarded")
+
+    parser.add_argument('-u', '--upper-ambiguity-frequency',
+                        type=float, default=0.75, help=f"Substitution "
+                                                       f"variants "
+                                                       f"with "
+                                                       f"frequency "
+                                                       f"less than -u "
+                                                       f"will be "
+                                                       f"encoded with "
+                                                       f"IUPAC "
+                                                       f"ambiguity "
+                                                       f"codes")
+
+    parser.add_argument('--manifest',
+                        help=f"A file listing one .gvcf file per line, "
+                             f"to process all of them instead of a "
+                             f"single file. The outputs of each are "
+                             f"named after the .gvcf file: "
+                             f"<name>.mask.txt, <name>.variants.vcf "
+                             f"and <name>.consensus.vcf")
+
+    parser.add_argument('--outdir', default='.',
+                        help=f"Output directory in --manifest mode")
+
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help=f"Number of .gvcf files processed in "
+                             f"parallel in --manifest mode")
+
+    parser.add_argument('--columnar', action='store_true',
+                        help=f"Classify the variant records of each "
+                             f".gvcf file all at once with NumPy "
+                             f"arrays, and write the consensus sites in "
+                             f"bulk; the outputs are the same")
+
+    parser.add_argument('file', action='store', nargs='?')
+
+    args = parser.parse_args()
+
+    settings = dict(
+        min_depth=args.min_depth,
+        lower_ambiguity_frequency=args.lower_ambiguity_frequency,
+        upper_ambiguity_frequency=args.upper_ambiguity_frequency,
+        columnar=args.columnar)
+
+    if args.manifest is not None:
+        if args.file is not None:
+            parser.error("a .gvcf file can't be given with --manifest")
+        process_manifest(args.manifest, args.outdir, args.jobs, settings)
+        return
+
+    if args.file is None or args.mask_output is None or \
+            args.variants_output is None or \
+            args.consensus_sites_output is None:
+        parser.error("a .gvcf file and -m, -v and -c are required "
+                     "without --manifest")
+    process_gvcf(args.file, args.mask_output, args.variants_output,
+                 args.consensus_sites_output, **settings)
 
 
 if __name__ == "__main__":
@@ -33,6 +33,32 @@ def parse_args():
     return parser.parse_args()
 
 
+def split_gvf_names(gvf, names_to_split, expanded=False):
+    # if expanded=True, the GVF already has one column per attribute and
+    # is returned that way, instead of with a single '#attributes' column
+    if not expanded:
+        # expand #attributes into columns to edit separately
+        gvf = separate_attributes(gvf)
+
+    # split names in "Names" attribute into separate rows
+    gvf = split_names(names_to_split, gvf, col_to_split='Name')
+    
+    # rename IDs: rows with the same entry in 'Name'
+    # get the same ID
+    gvf['ID'] = 'ID_' + gvf.groupby('Name', sort=False).ngroup().astype(str)
+
+    if expanded:
+        return gvf
+
+    # merge attributes back into a single column
+    gvf = rejoin_attributes(gvf, empty_attributes)
+
+    # discard temporary columns
+    gvf = gvf[gvf_columns]
+
+    return gvf
+
+
 if __name__ == '__main__':
 
     args = parse_args()
@@ -48,21 +74,8 @@ if __name__ == '__main__':
     pragmas = pragmas.fillna('')
     gvf = gvf[~gvf['#seqid'].astype(str).str.contains("#")]
 
-    # expand #attributes into columns to edit separately
-    gvf = separate_attributes(gvf)
-
     # split names in "Names" attribute into separate rows
-    gvf = split_names(args.names_to_split, gvf, col_to_split='Name')
-    
-    # rename IDs: rows with the same entry in 'Name'
-    # get the same ID
-    gvf['ID'] = 'ID_' + gvf.groupby('Name', sort=False).ngroup().astype(str)
-    
-    # merge attributes back into a single column
-    gvf = rejoin_attributes(gvf, empty_attributes)
-
-    # discard temporary columns
-    gvf = gvf[gvf_columns]
+    gvf = split_gvf_names(gvf, args.names_to_split)
     
     # add pragmas to gvf
     # columns are now 0, 1, ...
@@ -19,12 +19,14 @@ import glob
 import os
 import csv
 from functions import separate_attributes
+from mutation_index_store import MutationIndexStore
 
 def parse_args():
     parser = argparse.ArgumentParser(
         description='Creates a list of all unique mutation names across all GVFs')
     parser.add_argument('--mutation_index', type=str, default=None,
-                        help='Path to the TSV index of all mutations')
+                        help='Path to the TSV index of all mutations, or '
+                             'to a mutation index store directory')
     parser.add_argument('--gvf_files', type=str, default=None,
                         nargs='*', help='Paths to GVF files to process')
     parser.add_argument('--index_savefile', type=str,
@@ -33,6 +35,10 @@ def parse_args():
                         default=None, help='Path to partial log file, to append new mutations to')
     parser.add_argument('--log_savefile', type=str,
                         default=None, help='Filename to save log to')
+    parser.add_argument('--index_store', type=str,
+                        default=None, help='Mutation index store directory '
+                                           'to add the mutations of the GVFs '
+                                           'to, as a new segment')
 
     return parser.parse_args()
 
@@ -68,6 +74,47 @@ def gvf2df(gvf):
 
     return df, lineage
 
+class IncrementalMutationIndex:
+    '''
+    The mutation index, with the lineages of each mutation (all index
+    columns but 'lineages') kept in a list, so new GVFs are added in
+    time proportional to their own size, and the index is only turned
+    back into a dataframe once, at the end.
+    Mutations not in the starting index are tracked, for the logfile.
+    '''
+
+    def __init__(self, mutation_index, group_cols):
+        self.group_cols = group_cols
+        self.lineages = dict()
+        keys = mutation_index[group_cols].itertuples(index=False, name=None)
+        for key, lineages in zip(keys, mutation_index['lineages']):
+            self.lineages.setdefault(key, []).append(lineages)
+        # mutations first seen in the added GVFs, in order of appearance
+        self.new_keys = dict()
+
+    def add(self, df):
+        keys = df[self.group_cols].itertuples(index=False, name=None)
+        for key, lineage in zip(keys, df['lineages']):
+            if key not in self.lineages:
+                self.lineages[key] = []
+                self.new_keys[key] = None
+            self.lineages[key].append(lineage)
+
+    def to_dataframe(self, keys=None):
+        '''Returns the index (or the rows of the given keys), with the
+        lineages of each mutation comma-separated, sorted by pos.'''
+        if keys is None:
+            keys = self.lineages.keys()
+        keys = list(keys)
+        df = pd.DataFrame(keys, columns=self.group_cols, dtype=str)
+        df['lineages'] = [','.join(self.lineages[key]) for key in keys]
+        # drop rows without a position
+        df = df[df['pos']!='nan']
+        df = df.sort_values(by=self.group_cols, kind='mergesort')
+        df['pos'] = df['pos'].astype(int)
+        return df.sort_values(by=['pos'], kind='mergesort')
+
+
 if __name__ == '__main__':
 
     args = parse_args()
@@ -77,79 +124,65 @@ if __name__ == '__main__':
     partial_logfile = args.partial_logfile
     log_savefile = args.log_savefile
     
-    # set empty structures for creating the logfile at the end
-    lineages = []
-    logfile_df = pd.DataFrame(np.empty((0, 4)), columns=['pos', 'alias', 'new_mutations', 'lineages'])
 
     # set mutation index columns
     index_cols=['pos', 'mutation', 'hgvs_aa_mutation', 'hgvs_nt_mutation', 'gene', 'protein_name', 'alias', 'hgvs_alias', 'alias_protein', 'Pokay_annotation', 'lineages']
 
     # open the mutation index if the path was provided
-    if mutation_index_path!=None:
-        mutation_index = pd.read_csv(mutation_index_path, sep='\t', dtype='str')
+    # (values are kept as written, eg. 'nan' stays a string, so that they
+    # match the values from the GVFs)
+    if mutation_index_path!=None and os.path.isdir(mutation_index_path):
+        mutation_index = MutationIndexStore(mutation_index_path).read()
+        mutation_index['pos'] = mutation_index['pos'].astype(str)
+    elif mutation_index_path!=None:
+        mutation_index = pd.read_csv(mutation_index_path, sep='\t', dtype='str', keep_default_na=False)
     # if no path was given, create a new mutation index from scratch
     else:
-        mutation_index = pd.DataFrame(np.empty((0, 11)), columns=index_cols)
-    mutation_index['pos'] = mutation_index['pos'].astype(int)
-
+        mutation_index = pd.DataFrame(columns=index_cols, dtype=str)
 
     # for troubleshooting: make practice mutation_index with all mentions of ['HH.1.1', 'FT.3.1.1'] removed
     #for lineage in ['HH.1.1', 'FT.3.1.1']:
     #    mutation_index = mutation_index[mutation_index['lineage']!=lineage]
     #    mutation_index['lineage'] = mutation_index['lineage'].str.replace(lineage, "")
 
+    # the lineages of each mutation are collected by all other columns
+    group_cols = [x for x in index_cols if x != 'lineages']
+    index = IncrementalMutationIndex(mutation_index, group_cols)
 
-    # iterate through gvfs in the list argument and get set from each
+    # iterate through gvfs in the list argument and add each one's
+    # mutations and lineage to the index
+    gvf_dfs = []
     for file in gvf_list:
         print("Processing: " + file)
 
         # open gvf and reformat to match the mutation index
         df, lineage = gvf2df(file)
-        lineages.append(lineage)
-        # append the new gvf df to the index and use groupby() to add the lineage where 
-        mutation_index = pd.concat([mutation_index, df])
-        mutation_index['alias'] = mutation_index['alias'].astype(str)
-        # groupby group_cols, adding new lineages to "lineages" in a coma-separated string
-        group_cols = [x for x in index_cols if x != 'lineages']
-        mutation_index = mutation_index.groupby(by=group_cols, as_index=False)['lineages'].apply(','.join)
-
-        # if a starting index was provided, extract novel mutations to a new dataframe to save to the logfile
-        if mutation_index_path!=None:
-            # make a copy of the rows with novel mutations, ie. rows where "lineage"==gvf_lineage 
-            lineage_mask = mutation_index['lineages'].str.contains(lineage)
-            lineage_chunk = mutation_index.loc[lineage_mask,:].copy()
-            # fill in 'new_mutations' column like: "gene:mutation / nsp:alias"
-            lineage_chunk['new_mutations'] = lineage_chunk["gene"] + ":" + lineage_chunk["mutation"]
-            orf1ab_mask = lineage_chunk['gene'].astype(str).str.contains("ORF1ab")
-            lineage_chunk.loc[orf1ab_mask, 'new_mutations'] = lineage_chunk['new_mutations'] + " / " + lineage_chunk["alias_protein"] + ":" + lineage_chunk["alias"]
-            intergenic_mask = lineage_chunk['protein_name'].astype(str).str.contains("nan")
-            lineage_chunk.loc[intergenic_mask, 'new_mutations'] =  lineage_chunk.loc[intergenic_mask, 'new_mutations'].str.replace("nan", "intergenic", regex=True)
-            # drop duplicates (there shouldn't be any)
-            lineage_chunk = lineage_chunk[['pos', 'new_mutations', 'lineages']].drop_duplicates()
-            # drop NaN rows
-            lineage_chunk = lineage_chunk[lineage_chunk['pos'].notna()]
-            # append to logfile_df
-            logfile_df = pd.concat([logfile_df, lineage_chunk])
-            logfile_df['pos'] = logfile_df['pos'].astype(int)
-            
-
-    # sort mutation index by pos
-    mutation_index = mutation_index[mutation_index['pos']!='nan']
-    mutation_index['pos'] = mutation_index['pos'].astype(int)
-    mutation_index = mutation_index.sort_values(by=['pos'])
-    # save new mutation index
-    mutation_index.to_csv(index_savefile, sep='\t', header=True, index=False)
+        index.add(df)
+        gvf_dfs.append(df)
+
+    # save new mutation index, sorted by pos
+    mutation_index = index.to_dataframe()
+    if index_savefile!=None:
+        mutation_index.to_csv(index_savefile, sep='\t', header=True, index=False)
+
+    # add the new rows to the index store, rather than rewriting it
+    if args.index_store!=None:
+        new_rows = pd.concat(gvf_dfs)
+        new_rows = new_rows[new_rows['pos']!='nan']
+        new_rows['pos'] = new_rows['pos'].astype(int)
+        MutationIndexStore(args.index_store).append(new_rows)
 
     # if a starting index was provided, make a logfile
     if mutation_index_path!=None:
-        # clean up logfile_df: restrict df to rows with new mutations, added to the index from the GVFs added above
-        gvf_lineage_set = lineages
-        # get list of lists for "lineages" column
-        lineages_col = logfile_df["lineages"].str.split(",").tolist()
-        # keep only rows that have only lineages from the new GVFs
-        new_mutation_check = [set(subl).issubset(gvf_lineage_set) for subl in lineages_col]
-        logfile_df["new_mutation_check"] = new_mutation_check
-        logfile_df = logfile_df[logfile_df['new_mutation_check']==True]
+        # the new mutations are the ones not in the starting index, so
+        # they only have lineages from the new GVFs
+        logfile_df = index.to_dataframe(index.new_keys.keys())
+        # fill in 'new_mutations' column like: "gene:mutation / nsp:alias"
+        logfile_df['new_mutations'] = logfile_df["gene"] + ":" + logfile_df["mutation"]
+        orf1ab_mask = logfile_df['gene'].astype(str).str.contains("ORF1ab")
+        logfile_df.loc[orf1ab_mask, 'new_mutations'] = logfile_df['new_mutations'] + " / " + logfile_df["alias_protein"] + ":" + logfile_df["alias"]
+        intergenic_mask = logfile_df['protein_name'].astype(str).str.contains("nan")
+        logfile_df.loc[intergenic_mask, 'new_mutations'] =  logfile_df.loc[intergenic_mask, 'new_mutations'].str.replace("nan", "intergenic", regex=True)
         logfile_df = logfile_df[['new_mutations', 'lineages']]
 
         # read in partial logfile, append the mutations list, and save to the new name
@@ -18,15 +18,32 @@ import argparse
 import pandas as pd
 import numpy as np
 import json
-from functions import parse_INFO, find_sample_size, \
-    unnest_multi, get_unknown_labels, separate_attributes, rejoin_attributes, \
+from functions import parse_INFO, parse_EFF_records, find_sample_size, \
+    select_snpeff_records, unnest_multi, get_unknown_labels, separate_attributes, rejoin_attributes, \
     clade_defining_threshold, map_pos_to_gene_protein, add_alias_names, \
     convert_amino_acid_codes, rewrite_nt_snps_as_hgvs, remove_nts_from_nt_name, \
     add_hgvs_names
+from functions import load_hgvs_cache, save_hgvs_cache
 from functions import empty_attributes, gvf_columns, vcf_columns, pragmas
+from gene_positions import load_gene_position_indices
 
 
-def vcftogvf(vcf, strain, GENE_PROTEIN_POSITIONS_DICT, sample_size):
+# FORMAT fields holding the 'ro', 'ao' and 'dp' attributes for each
+# variant-calling source (see get_unknown_labels); iVar has no per-sample
+# depth, so 'dp' comes from INFO
+format_attributes = {"freeBayes": {"ro": "RO", "ao": "AO", "dp": "DP"},
+                     "iVar": {"ro": "REF_DP", "ao": "ALT_DP"}}
+
+# INFO fields extracted by parse_INFO, and their column names
+info_attributes = {'DP': 'dp', 'ps_filter': 'ps_filter', 'ps_exc': 'ps_exc',
+                   'mat_pep': 'mat_pep', 'mat_pep_desc': 'mat_pep_desc',
+                   'mat_pep_acc': 'mat_pep_acc'}
+
+
+def vcftogvf(vcf, strain, GENE_PROTEIN_POSITIONS_DICT, sample_size,
+             clades_threshold=0.75, expanded=False, cds_index=None):
+    # if expanded=True, the GVF is returned with one column per attribute
+    # instead of a single '#attributes' column, for further processing
     vcf_df = pd.read_csv(vcf, sep='\t', names=vcf_columns)
     # get variant-calling source
     var_cols = get_unknown_labels(vcf_df)
@@ -38,6 +55,28 @@ def vcftogvf(vcf, strain, GENE_PROTEIN_POSITIONS_DICT, sample_size):
     # expand INFO column into multiple columns
     vcf_df = parse_INFO(vcf_df, var_cols)
 
+    # fill in the GVF from the parsed VCF
+    new_gvf = make_gvf(vcf_df, strain, GENE_PROTEIN_POSITIONS_DICT,
+                       sample_size, clades_threshold, cds_index)
+
+    # add 'ID' attribute: here, rows with the same entry in 'Name'
+    # get the same ID (should all be different)
+    new_gvf['ID'] = 'ID_' + new_gvf.groupby('Name', sort=False).ngroup().astype(str)
+
+    if expanded:
+        return new_gvf
+
+    # merge attributes back into a single column
+    new_gvf = rejoin_attributes(new_gvf, empty_attributes)
+    
+    return new_gvf
+
+
+def make_gvf(vcf_df, strain, GENE_PROTEIN_POSITIONS_DICT, sample_size,
+             clades_threshold=0.75, cds_index=None):
+    # creates the GVF, with one column per attribute and no 'ID' yet,
+    # from a VCF dataframe expanded by parse_INFO (one row per allele)
+
     # create an empty df to make the new GVF in
     new_gvf = pd.DataFrame(index=range(0, len(vcf_df)), columns=gvf_columns)
 
@@ -83,7 +122,7 @@ def vcftogvf(vcf, strain, GENE_PROTEIN_POSITIONS_DICT, sample_size):
     
     # add gene and protein attributes from JSON
     json_df = map_pos_to_gene_protein(
-        vcf_df['POS'].astype(int), GENE_PROTEIN_POSITIONS_DICT)
+        vcf_df['POS'].astype(int), GENE_PROTEIN_POSITIONS_DICT, cds_index)
     new_gvf["gene"] = json_df["gene"]
     new_gvf["protein_name"] = json_df["protein_name"]
     new_gvf["protein_symbol"] = json_df["protein_symbol"]
@@ -93,7 +132,7 @@ def vcftogvf(vcf, strain, GENE_PROTEIN_POSITIONS_DICT, sample_size):
     new_gvf = add_alias_names(new_gvf, GENE_PROTEIN_POSITIONS_DICT)
 
     # add clade_defining attribute
-    new_gvf = clade_defining_threshold(args.clades_threshold,
+    new_gvf = clade_defining_threshold(clades_threshold,
                                              new_gvf, sample_size)
     
     # add HGVS names columns: 'hgvs_nt', 'hgvs_aa', 'hgvs_alias'
@@ -101,17 +140,112 @@ def vcftogvf(vcf, strain, GENE_PROTEIN_POSITIONS_DICT, sample_size):
     
     # save HGVS names for troubleshooting
     #new_gvf[['nt_name', 'hgvs_nt', 'aa_name', 'hgvs_aa', 'alias', 'hgvs_alias']].to_csv('hgvs_troubleshooting.tsv', sep='\t')
-    
-    # add 'ID' attribute: here, rows with the same entry in 'Name'
-    # get the same ID (should all be different)
-    new_gvf['ID'] = 'ID_' + new_gvf.groupby('Name', sort=False).ngroup().astype(str)
-    
-    # merge attributes back into a single column
-    new_gvf = rejoin_attributes(new_gvf, empty_attributes)
-    
+
     return new_gvf
 
 
+def format_values(record, field):
+    # values of a FORMAT field for the (single) sample, as strings
+    values = record.format(field)
+    if values.dtype.kind == 'U':
+        # String-typed fields are not split up by cyvcf2
+        return str(values[0]).split(',')
+    return [str(x) for x in values[0]]
+
+
+def read_vcf_chunks(vcf, chunk_size=10000):
+    # reads the VCF record by record with cyvcf2, yielding dataframes of
+    # up to chunk_size records in the same form as parse_INFO's output
+    # before parse_EFF_records (one row per alternate allele)
+    # cyvcf2 is only needed in streaming mode
+    from cyvcf2 import VCF
+
+    vcf_reader = VCF(vcf)
+    # get variant-calling source from the pragmas, as in get_unknown_labels
+    source = [line for line in vcf_reader.raw_header.split('\n')
+              if line.startswith("##source=")][0].split("=")[1].split()[0]
+    fields = format_attributes[source]
+
+    columns = ['#CHROM', 'POS', 'REF', 'ALT', 'eff_result'] + \
+        list(info_attributes.values()) + ['ro', 'ao']
+    rows = []
+    n_records = 0
+    for record in vcf_reader:
+        info = [record.INFO.get(key) for key in info_attributes.keys()]
+        info = [None if value is None else str(value) for value in info]
+        if 'dp' in fields:
+            # per-sample depth replaces INFO/DP, as in parse_INFO
+            info[0] = ",".join(format_values(record, fields['dp']))
+        ro = ",".join(format_values(record, fields['ro']))
+        ao = format_values(record, fields['ao'])
+
+        # expand multi-allelic records: one row per ALT allele, each
+        # with its own EFF record and AO count
+        eff_result = select_snpeff_records(record.INFO.get('EFF'), len(ao))
+        # the default mode fails on mismatched counts when unnesting them,
+        # so fail here too rather than dropping alleles
+        if not len(eff_result) == len(ao) == len(record.ALT):
+            raise ValueError("%s:%d has %d EFF records, %d AO values and "
+                             "%d ALT alleles" % (record.CHROM, record.POS,
+                                                 len(eff_result), len(ao),
+                                                 len(record.ALT)))
+        for eff, alt_ao, alt in zip(eff_result, ao, record.ALT):
+            rows.append([record.CHROM, str(record.POS), record.REF, alt,
+                         eff] + info + [ro, alt_ao])
+
+        n_records += 1
+        if n_records == chunk_size:
+            yield pd.DataFrame(rows, columns=columns)
+            rows = []
+            n_records = 0
+
+    if len(rows) > 0:
+        yield pd.DataFrame(rows, columns=columns)
+    vcf_reader.close()
+
+
+def vcftogvf_streaming(vcf, outgvf, gvf_pragmas, strain,
+                       GENE_PROTEIN_POSITIONS_DICT, sample_size,
+                       clades_threshold=0.75, chunk_size=10000,
+                       cds_index=None):
+    # converts the VCF to GVF chunk_size records at a time, appending each
+    # chunk's GVF rows to outgvf, so memory use stays flat for large VCFs.
+    # The output file is the same as with vcftogvf().
+
+    # write pragmas and header
+    header = pd.DataFrame([gvf_columns])
+    final_gvf = gvf_pragmas.append(header)
+    final_gvf.to_csv(outgvf, sep='\t', index=False, header=False)
+
+    # IDs of the names seen so far, numbered in order of first appearance
+    # over the whole VCF, as groupby('Name', sort=False).ngroup() would
+    name_ids = {}
+    for vcf_df in read_vcf_chunks(vcf, chunk_size):
+        vcf_df = parse_EFF_records(vcf_df)
+        new_gvf = make_gvf(vcf_df, strain, GENE_PROTEIN_POSITIONS_DICT,
+                           sample_size, clades_threshold, cds_index)
+
+        for name in new_gvf['Name'].dropna().unique():
+            if name not in name_ids:
+                name_ids[name] = len(name_ids)
+        new_gvf['ID'] = 'ID_' + new_gvf['Name'].map(name_ids).fillna(
+            -1).astype(int).astype(str)
+
+        new_gvf = rejoin_attributes(new_gvf, empty_attributes)
+        new_gvf[gvf_columns].to_csv(outgvf, sep='\t', index=False,
+                                    header=False, mode='a')
+
+
+def make_pragmas(species, sample_desc, sample_group):
+    # fill in the species and sample description pragmas
+    gvf_pragmas = pragmas.copy()
+    # add species to pragmas
+    gvf_pragmas[0] = gvf_pragmas[0].str.replace("##species", "##species " + str(species))
+    # temporary pragma, subject to change
+    gvf_pragmas[0] = gvf_pragmas[0].str.replace("##sample-description", "##sample-description " + 'sample_desc=' + str(sample_desc) +';' + 'sample_group=' + str(sample_group) + ';')
+
+    return gvf_pragmas
+
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -140,6 +274,16 @@ def parse_args():
                         action="store_true")
     parser.add_argument('--outgvf', type=str, required=True,
                         help='Filename for the output GVF file')
+    parser.add_argument("--streaming", help="Read the VCF record by record "
+                        "with cyvcf2 and write the GVF in chunks, for "
+                        "large VCFs", action="store_true")
+    parser.add_argument('--chunk_size', type=int, default=10000,
+                        help='Number of VCF records per chunk in '
+                             'streaming mode')
+    parser.add_argument('--hgvs_cache', type=str, default=None,
+                        help='JSON file of HGVS names worked out in '
+                             'previous runs; created or updated with '
+                             'this run\'s names')
 
     return parser.parse_args()
 
@@ -151,6 +295,9 @@ if __name__ == '__main__':
     # Reading the gene & protein coordinates of SARS-CoV-2 genome
     with open(args.gene_positions) as fp:
         GENE_PROTEIN_POSITIONS_DICT = json.load(fp)
+    # CDS lookup, from the compiled gene positions file if available
+    cds_index = load_gene_position_indices(
+        args.gene_positions, GENE_PROTEIN_POSITIONS_DICT)["CDS"]
     
     # Assigning variables
     vcf_file = args.vcffile
@@ -171,25 +318,37 @@ if __name__ == '__main__':
 
     sample_size = find_sample_size(size_stats, strain, vcf_file, args.wastewater)
     
-    # create gvf from annotated vcf (ignoring pragmas for now)
-    gvf = vcftogvf(vcf_file, strain, GENE_PROTEIN_POSITIONS_DICT,
-                   sample_size)
-    
-    # add species to pragmas
+    # add species and sample description to pragmas
     species = GENE_PROTEIN_POSITIONS_DICT['Src']['species']
-    pragmas[0] = pragmas[0].str.replace("##species", "##species " + str(species))
-    # temporary pragma, subject to change
-    pragmas[0] = pragmas[0].str.replace("##sample-description", "##sample-description " + 'sample_desc=' + str(sample_desc) +';' + 'sample_group=' + str(sample_group) + ';')
+    gvf_pragmas = make_pragmas(species, sample_desc, sample_group)
+
+    # reuse HGVS names from previous runs
+    if args.hgvs_cache is not None:
+        load_hgvs_cache(args.hgvs_cache)
 
-    # combine pragmas, header, GVF contents
-    final_gvf = pd.DataFrame(np.vstack([gvf.columns, gvf]))
-    final_gvf = pragmas.append(final_gvf)
-    
-    # save GVF
     filepath = args.outgvf  # outdir + strain + ".annotated.gvf"
+    if args.streaming:
+        # create and save gvf chunk by chunk
+        vcftogvf_streaming(vcf_file, filepath, gvf_pragmas, strain,
+                           GENE_PROTEIN_POSITIONS_DICT, sample_size,
+                           args.clades_threshold, args.chunk_size,
+                           cds_index)
+    else:
+        # create gvf from annotated vcf (ignoring pragmas for now)
+        gvf = vcftogvf(vcf_file, strain, GENE_PROTEIN_POSITIONS_DICT,
+                       sample_size, args.clades_threshold,
+                       cds_index=cds_index)
+
+        # combine pragmas, header, GVF contents
+        final_gvf = pd.DataFrame(np.vstack([gvf.columns, gvf]))
+        final_gvf = gvf_pragmas.append(final_gvf)
+
+        # save GVF
+        final_gvf.to_csv(filepath, sep='\t', index=False, header=False)
+    if args.hgvs_cache is not None:
+        save_hgvs_cache(args.hgvs_cache)
     print("Saved as: ", filepath)
     print("")
-    final_gvf.to_csv(filepath, sep='\t', index=False, header=False)
 
     print("")
     print("Processing complete.")
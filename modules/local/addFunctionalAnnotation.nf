@@ -9,6 +9,7 @@ process FUNCTIONALANNOTATION {
   input:
       tuple val(meta), path(gvf)
       tuple val(meta2), path(tsv)
+      tuple val(meta3), path(index)
       
   output:
       tuple val(meta), path("*.gvf"), emit: gvf
@@ -22,7 +23,8 @@ process FUNCTIONALANNOTATION {
     addfunctions2gvf.py \\
       --ingvf $gvf \\
       --outgvf ${prefix}.annotated.gvf \\
-      --functional_annotations $tsv
+      --functional_annotations $tsv \\
+      --annotation_index $index
 
   """
 
@@ -8,7 +8,7 @@ process ANNOTATEMATPEPTIDES_NCOV {
 
   input:
       tuple val(meta), path(vcf)
-      tuple val(meta2), path(json)
+      tuple val(meta2), path(json), path(compiled)
 
   output:
       tuple val(meta), path("*annotated.vcf"), emit: vcf
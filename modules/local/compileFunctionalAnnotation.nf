@@ -0,0 +1,27 @@
+process COMPILEFUNCTIONALANNOTATION {
+
+  tag "$meta.id"
+
+  conda "bioconda::pandas=1.4.3"
+  container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
+        'https://depot.galaxyproject.org/singularity/pandas:1.4.3' : '' }"
+  
+  input:
+      tuple val(meta), path(tsv)
+      
+  output:
+      tuple val(meta), path("*.npz"), emit: index
+
+  script:
+
+  def args = task.ext.args ?: ''
+  def prefix = task.ext.prefix ?: "${meta.id}"
+
+  """
+    addfunctions2gvf.py \\
+      --functional_annotations $tsv \\
+      --annotation_index ${prefix}.index.npz
+
+  """
+
+}
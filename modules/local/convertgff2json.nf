@@ -17,6 +17,7 @@ process CONVERTGFFTOJSON {
     
     output:
         tuple val(meta), path("*.json"), emit: json
+        tuple val(meta), path("*.npz"), emit: compiled
 
     script:
         def prefix = task.ext.prefix ?: "${meta.id}"
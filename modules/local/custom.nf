@@ -137,7 +137,8 @@ process surveillanceRawTsv {
     gvf2tsv.py --gvf_files ${gvf} \
     --clades ${variants} \
     --table ${stats} \
-    --all_variants
+    --all_variants \
+    --jobs ${task.cpus}
 
     """
   }
@@ -0,0 +1,55 @@
+process GVF_PIPELINE {
+
+  tag "$meta.id"
+
+  conda "bioconda::pandas=1.4.3"
+  container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
+        'https://depot.galaxyproject.org/singularity/pandas:1.4.3' : '' }"
+
+  input:
+      tuple val(meta), path(vcf)
+      path stats
+      val threshold
+      tuple val(meta2), path(json), path(compiled)
+      val lineage
+      val wastewater
+      val sampledesc
+      path names_to_split
+      path functional_annotations
+      tuple val(meta3), path(clades)
+
+  output:
+      tuple val(meta), path("*.gvf"), emit: gvf
+
+  script:
+
+  def args = task.ext.args ?: ''
+  def prefix = task.ext.prefix ?: "${meta.id}"
+  def strain = lineage ? "--strain ${prefix}" : ''
+  def stat     = stats ? "--size_stats ${stats}" : ''
+  def wastewater = wastewater ? "--wastewater" : ''
+  def group =  "--sample_group ${meta.id}"
+  def hgvs_cache = params.hgvs_cache ? "--hgvs_cache ${params.hgvs_cache}" : ''
+  def split = names_to_split ? "--names_to_split ${names_to_split}" : ''
+  def functions = functional_annotations ? "--functional_annotations ${functional_annotations}" : ''
+
+
+  """
+    gvf_pipeline.py --vcffile $vcf \\
+      $stat \\
+      --clades_threshold $threshold \\
+      --gene_positions $json \\
+      $wastewater \\
+      $strain \\
+      --sample_desc $sampledesc \\
+      $group \\
+      $hgvs_cache \\
+      $split \\
+      $functions \\
+      --clades $clades \\
+      $args \\
+      --outgvf ${prefix}_annotated.gvf
+
+  """
+
+}
@@ -9,7 +9,7 @@ process GVF_TO_INDEX_LOG {
   
 
   input:
-      tuple val(meta), path(gvf)
+      tuple val(meta), path(gvf, stageAs: 'gvfs/*')
       
   output:
       tuple val(meta), path("*.tsv"), emit: index
@@ -24,7 +24,8 @@ process GVF_TO_INDEX_LOG {
 
   """
     gvf2indexandlog.py \\
-        --gvf_file ${gvf} \\
+        --gvf_files ${gvf} \\
+        --jobs ${task.cpus} \\
         --index_savefile ${prefix}.${end_date}.index.tsv \\
         --log_savefile ${prefix}.${end_date}.log 
 
@@ -24,6 +24,7 @@ process MERGE_INDICES {
   """
     merge_indices.py \\
         --gvf_indices ${index} \\
+        --presorted \\
         $last_index \\
         --index_savefile ${end_date}.index.tsv
 
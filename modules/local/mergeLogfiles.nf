@@ -22,12 +22,15 @@ process MERGE_LOGFILES {
     def prefix = task.ext.prefix ?: "${meta.id}"
     def end_date = "${params.end_date}"
     def last_index = index ? "--original_index ${index}" : ''
+    def keys_cache = index && params.index_keys_cache ? "--index_keys_cache ${params.index_keys_cache}" : ''
 
     """
         merge_logfiles.py \\
                 --log_header ${log_header} \\
-                --gvf_log ${logs} \\
+                --gvf_logs ${logs} \\
+                --presorted \\
                  $last_index \\
+                 $keys_cache \\
                 --log_savefile ${end_date}.log.tsv
     """
 
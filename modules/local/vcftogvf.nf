@@ -10,7 +10,7 @@ process VCFTOGVF {
       tuple val(meta), path(vcf)
       path stats
       val threshold
-      tuple val(meta2), path(json)
+      tuple val(meta2), path(json), path(compiled)
       val lineage
       val wastewater
       val sampledesc
@@ -26,6 +26,7 @@ process VCFTOGVF {
   def stat     = stats ? "--size_stats ${stats}" : ''
   def wastewater = wastewater ? "--wastewater" : ''
   def group =  "--sample_group ${meta.id}"
+  def hgvs_cache = params.hgvs_cache ? "--hgvs_cache ${params.hgvs_cache}" : ''
 
 
   """
@@ -37,6 +38,7 @@ process VCFTOGVF {
       $strain \\
       --sample_desc $sampledesc \\
       $group \\
+      $hgvs_cache \\
       $args \\
       --outgvf ${prefix}.gvf
 
@@ -53,7 +53,7 @@ workflow ANNOTATION {
         
         if (ch_json == []){
             json_file = file(params.genecoord, checkIfExists: true)
-            json = [ [ id:params.virus_accession_id ], [ json_file ] ]
+            json = [ [ id:params.virus_accession_id ], [ json_file ], [] ]
         }
         else{
             json = ch_json
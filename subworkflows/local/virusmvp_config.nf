@@ -31,7 +31,9 @@ workflow CONFIGURE_VIRUSMVP {
         }
 
         CONVERTGFFTOJSON(gff, color, alias)
-        ch_json = CONVERTGFFTOJSON.out.json
+        // the compiled gene positions (.npz) are staged next to the JSON,
+        // so each task reads them instead of rebuilding the lookups
+        ch_json = CONVERTGFFTOJSON.out.json.join(CONVERTGFFTOJSON.out.compiled)
         
         SNPEFF_BUILD (
                 params.viral_genome,
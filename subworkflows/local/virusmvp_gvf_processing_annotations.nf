@@ -7,6 +7,7 @@ nextflow.enable.dsl = 2
 include { NCOVSPLITMUTATIONSGVF                     } from '../../modules/local/splitmutations_gvf'
 include { NCOVSPLITMUTATIONSPOKAY             } from '../../modules/local/splitmutations_pokay'
 include { FUNCTIONALANNOTATION                  } from '../../modules/local/addFunctionalAnnotation'
+include { COMPILEFUNCTIONALANNOTATION           } from '../../modules/local/compileFunctionalAnnotation'
 include { VARIANTANNOTATION                  } from '../../modules/local/addVariantAnnotation'
 
 
@@ -37,9 +38,15 @@ workflow GVF_PROCESSING_ANNOTATION {
                 )
             }
             
+            // compile the annotations once, for every GVF's task
+            COMPILEFUNCTIONALANNOTATION(
+                NCOVSPLITMUTATIONSPOKAY.out.tsv
+            )
+
             FUNCTIONALANNOTATION(
                 NCOVSPLITMUTATIONSGVF.out.gvf,
-                NCOVSPLITMUTATIONSPOKAY.out.tsv
+                NCOVSPLITMUTATIONSPOKAY.out.tsv,
+                COMPILEFUNCTIONALANNOTATION.out.index
             )
             annotation_gvf=FUNCTIONALANNOTATION.out.gvf
             
@@ -14,7 +14,17 @@ workflow POSTPROCESSING {
         logheader
 
     main:
-        GVF_TO_INDEX_LOG(gvf)
+        // one index and one log per batch of GVFs; GVFs are batched in
+        // name order rather than the order their tasks finish in, so the
+        // batches are the same in every run
+        gvf
+                .map { it[1] }
+                .toSortedList { a, b -> a.name <=> b.name }
+                .flatMap()
+                .collate(params.gvf_batch_size)
+                .map { batch -> [ [id:"batch_${batch[0].baseName}"], batch ] }
+                .set { ch_gvf_batches }
+        GVF_TO_INDEX_LOG(ch_gvf_batches)
         ch_indexfile=Channel.empty()
         if (!params.mutation_indexfile) {
             ch_indexfile = [[],[]]
@@ -22,16 +32,20 @@ workflow POSTPROCESSING {
         else {
             ch_indexfile = [[id:params.virus_accession_id], file(params.mutation_indexfile, checkIfExists: true)]
         }
+        // each batch's index and log are merged and sorted by pos, so
+        // they are merged with a streaming merge (--presorted); the same
+        // batches are given in name order, so lineages are joined in the
+        // same order in every run
         GVF_TO_INDEX_LOG.out.index
                 .map { [it[1]] }
-                .collect()
+                .collect(sort: true)
                 .map { indices -> [ [id:"mergingindices"], indices ] }
                 .set { ch_indices}
         MERGE_INDICES(ch_indices, ch_indexfile)
         
         GVF_TO_INDEX_LOG.out.log
                 .map { [it[1]] }
-                .collect()
+                .collect(sort: true)
                 .map { logs -> [ [id:"merginglogfiles"], logs ] }
                 .set { ch_logs}
 
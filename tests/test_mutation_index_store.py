@@ -0,0 +1,52 @@
+"""
+Checks that a mutation index store reads the same rows after an
+interrupted compaction, and that appends never overwrite a segment.
+"""
+
+import os
+import sys
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+from mutation_index_store import MutationIndexStore, write_segment  # noqa
+
+
+def index_rows(lineage):
+    return pd.DataFrame({'pos': [10, 20, 30],
+                         'mutation': ['A10G', 'C20T', 'G30A'],
+                         'gene': ['S', 'S', 'N'],
+                         'lineages': lineage})
+
+
+def test_interrupted_compaction(tmp_path):
+    store = MutationIndexStore(str(tmp_path))
+    store.append(index_rows('L1'))
+    store.append(index_rows('L2'))
+    expected = store.read()
+    assert list(expected['lineages']) == ['L1,L2'] * 3
+    # the compacted segment is written, but the old ones are not removed
+    write_segment(str(tmp_path / "segment_000000-000001.npz"), expected)
+    assert store.read().equals(expected)
+    store.compact()
+    assert os.listdir(str(tmp_path)) == ["segment_000000-000001.npz"]
+    assert store.read().equals(expected)
+
+
+def test_append_skips_taken_segment_names(tmp_path):
+    store = MutationIndexStore(str(tmp_path))
+    store.append(index_rows('L1'))
+    # another process takes the next name after append has listed the
+    # segments
+    stale_segments = store.segment_files()
+    taken = tmp_path / "segment_000001.npz"
+    write_segment(str(taken), index_rows('L2'))
+    before = taken.read_bytes()
+    segment_files = store.segment_files
+    listings = [stale_segments]
+    store.segment_files = lambda: (listings.pop() if listings
+                                   else segment_files())
+    store.append(index_rows('L3'))
+    assert os.path.exists(str(tmp_path / "segment_000002.npz"))
+    assert taken.read_bytes() == before
+    assert list(store.read()['lineages']) == ['L1,L2,L3'] * 3
+    assert list(store.read(pos_range=(15, 30), genes={'N'})['pos']) == [30]
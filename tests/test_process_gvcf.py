@@ -0,0 +1,54 @@
+"""
+Checks that process_gvcf.py writes the same files with and without
+--columnar.
+"""
+
+import os
+import sys
+import subprocess
+import pytest
+
+bin_dir = os.path.join(os.path.dirname(__file__), "..", "bin")
+data_dir = os.path.join(os.path.dirname(__file__), "data")
+
+pytest.importorskip("pysam")
+
+
+def run_process_gvcf(gvcf, prefix, *args):
+    subprocess.run([sys.executable, os.path.join(bin_dir, "process_gvcf.py"),
+                    "-m", prefix + ".mask.txt",
+                    "-v", prefix + ".variants.vcf",
+                    "-c", prefix + ".consensus.vcf"] + list(args) + [gvcf],
+                   check=True, capture_output=True)
+
+
+def test_columnar_matches_record_by_record(tmp_path):
+    gvcf = os.path.join(data_dir, "small.gvcf")
+    run_process_gvcf(gvcf, str(tmp_path / "records"))
+    run_process_gvcf(gvcf, str(tmp_path / "columnar"), "--columnar")
+    for suffix in [".mask.txt", ".variants.vcf", ".consensus.vcf"]:
+        with open(str(tmp_path / "records") + suffix) as fp:
+            expected = fp.read()
+        with open(str(tmp_path / "columnar") + suffix) as fp:
+            assert fp.read() == expected, suffix
+
+
+def test_manifest_duplicate_sample_names(tmp_path):
+    # the same file name in two directories would write the same outputs
+    for name in ["a", "b"]:
+        os.makedirs(str(tmp_path / name))
+        with open(os.path.join(data_dir, "small.gvcf")) as fp:
+            (tmp_path / name / "sample.gvcf").write_text(fp.read())
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text("%s\n%s\n" % (tmp_path / "a" / "sample.gvcf",
+                                      tmp_path / "b" / "sample.gvcf"))
+    outdir = str(tmp_path / "out")
+    os.makedirs(outdir)
+    result = subprocess.run([sys.executable,
+                             os.path.join(bin_dir, "process_gvcf.py"),
+                             "--manifest", str(manifest),
+                             "--outdir", outdir],
+                            capture_output=True)
+    assert result.returncode != 0
+    assert b"same sample name" in result.stderr
+    assert os.listdir(outdir) == []
@@ -0,0 +1,60 @@
+"""
+Checks that vcf2gvf.py writes the same GVF with and without --streaming,
+on a VCF with multi-allelic records.
+"""
+
+import os
+import sys
+import subprocess
+import pytest
+
+bin_dir = os.path.join(os.path.dirname(__file__), "..", "bin")
+data_dir = os.path.join(os.path.dirname(__file__), "data")
+gene_positions = os.path.join(os.path.dirname(__file__), "..", "assets",
+                              "virus_geneCoordinates", "NC_045512.2",
+                              "NC_045512.2.json")
+
+pytest.importorskip("cyvcf2")
+
+
+def run_vcf2gvf(vcf, outgvf, *args):
+    subprocess.run([sys.executable, os.path.join(bin_dir, "vcf2gvf.py"),
+                    "--vcffile", vcf, "--sample_desc", "Clinical",
+                    "--sample_group", "BA.2", "--strain", "BA.2",
+                    "--gene_positions", gene_positions,
+                    "--outgvf", outgvf] + list(args),
+                   check=True, capture_output=True)
+
+
+def test_streaming_matches_default(tmp_path):
+    vcf = os.path.join(data_dir, "multiallelic.vcf")
+    default_gvf = str(tmp_path / "default.gvf")
+    run_vcf2gvf(vcf, default_gvf)
+    # small chunks, so multi-allelic records and names span chunks
+    streaming_gvf = str(tmp_path / "streaming.gvf")
+    run_vcf2gvf(vcf, streaming_gvf, "--streaming", "--chunk_size", "4")
+    with open(default_gvf) as fp:
+        expected = fp.read()
+    with open(streaming_gvf) as fp:
+        assert fp.read() == expected
+
+
+def test_streaming_mismatched_alleles(tmp_path):
+    # drop the second EFF record of a multi-allelic record
+    with open(os.path.join(data_dir, "multiallelic.vcf")) as fp:
+        lines = fp.readlines()
+    for i, line in enumerate(lines):
+        fields = line.split('\t')
+        if not line.startswith('#') and ',' in fields[4]:
+            info = fields[7].split(';')
+            info = [x.split('),')[0] + ')' if x.startswith('EFF=') else x
+                    for x in info]
+            fields[7] = ';'.join(info)
+            lines[i] = '\t'.join(fields)
+            break
+    vcf = str(tmp_path / "mismatched.vcf")
+    with open(vcf, "w") as fp:
+        fp.writelines(lines)
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        run_vcf2gvf(vcf, str(tmp_path / "streaming.gvf"), "--streaming")
+    assert b"EFF records" in error.value.stderr